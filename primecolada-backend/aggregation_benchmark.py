@@ -0,0 +1,108 @@
+# Benchmark of the server-side aggregation queries (aggregations.py).
+#
+# Seeds the in-memory backend with N ventas and, for each aggregation shape the
+# endpoints use, compares streaming every matching document and counting/summing
+# in Python against the count()/sum() aggregation queries (cold) and the cached
+# result. Reports Firestore reads (as billed: documents returned for queries,
+# one per 1000 index entries for aggregations) and latency, and exits with an
+# error if the aggregations don't give the streamed results.
+#
+#   python aggregation_benchmark.py --ventas 20000 --repeat 5
+
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+
+# Siempre contra el backend en memoria: nunca contra la base de datos real
+os.environ['FIRESTORE_BACKEND'] = 'memory'
+
+from benchmark import seed
+from db import db
+from enums import VentaState, NON_TERMINAL_STATES
+from aggregations import aggregation_cache, count_ventas_by_state, get_range_stats
+from query_planner import plan_venta_query, parse_moment
+
+def _stream(args, field_paths):
+    """Documents of the hot collection and the archive matching the listing filters."""
+    plan = plan_venta_query(args)
+    for collection in ('ventas', 'ventas_archive'):
+        for doc in plan.build(db.collection(collection)).select(field_paths).stream():
+            yield doc.to_dict()
+
+def streamed_counts(args):
+    counts = {state.value: 0 for state in VentaState}
+    for venta in _stream(args, ['estado_actual']):
+        counts[venta['estado_actual']] += 1
+    return counts
+
+def streamed_range_stats(args):
+    total_ventas = total_precio = 0
+    for venta in _stream(args, ['coste']):
+        total_ventas += 1
+        total_precio += (venta.get('coste') or {}).get('total') or 0
+    pedidos_antiguos = 0
+    if args.get('created_from'):
+        before = parse_moment('created_from', args['created_from']) - timedelta(microseconds=1)
+        older = plan_venta_query({'created_to': before.isoformat()})
+        for doc in older.build(db.collection('ventas')).select(['estado_actual']).stream():
+            pedidos_antiguos += doc.to_dict()['estado_actual'] in NON_TERMINAL_STATES
+    return {"total_precio": total_precio, "total_ventas": total_ventas, "pedidos_antiguos": pedidos_antiguos}
+
+def measure(repeat, fn, cold=True):
+    """Best wall time and Firestore reads of `repeat` runs of fn(), and its last result."""
+    best = float('inf')
+    reads = 0
+    result = None
+    for _ in range(repeat):
+        if cold:
+            aggregation_cache.clear()
+        before = db.stats['reads']
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+        reads = db.stats['reads'] - before
+    return best, reads, result
+
+def run(num_ventas, repeat, seed_value):
+    ids = seed(num_ventas, seed_value)
+    client_id = ids['registered_client_id']
+    days = sorted(doc.to_dict()['created_at'].date() for doc in db.collection('ventas').select(['created_at']).stream())
+    last_week = {'created_from': (days[-1] - timedelta(days=6)).isoformat(), 'created_to': days[-1].isoformat()}
+
+    cases = [
+        ('count by state', lambda: streamed_counts({}), lambda: count_ventas_by_state({})),
+        ('count, last week', lambda: streamed_counts(last_week), lambda: count_ventas_by_state(last_week)),
+        ('stats, last week', lambda: streamed_range_stats(last_week), lambda: get_range_stats(last_week)),
+        ('client stats', lambda: streamed_range_stats({'client_id': client_id}),
+         lambda: get_range_stats({'client_id': client_id})),
+    ]
+
+    results = []
+    for name, streamed, aggregated in cases:
+        stream_time, stream_reads, expected = measure(repeat, streamed)
+        cold_time, cold_reads, actual = measure(repeat, aggregated)
+        aggregated()
+        cached_time, cached_reads, _ = measure(repeat, aggregated, cold=False)
+        if actual != expected:
+            print(f"{name}: aggregation gave {actual}, streaming {expected}", file=sys.stderr)
+            sys.exit(1)
+        results.append((name, stream_reads, stream_time, cold_reads, cold_time, cached_reads, cached_time))
+    return results
+
+def print_report(num_ventas, results):
+    print(f"{num_ventas} ventas (in-memory backend; latency excludes network round trips)")
+    print(f"{'shape':<18} {'stream reads':>12} {'stream ms':>10} {'agg reads':>10} {'agg ms':>8} {'cached reads':>13} {'cached ms':>10}")
+    for name, stream_reads, stream_time, cold_reads, cold_time, cached_reads, cached_time in results:
+        print(f"{name:<18} {stream_reads:>12} {stream_time * 1000:>10.2f} {cold_reads:>10} {cold_time * 1000:>8.2f} "
+              f"{cached_reads:>13} {cached_time * 1000:>10.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare streaming counts/sums with Firestore aggregation queries.")
+    parser.add_argument('--ventas', type=int, default=20000, help="Number of ventas to seed.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (best is reported).")
+    parser.add_argument('--seed', type=int, default=42, help="Seed for the generated ventas.")
+    args = parser.parse_args()
+
+    print_report(args.ventas, run(args.ventas, args.repeat, args.seed))
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from db import db
+from enums import VentaState, NON_TERMINAL_STATES
+from archive import ARCHIVE_COLLECTION
+from query_planner import plan_venta_query, parse_moment
+
+# Agregaciones en servidor (count()/sum() de Firestore) para las preguntas que
+# los contadores materializados (counters.py) no responden: recuentos por
+# estado y totales de un rango de fechas o de un cliente en un rango. Se
+# factura una lectura por cada 1000 entradas de índice en lugar de una por
+# documento, y no se transfiere ningún documento. Como los contadores, cubren
+# también las ventas archivadas (solo en estados terminales). Los resultados
+# se guardan unos segundos en una caché por worker.
+AGGREGATION_CACHE_TTL = float(os.getenv('AGGREGATION_CACHE_TTL', 10))
+AGGREGATION_CACHE_MAX_ENTRIES = int(os.getenv('AGGREGATION_CACHE_MAX_ENTRIES', 512))
+
+class AggregationCache:
+    """Per-worker LRU of aggregation results, each kept for `ttl` seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached result, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+aggregation_cache = AggregationCache(AGGREGATION_CACHE_MAX_ENTRIES, AGGREGATION_CACHE_TTL)
+
+def _plan_key(plan):
+    return repr(plan.filters)
+
+def _aggregate_collection(collection, plan, sums, count):
+    query = plan.build(db.collection(collection), paged=True)
+    aggregation = None
+    if count:
+        aggregation = query.count(alias='count')
+    for index, field in enumerate(sums):
+        # Los alias de Firestore no admiten puntos: se usa la posición
+        aggregation = (aggregation or query).sum(field, alias=f'sum_{index}')
+    return {result.alias: result.value for result in aggregation.get()[0]}
+
+def aggregate(plan, sums=(), count=True, archived=True):
+    """
+    Run one aggregation query over the ventas matching a query plan.
+
+    The query keeps the plan's created_at ordering so it is served by the
+    same composite indexes as the listing (see firestore.indexes.json).
+
+    Args:
+        plan (VentaQueryPlan): Filters to aggregate over (see query_planner.py).
+        sums (iterable): Numeric field paths to sum (e.g. 'coste.total').
+        count (bool): Include the number of matching ventas as 'count'.
+        archived (bool): Also aggregate the archive (a second query).
+
+    Returns:
+        dict: {'count': int, <field path>: sum}, cached for AGGREGATION_CACHE_TTL seconds.
+    """
+    sums = tuple(sums)
+    key = ('aggregate', _plan_key(plan), sums, count, archived)
+    cached = aggregation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    collections = ('ventas', ARCHIVE_COLLECTION) if archived else ('ventas',)
+    result = {'count': 0} if count else {}
+    result.update((field, 0) for field in sums)
+    for collection in collections:
+        values = _aggregate_collection(collection, plan, sums, count)
+        if count:
+            result['count'] += values.get('count') or 0
+        for index, field in enumerate(sums):
+            result[field] += values.get(f'sum_{index}') or 0
+    aggregation_cache.put(key, result)
+    return result
+
+def count_ventas_by_state(args):
+    """
+    Count the ventas in each state matching the listing filters, one count()
+    per state.
+
+    Args:
+        args (Mapping): GET /ventas filters (client_id, created_from,
+            created_to; estado restricts the states counted).
+
+    Returns:
+        dict: {state value: count} with every VentaState present.
+
+    Raises:
+        UnsupportedQuery: If the filters can't be planned.
+    """
+    base_plan = plan_venta_query(args)
+    states = [state.value for state in VentaState]
+    estado_filter = next((value for field, _, value in base_plan.filters if field == 'estado_actual'), None)
+    if estado_filter is not None:
+        states = estado_filter if isinstance(estado_filter, list) else [estado_filter]
+
+    filters = {key: value for key, value in args.items() if key != 'estado'}
+    counts = {state.value: 0 for state in VentaState}
+    for state in states:
+        plan = plan_venta_query({**filters, 'estado': str(state)})
+        # El archivo solo guarda ventas en estados terminales
+        counts[state] = aggregate(plan, archived=state not in NON_TERMINAL_STATES)['count']
+    return counts
+
+def get_range_stats(args, include_older_open=True):
+    """
+    Sales statistics of a created_at range (optionally of one client), the
+    range counterpart of counters.get_daily_stats.
+
+    Args:
+        args (Mapping): client_id, created_from and created_to filters.
+        include_older_open (bool): Also count pedidos_antiguos (one more query).
+
+    Returns:
+        dict: total_precio and total_ventas of the ventas created in the
+        range, and pedidos_antiguos, the ventas created before it that are
+        still open.
+
+    Raises:
+        UnsupportedQuery: If the filters can't be planned.
+    """
+    totals = aggregate(plan_venta_query(args), sums=('coste.total',))
+    pedidos_antiguos = 0
+    if include_older_open and args.get('created_from'):
+        # Abiertos y creados antes del rango (created_at < created_from)
+        before = parse_moment('created_from', args['created_from']) - timedelta(microseconds=1)
+        older_args = {'estado': ','.join(str(state) for state in NON_TERMINAL_STATES), 'created_to': before.isoformat()}
+        if args.get('client_id'):
+            older_args['client_id'] = args['client_id']
+        pedidos_antiguos = aggregate(plan_venta_query(older_args), archived=False)['count']
+    return {
+        "total_precio": totals['coste.total'],
+        "total_ventas": totals['count'],
+        "pedidos_antiguos": pedidos_antiguos
+    }
@@ -1,16 +1,14 @@
 import os
 from flask import Flask, jsonify
-from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
-import firebase_admin
 import logging
 from flask_jwt_extended import JWTManager
 
-# Import routes and swagger spec
+# Import routes (Firestore and Firebase Admin are initialized on first use, see lazy.py)
 from routes import api
 from clients import clients_api
-from swagger_spec import get_swagger_spec
-import db  # Import the db module to initialize Firestore
+from instrumentation import init_instrumentation
+from serializers import FastJSONProvider
 
 # ... arriba del todo ...
 from auth_middleware import token_required 
@@ -18,33 +16,42 @@ from flask import g
 
 # Initialize Flask App
 app = Flask(__name__)
+# Respuestas JSON codificadas con orjson si está instalado (mismos bytes)
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # JWT Configuration
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key')  # Change this to a secure key
 jwt = JWTManager(app)
 
-if not firebase_admin._apps:
-    firebase_admin.initialize_app()
-
 # --- Swagger UI Configuration ---
+# Opcional (SWAGGER_UI_ENABLED=0 quita la UI y swagger.json); la especificación
+# se importa y genera al pedirla
+SWAGGER_UI_ENABLED = os.getenv('SWAGGER_UI_ENABLED', '1') == '1'
 SWAGGER_URL = '/api/docs'
 API_URL = '/static/swagger.json'
 
-swaggerui_blueprint = get_swaggerui_blueprint(
-    SWAGGER_URL,
-    API_URL,
-    config={'app_name': "Firestore Flask API"}
-)
+if SWAGGER_UI_ENABLED:
+    from flask_swagger_ui import get_swaggerui_blueprint
+
+    swaggerui_blueprint = get_swaggerui_blueprint(
+        SWAGGER_URL,
+        API_URL,
+        config={'app_name': "Firestore Flask API"}
+    )
+    app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
+
+    @app.route(API_URL)
+    def swagger_spec_json():
+        """Serve the swagger.json file."""
+        from swagger_spec import get_swagger_spec
+        return jsonify(get_swagger_spec())
 
-app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 app.register_blueprint(api)
 app.register_blueprint(clients_api)
 
-@app.route('/static/swagger.json')
-def swagger_spec_json():
-    """Serve the swagger.json file."""
-    return jsonify(get_swagger_spec())
+# Métricas por petición: cabecera Server-Timing, logs estructurados y /metrics
+init_instrumentation(app)
 
 
 @app.route('/test-auth', methods=['GET'])
@@ -0,0 +1,158 @@
+import os
+from datetime import datetime, timedelta, timezone
+from google.api_core import exceptions
+from db import db
+from enums import NON_TERMINAL_STATES
+
+# Archivo de ventas cerradas: las ventas en estado terminal (RECOGIDO, ERROR)
+# sin cambios desde hace ARCHIVE_AFTER_DAYS días se mueven de 'ventas' a
+# 'ventas_archive' en forma compacta. Los agregados (contadores por estado,
+# rollups diarios y del cliente) no cambian: la venta sigue contando.
+ARCHIVE_COLLECTION = 'ventas_archive'
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+# Cada venta archivada son 2 escrituras (create + delete) en el mismo commit
+ARCHIVE_CHUNK_SIZE = 250
+
+# Campos que se empaquetan; el resto de la venta se guarda tal cual
+PACKED_FIELDS = ('historial_estados', 'updated_at')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _as_utc(moment):
+    # Firestore guarda los datetime naive como UTC y los devuelve con tzinfo
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def _offset(moment, base):
+    """Microseconds from `base` to `moment` (None stays None)."""
+    if moment is None:
+        return None
+    delta = _as_utc(moment) - _as_utc(base)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _moment(offset, base):
+    return None if offset is None else base + timedelta(microseconds=offset)
+
+def pack_venta(venta):
+    """
+    Compact archive form of a venta document.
+
+    historial_estados becomes `transiciones`, a flat array of
+    [estado, entrada, salida, ...] with the timestamps as microsecond offsets
+    from created_at (the Unix epoch if the venta has none), and updated_at
+    becomes `updated_at_offset`. Offsets are exact, so unpack_venta gives the
+    original document back.
+    """
+    packed = {key: value for key, value in venta.items() if key not in PACKED_FIELDS}
+    base = venta.get('created_at') or _EPOCH
+
+    historial = venta.get('historial_estados')
+    if isinstance(historial, dict) and all(
+        estado.isdigit() and isinstance(entrada, dict) and set(entrada) <= {'entrada', 'salida'}
+        for estado, entrada in historial.items()
+    ):
+        packed['transiciones'] = [
+            value
+            for estado, entrada in historial.items()
+            for value in (int(estado), _offset(entrada.get('entrada'), base), _offset(entrada.get('salida'), base))
+        ]
+    elif 'historial_estados' in venta:
+        # Historial con un formato inesperado: se archiva sin empaquetar
+        packed['historial_estados'] = historial
+
+    if 'updated_at' in venta:
+        packed['updated_at_offset'] = _offset(venta['updated_at'], base)
+    return packed
+
+def unpack_venta(packed):
+    """Rebuild the venta document stored by pack_venta."""
+    venta = {key: value for key, value in packed.items() if key not in ('transiciones', 'updated_at_offset', 'archived_at')}
+    base = packed.get('created_at') or _EPOCH
+
+    transiciones = packed.get('transiciones')
+    if transiciones is not None:
+        venta['historial_estados'] = {
+            str(transiciones[i]): {
+                'entrada': _moment(transiciones[i + 1], base),
+                'salida': _moment(transiciones[i + 2], base)
+            }
+            for i in range(0, len(transiciones), 3)
+        }
+    if 'updated_at_offset' in packed:
+        venta['updated_at'] = _moment(packed['updated_at_offset'], base)
+    return venta
+
+def get_archived_venta(venta_id):
+    """
+    Look a venta up in the archive.
+
+    Returns:
+        dict | None: The unpacked venta (with 'id'), or None if it is not archived.
+    """
+    doc = db.collection(ARCHIVE_COLLECTION).document(venta_id).get()
+    if not doc.exists:
+        return None
+    venta = unpack_venta(doc.to_dict())
+    venta['id'] = doc.id
+    return venta
+
+def _archive_chunk(doc_refs, cutoff, now):
+    """
+    Move a chunk of ventas to the archive in one atomic commit.
+
+    The deletes carry a last-update-time precondition, so a venta edited
+    since it was read makes the commit fail and the chunk is left for the
+    next run. Returns the number of ventas archived.
+    """
+    batch = db.batch()
+    archived = 0
+    for snapshot in db.get_all(doc_refs):
+        if not snapshot.exists:
+            continue
+        venta = snapshot.to_dict()
+        updated_at = venta.get('updated_at')
+        if venta.get('estado_actual') in NON_TERMINAL_STATES or updated_at is None or _as_utc(updated_at) >= cutoff:
+            continue
+        batch.set(db.collection(ARCHIVE_COLLECTION).document(snapshot.id), {**pack_venta(venta), 'archived_at': now})
+        batch.delete(snapshot.reference, option=db.write_option(last_update_time=snapshot.update_time))
+        archived += 1
+
+    if not archived:
+        return 0
+    try:
+        batch.commit()
+    except (exceptions.FailedPrecondition, exceptions.Aborted):
+        return 0
+    return archived
+
+def archive_ventas(older_than_days=ARCHIVE_AFTER_DAYS, now=None):
+    """
+    Move terminal ventas not updated for `older_than_days` days to the archive.
+
+    No aggregate is touched: archived ventas keep counting in the per-state
+    counters, the daily rollups and the client aggregates (rebuild_aggregates
+    recounts both collections).
+
+    Returns:
+        dict: {"archived": int, "skipped": int} (skipped: changed while archiving).
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = _as_utc(now) - timedelta(days=older_than_days)
+
+    candidates = [
+        doc.reference
+        for doc in db.collection('ventas').where('updated_at', '<', cutoff).select(['estado_actual']).stream()
+        if doc.to_dict().get('estado_actual') not in NON_TERMINAL_STATES
+    ]
+
+    archived = 0
+    for start in range(0, len(candidates), ARCHIVE_CHUNK_SIZE):
+        archived += _archive_chunk(candidates[start:start + ARCHIVE_CHUNK_SIZE], cutoff, now)
+    return {"archived": archived, "skipped": len(candidates) - archived}
+
+if __name__ == "__main__":
+    if not db:
+        print("Firestore not initialized. Aborting archival.")
+    else:
+        print(f"Archiving terminal ventas older than {ARCHIVE_AFTER_DAYS} days...")
+        print(archive_ventas())
+        print("Archival finished.")
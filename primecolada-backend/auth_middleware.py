@@ -1,10 +1,189 @@
 # primecolada-backend/auth_middleware.py
 
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from flask import request, jsonify, g
-import firebase_admin
-from firebase_admin import auth
 from db import db  # <--- Importamos la DB
+from lazy import LazyProxy
+from uid_index import lookup_client_id_by_uid
+
+def _init_firebase_auth():
+    """Initialize the Firebase Admin app and return its auth module."""
+    import firebase_admin
+    from firebase_admin import auth as firebase_auth
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app()
+    return firebase_auth
+
+# Firebase Admin se importa e inicializa con el primer token que hay que
+# verificar (no al arrancar): las peticiones públicas no lo necesitan
+auth = LazyProxy(_init_firebase_auth)
+
+class TokenCache:
+    """
+    Per-worker LRU cache of verified ID tokens.
+
+    Entries are keyed by the SHA-256 of the raw token and expire after `ttl`
+    seconds or at the token's own `exp`, whichever comes first. Only the
+    verification is cached: the admin role comes from admin_roster, which
+    every worker keeps current.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        """Return the decoded token, or None on a miss."""
+        key = self.key_for(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, decoded_token = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decoded_token
+
+    def put(self, token, decoded_token):
+        expires_at = min(time.time() + self.ttl, decoded_token.get('exp', float('inf')))
+        key = self.key_for(token)
+        with self._lock:
+            self._entries[key] = (expires_at, decoded_token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+token_cache = TokenCache(
+    max_entries=int(os.getenv('AUTH_CACHE_MAX_ENTRIES', 1024)),
+    ttl=int(os.getenv('AUTH_CACHE_TTL', 300))
+)
+
+# Rol de admin: cada worker sigue con un listener on_snapshot a los clientes
+# con admin == True. Una concesión o revocación (desde la API, otro worker o
+# la consola de Firestore) llega a todos los workers en lo que tarda el
+# listener (normalmente menos de un segundo), sin caché que expirar.
+ADMIN_LISTENER_ENABLED = os.getenv('ADMIN_LISTENER_ENABLED', '1') not in ('0', 'false', 'False')
+
+class AdminRoster:
+    """
+    Per-worker set of the Firebase UIDs of admin clients, fed by an
+    on_snapshot listener on clients where admin == True.
+
+    The listener starts lazily on first use and is restarted if it dies.
+    Until it has delivered a snapshot, is_admin() returns None and callers
+    read the role from Firestore (resolve_is_admin) on every request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._watch = None
+        self._uids = None
+        self.restarts = 0
+        self.fallbacks = 0
+
+    def ensure_started(self):
+        """Start (or restart) the listener if it is missing or dead."""
+        if not ADMIN_LISTENER_ENABLED or not db:
+            return
+        if self._watch is not None and self._watch.is_active:
+            return
+        with self._start_lock:
+            if self._watch is not None and self._watch.is_active:
+                return
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self.restarts += 1
+            with self._lock:
+                # Sin listener vivo el conjunto puede estar desfasado
+                self._uids = None
+            try:
+                self._watch = db.collection('clients').where('admin', '==', True).on_snapshot(self._on_snapshot)
+            except Exception as e:
+                self._watch = None
+                logging.error(f"Admin roster: could not start the listener: {e}")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        uids = {doc.to_dict().get('firebase_uid') for doc in docs}
+        uids.discard(None)
+        with self._lock:
+            self._uids = uids
+
+    def is_admin(self, firebase_uid):
+        """True/False from the listener, or None if it has not synced yet."""
+        self.ensure_started()
+        with self._lock:
+            if self._uids is None:
+                self.fallbacks += 1
+                return None
+            return firebase_uid in self._uids
+
+    def stop(self):
+        with self._start_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = None
+            with self._lock:
+                self._uids = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'listening': self._watch is not None and self._watch.is_active,
+                'synced': self._uids is not None,
+                'admins': len(self._uids) if self._uids is not None else None,
+                'restarts': self.restarts,
+                'fallbacks': self.fallbacks
+            }
+
+admin_roster = AdminRoster()
+
+def resolve_is_admin(firebase_uid):
+    """Read the 'admin' flag of the client profile linked to a Firebase UID."""
+    if not db:
+        return False
+    # Perfil vinculado por uid_index (ver uid_index.py; backfill con python uid_index.py)
+    client_id = lookup_client_id_by_uid(firebase_uid)
+    if client_id is None:
+        return False
+    client = db.collection('clients').document(client_id).get()
+    return bool(client.exists and client.to_dict().get('admin', False))
 
 def token_required(f):
     @wraps(f)
@@ -20,20 +199,21 @@ def token_required(f):
         token = parts[1]
 
         try:
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = token_cache.get(token)
+            if not decoded_token:
+                decoded_token = auth.verify_id_token(token)
+                token_cache.put(token, decoded_token)
+
+            # --- Rol de admin: del listener, o de Firestore si aún no está listo ---
+            is_admin = admin_roster.is_admin(decoded_token['uid'])
+            if is_admin is None:
+                is_admin = resolve_is_admin(decoded_token['uid'])
+
             g.user_id = decoded_token['uid']
-            
-            # --- NUEVA LÓGICA: Consultar rol en Firestore ---
-            # Esto valida contra tu "colección extra"
-            g.is_admin = False
-            if db:
-                user_query = db.collection('clients').where('firebase_uid', '==', g.user_id).limit(1).get()
-                if user_query:
-                    g.is_admin = user_query[0].to_dict().get('admin', False)
-            # -----------------------------------------------
+            g.is_admin = is_admin
 
         except Exception as e:
             return jsonify({'error': f'Authentication failed: {str(e)}'}), 401
 
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
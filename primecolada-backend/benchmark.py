@@ -0,0 +1,237 @@
+# Offline load/benchmark suite.
+#
+# Seeds the in-memory Firestore backend (memory_firestore.py) with N ventas and
+# measures p50/p99 latency, throughput and Firestore reads/writes per request
+# for every endpoint through the Flask test client. No network or credentials
+# are needed, so it can run in CI before deploying:
+#
+#   python benchmark.py --ventas 5000 --requests 200 --output bench.json
+#   python benchmark.py --ventas 5000 --baseline bench.json --tolerance 0.25
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# Siempre contra el backend en memoria: nunca contra la base de datos real
+os.environ['FIRESTORE_BACKEND'] = 'memory'
+# Todas las peticiones salen de la misma IP: sin límite de peticiones
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import auth_middleware
+from app import app
+from counters import rebuild_aggregates
+from db import db
+from phone_index import index_phone
+from uid_index import index_uid
+from populate_db import create_random_ventas
+
+ADMIN_TOKEN = 'bench-admin'
+USER_TOKEN = 'bench-user'
+
+def fake_verify_id_token(token):
+    """Accept any token offline: the token itself is the Firebase UID."""
+    return {'uid': token, 'exp': time.time() + 3600}
+
+def seed(num_ventas, seed_value):
+    """
+    Load `num_ventas` random ventas (plus their clients and phone index) into
+    the in-memory backend and rebuild the aggregates.
+
+    Returns:
+        dict: IDs the endpoint scenarios need (venta_ids, client_ids).
+    """
+    db.reset()
+    ventas = create_random_ventas(num_ventas, seed=seed_value)
+
+    batch = db.batch()
+    client_ids = {}
+    venta_ids = []
+    for venta in ventas:
+        telefono = venta['telefono']
+        if telefono not in client_ids:
+            client_ref = db.collection('clients').document()
+            client_ids[telefono] = client_ref.id
+            batch.set(client_ref, {
+                'nombre': venta['nombre'],
+                'telefono': str(telefono),
+                'firebase_uid': None,
+                'created_at': venta['created_at']
+            })
+            index_phone(batch, telefono, client_ref.id)
+        venta_ref = db.collection('ventas').document()
+        venta_ids.append(venta_ref.id)
+        batch.set(venta_ref, {**venta, 'telefono': str(telefono), 'client_id': client_ids[telefono]})
+        if len(batch) >= 450:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+    # Admin que lanza las peticiones autenticadas
+    batch = db.batch()
+    batch.set(db.collection('clients').document('bench-admin-client'), {
+        'nombre': 'Bench Admin',
+        'telefono': '+34000000000',
+        'firebase_uid': ADMIN_TOKEN,
+        'admin': True
+    })
+    index_uid(batch, ADMIN_TOKEN, 'bench-admin-client')
+    batch.commit()
+    # Cliente registrado para los endpoints de cliente
+    registered_id = next(iter(client_ids.values()))
+    batch = db.batch()
+    batch.update(db.collection('clients').document(registered_id), {'firebase_uid': USER_TOKEN})
+    index_uid(batch, USER_TOKEN, registered_id)
+    batch.commit()
+
+    rebuild_aggregates()
+    return {
+        'venta_ids': venta_ids,
+        'client_ids': list(client_ids.values()),
+        'registered_client_id': registered_id
+    }
+
+def scenarios(ids):
+    """
+    Endpoint scenarios as (name, method, url(i), json(i), token).
+    `i` is the request number, used to spread requests across documents.
+    """
+    venta_ids, client_ids = ids['venta_ids'], ids['client_ids']
+    pick = lambda items, i: items[(i * 7919) % len(items)]
+    new_venta = lambda i: {
+        'nombre': f'Bench {i}',
+        'telefono': str(610000000 + i),
+        'coste': {'lavadora': 8, 'secadora': 5, 'total': 13}
+    }
+    return [
+        ('GET /user/profile', 'GET', lambda i: '/user/profile', None, ADMIN_TOKEN),
+        ('GET /ventas (full)', 'GET', lambda i: '/ventas', None, ADMIN_TOKEN),
+        ('GET /ventas?limit=50', 'GET', lambda i: '/ventas?limit=50&fields=nombre,telefono,estado_actual,coste,created_at', None, ADMIN_TOKEN),
+        ('GET /ventas?client_id', 'GET', lambda i: f'/ventas?client_id={pick(client_ids, i)}', None, ADMIN_TOKEN),
+        ('GET /ventas?stream=ndjson', 'GET', lambda i: '/ventas?stream=ndjson', None, ADMIN_TOKEN),
+        ('GET /ventas/count', 'GET', lambda i: '/ventas/count', None, ADMIN_TOKEN),
+        ('GET /ventas/stats', 'GET', lambda i: '/ventas/stats', None, ADMIN_TOKEN),
+        ('GET /ventas/<id>', 'GET', lambda i: f'/ventas/{pick(venta_ids, i)}', None, ADMIN_TOKEN),
+        ('GET /public/ventas/<id>', 'GET', lambda i: f'/public/ventas/{pick(venta_ids, i)}', None, None),
+        ('GET /clients', 'GET', lambda i: '/clients', None, None),
+        ('POST /ventas', 'POST', lambda i: '/ventas', new_venta, ADMIN_TOKEN),
+        ('POST /ventas/batch (20)', 'POST', lambda i: '/ventas/batch',
+            lambda i: [new_venta(i * 20 + j) for j in range(20)], ADMIN_TOKEN),
+        ('PUT /ventas/<id>', 'PUT', lambda i: f'/ventas/{pick(venta_ids, i)}',
+            lambda i: {'estado_actual': 1 + i % 3}, ADMIN_TOKEN),
+        ('POST /ventas/transition (10)', 'POST', lambda i: '/ventas/transition',
+            lambda i: {'ids': [pick(venta_ids, i * 10 + j) for j in range(10)], 'estado_actual': 1 + i % 3}, ADMIN_TOKEN),
+        ('POST /clients/login', 'POST', lambda i: '/clients/login', lambda i: {}, USER_TOKEN),
+        ('GET /clients/<id>/stats', 'GET', lambda i: f"/clients/{ids['registered_client_id']}/stats", None, USER_TOKEN),
+        ('GET /clients/<id>/stats?range', 'GET',
+            lambda i: f"/clients/{ids['registered_client_id']}/stats?created_from=2020-01-01&created_to=2100-01-01", None, USER_TOKEN),
+    ]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run(num_ventas, num_requests, seed_value, only=None):
+    """Seed the backend and benchmark every scenario. Returns the results dict."""
+    auth_middleware.auth.verify_id_token = fake_verify_id_token
+    app.config['JWT_SECRET_KEY'] = 'offline-benchmark-secret-key-0123456789'
+    app.logger.disabled = True
+
+    started = time.perf_counter()
+    ids = seed(num_ventas, seed_value)
+    seed_seconds = time.perf_counter() - started
+
+    client = app.test_client()
+    results = {}
+    for name, method, url, body, token in scenarios(ids):
+        if only and only not in name:
+            continue
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        # Calentamiento (caché de tokens, imports perezosos...)
+        client.open(url(0), method=method, json=body(0) if body else None, headers=headers).get_data()
+
+        stats_before = dict(db.stats)
+        latencies = []
+        errors = 0
+        for i in range(1, num_requests + 1):
+            request_started = time.perf_counter()
+            response = client.open(url(i), method=method, json=body(i) if body else None, headers=headers)
+            response.get_data()
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+        latencies.sort()
+        total_seconds = sum(latencies) / 1000
+        results[name] = {
+            'requests': num_requests,
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'throughput_rps': round(num_requests / total_seconds, 1) if total_seconds else None,
+            'reads_per_request': round((db.stats['reads'] - stats_before['reads']) / num_requests, 2),
+            'writes_per_request': round((db.stats['writes'] - stats_before['writes']) / num_requests, 2)
+        }
+
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'ventas': num_ventas,
+        'requests_per_endpoint': num_requests,
+        'seed': seed_value,
+        'seed_seconds': round(seed_seconds, 2),
+        'endpoints': results
+    }
+
+def print_report(report):
+    print(f"\n{report['ventas']} ventas seeded in {report['seed_seconds']}s, "
+          f"{report['requests_per_endpoint']} requests per endpoint\n")
+    header = f"{'endpoint':32} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'reads':>8} {'writes':>8} {'errors':>7}"
+    print(header)
+    print('-' * len(header))
+    for name, result in report['endpoints'].items():
+        print(f"{name:32} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['throughput_rps'] or 0:>9.1f} "
+              f"{result['reads_per_request']:>8.2f} {result['writes_per_request']:>8.2f} {result['errors']:>7}")
+
+def compare(report, baseline, tolerance):
+    """Return the endpoints whose p99 or reads per request regressed beyond `tolerance`."""
+    regressions = []
+    for name, result in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p99_ms', 'reads_per_request'):
+            if previous[metric] and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {result[metric]}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline endpoint benchmark on the in-memory Firestore backend.")
+    parser.add_argument('--ventas', type=int, default=2000, help="ventas to seed")
+    parser.add_argument('--requests', type=int, default=100, help="timed requests per endpoint")
+    parser.add_argument('--seed', type=int, default=42, help="random seed for the generated data")
+    parser.add_argument('--only', help="only run endpoints whose name contains this text")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="previous JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed regression ratio vs the baseline")
+    args = parser.parse_args()
+
+    report = run(args.ventas, args.requests, args.seed, only=args.only)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
@@ -1,15 +1,272 @@
+from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify, g
+from google.api_core import exceptions
 from google.cloud import firestore
-from db import db
-from flask_jwt_extended import create_access_token, get_jwt
+from db import db, lazy_collection
+from flask_jwt_extended import create_access_token
 from auth_middleware import token_required
-from models import client_schema
+from serializers import client_serializer
+from streaming import requested_stream_format, stream_query
 import logging
-from utils import merge_shadow_user
+from phone_index import lookup_client_id, index_phone, unindex_phone, phone_index_ref, normalize_phone, legacy_phone_forms, PhoneConflictError
+from uid_index import lookup_client_id_by_uid, index_uid, unindex_uid, uid_index_ref
+from counters import CLIENT_SNAPSHOT_FIELDS
+from archive import ARCHIVE_COLLECTION
+from rate_limit import rate_limited, LOGIN_RATE_LIMIT_PER_MINUTE, LOGIN_RATE_LIMIT_BURST
+from aggregations import get_range_stats
+from query_planner import UnsupportedQuery
 
 clients_api = Blueprint('clients_api', __name__)
 
-clients_collection = db.collection('clients') if db else None
+clients_collection = lazy_collection('clients')
+
+# Campos que puede editar el propio cliente (PUT /clients/<id>) y los que
+# además puede cambiar un admin; el resto (firebase_uid, agregados...) los
+# mantienen el login y las escrituras de ventas
+CLIENT_EDITABLE_FIELDS = ('nombre', 'telefono')
+CLIENT_ADMIN_EDITABLE_FIELDS = ('admin',)
+# Ventas por commit al copiar nombre/teléfono (límite de escrituras de Firestore)
+SNAPSHOT_CHUNK_SIZE = 500
+
+def _is_own_client(client_id):
+    """Whether client_id is the profile of the authenticated user."""
+    # Los perfiles creados en el login o reclamados tienen ID propio: uid_index
+    return client_id == g.user_id or lookup_client_id_by_uid(g.user_id) == client_id
+
+def _validate_client_changes(data):
+    """
+    Check a PUT /clients/<id> payload.
+
+    Returns:
+        dict | None: Validation errors by field, or None if the payload is valid.
+    """
+    editable = CLIENT_EDITABLE_FIELDS + (CLIENT_ADMIN_EDITABLE_FIELDS if g.is_admin else ())
+    errors = {field: ["Field is not editable."] for field in data if field not in editable}
+    if 'nombre' in data and (not isinstance(data['nombre'], str) or not data['nombre'].strip()):
+        errors['nombre'] = ["Must be a non-empty string."]
+    if data.get('telefono') is not None:
+        try:
+            normalize_phone(data['telefono'])
+        except ValueError as e:
+            errors['telefono'] = [str(e)]
+    if 'admin' in data and not isinstance(data['admin'], bool):
+        errors['admin'] = ["Must be a boolean."]
+    return errors or None
+
+@firestore.transactional
+def _update_client_txn(transaction, doc_ref, data):
+    """
+    Update a client and its phone index entry. Returns the client data
+    before the update, or None if missing. The copy stored on its ventas is
+    refreshed afterwards (refresh_client_snapshot).
+    """
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return None
+
+    previous = doc.to_dict()
+
+    # Cambio de teléfono: el nuevo número no puede pertenecer a otro cliente
+    old_phone, new_phone = previous.get('telefono'), data.get('telefono')
+    phone_changed = 'telefono' in data and new_phone != old_phone
+    old_phone_indexed = False
+    if phone_changed:
+        if new_phone:
+            owner = lookup_client_id(new_phone, transaction=transaction)
+            if owner and owner != doc_ref.id:
+                raise PhoneConflictError(f"Phone {new_phone} already belongs to client {owner}")
+        if old_phone:
+            old_phone_indexed = lookup_client_id(old_phone, transaction=transaction) == doc_ref.id
+
+    transaction.update(doc_ref, data)
+    if phone_changed:
+        if old_phone_indexed:
+            unindex_phone(transaction, old_phone)
+        if new_phone:
+            index_phone(transaction, new_phone, doc_ref.id)
+    return previous
+
+def refresh_client_snapshot(client_id):
+    """
+    Copy the client's current nombre/telefono onto each of its ventas, hot
+    and archived, in WriteBatch commits of SNAPSHOT_CHUNK_SIZE ventas.
+
+    Runs outside the client transaction, so the number of ventas is not
+    bounded by a single commit. The values are read from the stored client,
+    so a repeated or concurrent refresh converges to the latest edit.
+
+    Returns:
+        int: Ventas updated, or None if the client does not exist.
+    """
+    client = db.collection('clients').document(client_id).get()
+    if not client.exists:
+        return None
+    stored = client.to_dict()
+    snapshot = {field: stored.get(field) for field in CLIENT_SNAPSHOT_FIELDS}
+
+    updated = 0
+    for collection in ('ventas', ARCHIVE_COLLECTION):
+        refs = [doc.reference for doc in db.collection(collection).where('client_id', '==', client_id).select([]).stream()]
+        for start in range(0, len(refs), SNAPSHOT_CHUNK_SIZE):
+            chunk = refs[start:start + SNAPSHOT_CHUNK_SIZE]
+            batch = db.batch()
+            for ref in chunk:
+                batch.update(ref, snapshot)
+            try:
+                batch.commit()
+                updated += len(chunk)
+            except exceptions.NotFound:
+                # Una venta borrada entre la consulta y el commit: una a una
+                for ref in chunk:
+                    try:
+                        ref.update(snapshot)
+                        updated += 1
+                    except exceptions.NotFound:
+                        continue
+    return updated
+
+@firestore.transactional
+def _create_client_txn(transaction, doc_ref, data):
+    """Create a client and index its phone. Returns False if it already exists."""
+    if doc_ref.get(transaction=transaction).exists:
+        return False
+    telefono = data.get('telefono')
+    if telefono:
+        owner = lookup_client_id(telefono, transaction=transaction)
+        if owner and owner != doc_ref.id:
+            raise PhoneConflictError(f"Phone {telefono} already belongs to client {owner}")
+
+    transaction.set(doc_ref, data)
+    if telefono:
+        index_phone(transaction, telefono, doc_ref.id)
+    return True
+
+@firestore.transactional
+def _delete_client_txn(transaction, doc_ref):
+    """Delete a client and its phone and UID index entries. Returns its data, or None if missing."""
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return None
+    client = doc.to_dict()
+    telefono = client.get('telefono')
+    phone_indexed = bool(telefono) and lookup_client_id(telefono, transaction=transaction) == doc_ref.id
+    firebase_uid = client.get('firebase_uid')
+    uid_indexed = bool(firebase_uid) and lookup_client_id_by_uid(firebase_uid, transaction=transaction) == doc_ref.id
+
+    transaction.delete(doc_ref)
+    if phone_indexed:
+        unindex_phone(transaction, telefono)
+    if uid_indexed:
+        unindex_uid(transaction, firebase_uid)
+    return client
+
+def _login_lookup(transaction, index_snapshot, legacy_query):
+    """Client ID an index entry points at, or the first legacy match (pre-index profiles)."""
+    if index_snapshot is not None and index_snapshot.exists:
+        return index_snapshot.to_dict().get('client_id'), True
+    legacy = list(transaction.get(legacy_query.limit(1)))
+    return (legacy[0].id if legacy else None), False
+
+@firestore.transactional
+def _login_txn(transaction, uid, telefono, nombre, now):
+    """
+    Resolve, claim or create the profile of a Firebase user in one transaction.
+
+    Reads the uid and phone index entries with one get_all and then the
+    profiles they point at with another; every write (claim, index entries,
+    cleanup of a superseded empty profile, new profile) commits atomically.
+
+    Returns:
+        tuple: (client ID, client data) or (None, None) if the phone belongs
+        to another user and the caller has no profile of its own.
+    """
+    refs = [uid_index_ref(uid)] + ([phone_index_ref(telefono)] if telefono else [])
+    index_snaps = {snap.reference.path: snap for snap in transaction.get_all(refs)}
+
+    uid_client_id, uid_indexed = _login_lookup(
+        transaction, index_snaps.get(refs[0].path), clients_collection.where('firebase_uid', '==', uid)
+    )
+    phone_client_id = None
+    if telefono:
+        phone_client_id, _ = _login_lookup(
+            transaction, index_snaps.get(refs[1].path), clients_collection.where('telefono', 'in', legacy_phone_forms(telefono))
+        )
+
+    client_ids = [client_id for client_id in dict.fromkeys([uid_client_id, phone_client_id]) if client_id]
+    profiles = {
+        snap.id: snap for snap in transaction.get_all([clients_collection.document(client_id) for client_id in client_ids])
+        if snap.exists
+    }
+    own = profiles.get(uid_client_id)
+    if uid_indexed and (own is None or own.to_dict().get('firebase_uid') != uid):
+        # Entrada obsoleta (perfil borrado o fusionado fuera de este flujo)
+        legacy = list(transaction.get(clients_collection.where('firebase_uid', '==', uid).limit(1)))
+        own = legacy[0] if legacy else None
+        uid_client_id, uid_indexed = (own.id if own else None), False
+    shadow = profiles.get(phone_client_id)
+
+    phone_taken = False
+    if shadow is not None and shadow.to_dict().get('firebase_uid') not in (None, uid):
+        logging.warning(f"SECURITY ALERT: User {uid} attempted to claim phone number {telefono} already owned by {shadow.to_dict().get('firebase_uid')}.")
+        if own is None:
+            return None, None
+        shadow, phone_taken = None, True
+
+    # Perfil propio vacío reemplazado por el reclamado: su teléfono se desindexa
+    # si apunta a él (última lectura, antes de cualquier escritura)
+    superseded = own if shadow is not None and own is not None and own.id != shadow.id else None
+    unindex_superseded_phone = False
+    if superseded is not None and not superseded.to_dict().get('total_ventas'):
+        old_phone = superseded.to_dict().get('telefono')
+        unindex_superseded_phone = bool(old_phone) and lookup_client_id(old_phone, transaction=transaction) == superseded.id
+
+    if shadow is not None:
+        # Reclamación del perfil sombra (o re-login con el mismo teléfono)
+        client_id = shadow.id
+        client_data = shadow.to_dict()
+        if not client_data.get('firebase_uid'):
+            claim = {'firebase_uid': uid, 'updated_at': now}
+            transaction.update(shadow.reference, claim)
+            client_data.update(claim)
+            logging.info(f"MERGE SUCCESS: User {uid} claimed Shadow profile {client_id}")
+        if not index_snaps[refs[1].path].exists:
+            index_phone(transaction, telefono, client_id)
+
+        if superseded is not None:
+            if superseded.to_dict().get('total_ventas'):
+                # Perfil con ventas: no se borra, vuelve a ser un perfil sombra
+                transaction.update(superseded.reference, {'firebase_uid': None, 'updated_at': now})
+            else:
+                logging.info(f"CLEANUP: Deleting obsolete empty profile {superseded.id} after successful claim.")
+                transaction.delete(superseded.reference)
+                if unindex_superseded_phone:
+                    unindex_phone(transaction, superseded.to_dict()['telefono'])
+    elif own is not None:
+        client_id = own.id
+        client_data = own.to_dict()
+        if telefono and not phone_taken and not client_data.get('telefono'):
+            # Teléfono sin perfil y perfil sin teléfono: se vincula
+            transaction.update(own.reference, {'telefono': str(telefono), 'updated_at': now})
+            client_data.update({'telefono': str(telefono), 'updated_at': now})
+            index_phone(transaction, telefono, client_id)
+    else:
+        new_ref = clients_collection.document()
+        client_id = new_ref.id
+        client_data = {
+            'firebase_uid': uid,
+            'nombre': nombre,
+            'created_at': now
+        }
+        if telefono:
+            client_data['telefono'] = str(telefono)
+        transaction.set(new_ref, client_data)
+        if telefono:
+            index_phone(transaction, telefono, client_id)
+        logging.info(f"NEW USER: Created profile {client_id} for {uid}")
+
+    if not uid_indexed or uid_client_id != client_id:
+        index_uid(transaction, uid, client_id)
+    return client_id, client_data
 
 @clients_api.route('/clients', methods=['POST'])
 @token_required
@@ -26,20 +283,26 @@ def create_client():
         data = request.get_json()
         if not data or 'nombre' not in data:
             return jsonify({"error": "Missing nombre"}), 400
+        if data.get('telefono'):
+            try:
+                normalize_phone(data['telefono'])
+            except ValueError as e:
+                return jsonify({"telefono": [str(e)]}), 400
         
         client_id = g.user_id  # Use Firebase UID as client ID
         
-        # Check if client already exists
+        # Check if client already exists (and the phone is free) while creating it
         doc_ref = clients_collection.document(client_id)
-        if doc_ref.get().exists:
-            return jsonify({"error": "Client already exists"}), 409
-
-        doc_ref.set({
+        created = _create_client_txn(db.transaction(), doc_ref, {
             'nombre': data['nombre'],
             'telefono': data.get('telefono'),  # Optional
             'created_at': firestore.SERVER_TIMESTAMP
         })
+        if not created:
+            return jsonify({"error": "Client already exists"}), 409
         return jsonify({"id": client_id}), 201
+    except PhoneConflictError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         logging.error(f"Error creating client: {e}")
         return jsonify({"error": str(e)}), 500
@@ -48,6 +311,9 @@ def create_client():
 def get_clients():
     """
     Get all clients from Firestore.
+
+    `?stream=json` / `?stream=ndjson` streams the clients through the compiled ClientSchema
+    instead of building the whole list in memory.
     """
     if not clients_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
@@ -55,6 +321,10 @@ def get_clients():
         # Only admins can get all clients
         #if not get_jwt().get('is_admin', False):
         #    return jsonify({"error": "Admin required"}), 403
+
+        stream_format = requested_stream_format()
+        if stream_format:
+            return stream_query(clients_collection, client_serializer, stream_format)
         
         all_clients = []
         for doc in clients_collection.stream():
@@ -66,6 +336,7 @@ def get_clients():
         return jsonify({"error": str(e)}), 500
 
 @clients_api.route('/clients/<string:client_id>', methods=['GET'])
+@token_required
 def get_client(client_id):
     """
     Get a single client by their ID (Firebase UID).
@@ -74,7 +345,7 @@ def get_client(client_id):
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         # For non-admin, only allow access to own data
-        if client_id != g.user_id and not get_jwt().get('is_admin', False):
+        if not g.is_admin and not _is_own_client(client_id):
             return jsonify({"error": "Unauthorized"}), 403
         
         doc_ref = clients_collection.document(client_id)
@@ -87,28 +358,43 @@ def get_client(client_id):
         return jsonify({"error": str(e)}), 500
 
 @clients_api.route('/clients/<string:client_id>', methods=['PUT'])
+@token_required
 def update_client(client_id):
     """
     Update a client's information.
+
+    The owner can change nombre and telefono (copied to the client's ventas);
+    admins can also grant or revoke 'admin'. Any other field is rejected.
     """
     if not clients_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         # For non-admin, only allow updating own data
-        if client_id != g.user_id and not get_jwt().get('is_admin', False):
+        if not g.is_admin and not _is_own_client(client_id):
             return jsonify({"error": "Unauthorized"}), 403
         
-        data = request.get_json()
+        data = request.get_json() or {}
+        if not isinstance(data, dict) or not data:
+            return jsonify({"error": "No editable fields"}), 400
+        errors = _validate_client_changes(data)
+        if errors:
+            return jsonify(errors), 400
+
         doc_ref = clients_collection.document(client_id)
-        if doc_ref.get().exists:
-            doc_ref.update(data)
+        previous = _update_client_txn(db.transaction(), doc_ref, data)
+        if previous is not None:
+            if any(field in data for field in CLIENT_SNAPSHOT_FIELDS):
+                refresh_client_snapshot(client_id)
             return jsonify({"success": True}), 200
         else:
             return jsonify({"error": "Client not found"}), 404
+    except PhoneConflictError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @clients_api.route('/clients/<string:client_id>', methods=['DELETE'])
+@token_required
 def delete_client(client_id):
     """
     Delete a client.
@@ -117,12 +403,12 @@ def delete_client(client_id):
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         # Only admins can delete clients
-        if not get_jwt().get('is_admin', False):
+        if not g.is_admin:
             return jsonify({"error": "Admin required"}), 403
         
         doc_ref = clients_collection.document(client_id)
-        if doc_ref.get().exists:
-            doc_ref.delete()
+        client = _delete_client_txn(db.transaction(), doc_ref)
+        if client is not None:
             return jsonify({"success": True}), 200
         else:
             return jsonify({"error": "Client not found"}), 404
@@ -130,10 +416,16 @@ def delete_client(client_id):
         return jsonify({"error": str(e)}), 500
 
 @clients_api.route('/clients/login', methods=['POST'])
+@rate_limited('clients_login', LOGIN_RATE_LIMIT_PER_MINUTE, LOGIN_RATE_LIMIT_BURST)
 @token_required
 def client_login():
     """
     Authenticate a client AND perform Identity Resolution (Merging).
+
+    Resolving the profile of the Firebase user, claiming the shadow profile
+    of its phone and creating a new profile all run in one transaction over
+    uid_index and phone_index (see _login_txn): concurrent logins for the same
+    phone leave exactly one owner.
     """
     if not clients_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
@@ -141,58 +433,19 @@ def client_login():
         uid = g.user_id
         data = request.get_json() or {}
         phone_input = data.get('telefono')
-        
-        # 1. ¿Existe ya un usuario registrado con este UID?
-        query_uid = clients_collection.where('firebase_uid', '==', uid).limit(1)
-        results_uid = list(query_uid.stream())
-        
-        existing_doc = results_uid[0] if results_uid else None
-        final_doc_id = existing_doc.id if existing_doc else None
-        client_data = existing_doc.to_dict() if existing_doc else {}
-
-        # 2. LÓGICA DE MERGE (Si hay teléfono)
         if phone_input:
-            merge_result_id = merge_shadow_user(uid, phone_input)
-            
-            # CASO 1: CONFLICTO DE PROPIEDAD
-            # merge_shadow_user devuelve None si el teléfono ya está reclamado por otro UID.
-            if merge_result_id is None:
-                # Si el usuario ya tenía un perfil, no hacemos nada drástico.
-                # Simplemente ignoramos la reclamación y seguimos con su perfil existente.
-                # Si no tenía perfil, se le creará uno nuevo más abajo, pero sin el teléfono.
-                logging.warning(f"User {uid} failed to claim phone {phone_input}. It may belong to another user.")
-                
-                # Devolvemos un error específico para que el frontend pueda reaccionar.
-                # 409 Conflict es un buen candidato.
-                if not existing_doc:
-                     return jsonify({"error": "Este número ya está vinculado a otra cuenta."}), 409
-
-            # CASO 2: ÉXITO EN LA RECLAMACIÓN
-            else:
-                final_doc_id = merge_result_id
-                
-                # LIMPIEZA: Si el usuario tenía un perfil "vacío" antes de reclamar, lo borramos.
-                if existing_doc and existing_doc.id != final_doc_id:
-                    logging.info(f"CLEANUP: Deleting obsolete empty profile {existing_doc.id} after successful claim.")
-                    clients_collection.document(existing_doc.id).delete()
-                
-                # Refrescamos los datos del perfil reclamado.
-                client_data = clients_collection.document(final_doc_id).get().to_dict()
-
-        # 3. SI AÚN NO TENEMOS CUENTA (Ni existente, ni fusionada) -> CREAR NUEVA
-        if not final_doc_id:
-            new_data = {
-                'firebase_uid': uid,
-                'nombre': data.get('nombre', 'Usuario Digital'),
-                'created_at': firestore.SERVER_TIMESTAMP
-            }
-            if phone_input:
-                new_data['telefono'] = str(phone_input)
-                
-            update_time, doc_ref = clients_collection.add(new_data)
-            final_doc_id = doc_ref.id
-            client_data = new_data
-            logging.info(f"NEW USER: Created profile {final_doc_id} for {uid}")
+            try:
+                normalize_phone(phone_input)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        final_doc_id, client_data = _login_txn(
+            db.transaction(), uid, phone_input, data.get('nombre', 'Usuario Digital'), datetime.now(timezone.utc)
+        )
+        if final_doc_id is None:
+            # El teléfono pertenece a otra cuenta y el usuario no tiene perfil propio
+            logging.warning(f"User {uid} failed to claim phone {phone_input}. It may belong to another user.")
+            return jsonify({"error": "Este número ya está vinculado a otra cuenta."}), 409
 
         # Generate Token (Siempre apunta al final_doc_id resuelto)
         is_admin = client_data.get('admin', False)
@@ -212,34 +465,49 @@ def client_login():
         return jsonify({"error": str(e)}), 500
     
 @clients_api.route('/clients/<string:client_id>/stats', methods=['GET'])
+@token_required
 def get_client_stats(client_id):
     """
     Get sales statistics for a specific client.
+
+    Query Parameters:
+        created_from (str): ISO date/datetime; only ventas created since then.
+        created_to (str): ISO date/datetime; only ventas created until then.
+
+    Served from the aggregates kept on the client document (see counters.py),
+    so it is a single document read (plus the uid_index entry when the
+    profile ID is not the caller's UID). With a date range, total_ventas and
+    gasto_total come from count()/sum() aggregations over the client's ventas
+    in the range (see aggregations.py).
     """
     if not db:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         # Verify the client_id matches the authenticated user
-        if client_id != g.user_id:
+        if not g.is_admin and not _is_own_client(client_id):
             return jsonify({"error": "Unauthorized"}), 403
-        
-        # Query the ventas collection for sales associated with this client_id
-        ventas_query = db.collection('ventas').where('client_id', '==', client_id)
-        
-        total_ventas = 0
-        last_purchase_date = None
-        
-        for venta in ventas_query.stream():
-            total_ventas += 1
-            venta_data = venta.to_dict()
-            if 'created_at' in venta_data:
-                if last_purchase_date is None or venta_data['created_at'] > last_purchase_date:
-                    last_purchase_date = venta_data['created_at']
+
+        doc = clients_collection.document(client_id).get()
+        if not doc.exists:
+            return jsonify({"error": "Client not found"}), 404
+        client = doc.to_dict()
+
+        total_ventas = client.get('total_ventas', 0)
+        gasto_total = client.get('gasto_total', 0)
+        if request.args:
+            if set(request.args) - {'created_from', 'created_to'}:
+                return jsonify({"error": "Client stats can only be filtered by created_from and created_to"}), 400
+            try:
+                stats = get_range_stats({**request.args, 'client_id': client_id}, include_older_open=False)
+            except UnsupportedQuery as e:
+                return jsonify({"error": str(e)}), 400
+            total_ventas, gasto_total = stats['total_ventas'], stats['total_precio']
 
         return jsonify({
             "client_id": client_id,
             "total_ventas": total_ventas,
-            "last_purchase_date": last_purchase_date
+            "gasto_total": gasto_total,
+            "last_purchase_date": client.get('last_purchase_date')
         }), 200
         
     except Exception as e:
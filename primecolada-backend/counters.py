@@ -0,0 +1,402 @@
+import os
+import random
+from datetime import datetime, timezone
+from itertools import chain
+from google.cloud import firestore
+from db import db
+from enums import VentaState, NON_TERMINAL_STATES
+from archive import ARCHIVE_COLLECTION, unpack_venta
+from query_planner import plan_venta_query
+from dwell import DWELL_COLLECTION, DwellEvents, dwell_day_ref, record_dwell_change
+
+# Documentos agregados que se mantienen en la misma transacción que las
+# escrituras de 'ventas':
+#   - stats/ventas_por_estado/shards/<n>: número de ventas en cada estado,
+#     repartido en STATE_COUNTER_SHARDS documentos que se suman al leer.
+#   - ventas_diarias/<YYYY-MM-DD>: recaudación, nº de ventas y pedidos abiertos
+#     de las ventas creadas ese día.
+#   - clients/<id>: total_ventas, gasto_total y last_purchase_date del cliente.
+#   - ventas_dwell/<YYYY-MM-DD>: bocetos de permanencia por estado (dwell.py).
+STATS_COLLECTION = 'stats'
+STATE_COUNTERS_DOC = 'ventas_por_estado'
+STATE_COUNTER_SHARDS_COLLECTION = 'shards'
+# Firestore admite ~1 escritura/s sostenida por documento y todas las
+# escrituras de ventas tocan estos contadores: cada una incrementa un shard
+# al azar, así que N shards aguantan ~N escrituras/s sin contención.
+STATE_COUNTER_SHARDS = int(os.getenv('STATE_COUNTER_SHARDS', 10))
+DAILY_ROLLUPS_COLLECTION = 'ventas_diarias'
+
+# Campos del cliente copiados en cada venta
+CLIENT_SNAPSHOT_FIELDS = ('nombre', 'telefono')
+
+def state_counters_ref():
+    """Return the CollectionReference of the per-state counter shards."""
+    return db.collection(STATS_COLLECTION).document(STATE_COUNTERS_DOC).collection(STATE_COUNTER_SHARDS_COLLECTION)
+
+def state_counter_shard_ref(shard=None):
+    """Return the DocumentReference of a counter shard (a random one by default)."""
+    if shard is None:
+        shard = random.randrange(STATE_COUNTER_SHARDS)
+    return state_counters_ref().document(str(shard))
+
+def sum_state_counters(shards):
+    """
+    Add up the per-state counter shards.
+
+    Args:
+        shards (iterable): Snapshots of the shard documents.
+
+    Returns:
+        dict: {state value: count} with every VentaState present.
+    """
+    counts = {state.value: 0 for state in VentaState}
+    for shard in shards:
+        stored = shard.to_dict() or {}
+        for state in counts:
+            counts[state] += stored.get(str(state), 0)
+    return counts
+
+def day_key(moment):
+    """
+    Return the 'YYYY-MM-DD' bucket a datetime belongs to.
+
+    Days are UTC days (like the dwell sketches), whatever the timezone of the
+    server: aware datetimes are converted to UTC and naive ones are taken as
+    UTC, as Firestore stores them.
+    """
+    return _as_utc(moment).astimezone(timezone.utc).strftime('%Y-%m-%d')
+
+def daily_rollup_ref(day):
+    """Return the DocumentReference of the rollup bucket for a 'YYYY-MM-DD' day."""
+    return db.collection(DAILY_ROLLUPS_COLLECTION).document(day)
+
+def _total(venta):
+    return (venta.get('coste') or {}).get('total', 0) or 0
+
+def _as_utc(moment):
+    # Firestore guarda los datetime naive como UTC y los devuelve con tzinfo
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def _is_later(moment, reference):
+    return reference is None or _as_utc(moment) > _as_utc(reference)
+
+def _is_open(venta):
+    return venta.get('estado_actual') in NON_TERMINAL_STATES
+
+def record_state_change(transaction, old_state, new_state):
+    """
+    Adjust the per-state counters inside an open transaction.
+
+    Both deltas go to one random shard, so the venta write only contends
+    with the writes that happen to pick the same shard.
+
+    Args:
+        transaction: The Firestore transaction (or batch) the venta write belongs to.
+        old_state (int | None): Previous estado_actual, None when the venta is created.
+        new_state (int | None): New estado_actual, None when the venta is deleted.
+    """
+    if old_state == new_state:
+        return
+
+    deltas = {}
+    if old_state is not None:
+        deltas[str(old_state)] = firestore.Increment(-1)
+    if new_state is not None:
+        deltas[str(new_state)] = firestore.Increment(1)
+    transaction.set(state_counter_shard_ref(), deltas, merge=True)
+
+def record_daily_change(transaction, before, after):
+    """
+    Adjust the daily rollup bucket of a venta inside an open transaction.
+
+    The bucket is the day the venta was created, so a venta always stays in
+    the same bucket; only its contribution changes.
+
+    Args:
+        transaction: The Firestore transaction (or batch) the venta write belongs to.
+        before (dict | None): Venta data before the write, None on create.
+        after (dict | None): Venta data after the write, None on delete.
+    """
+    venta = after or before
+    if not venta or not venta.get('created_at'):
+        return
+
+    deltas = {}
+    total_delta = (_total(after) if after else 0) - (_total(before) if before else 0)
+    if total_delta:
+        deltas['total_precio'] = firestore.Increment(total_delta)
+    if before is None:
+        deltas['total_ventas'] = firestore.Increment(1)
+    elif after is None:
+        deltas['total_ventas'] = firestore.Increment(-1)
+    open_delta = int(bool(after) and _is_open(after)) - int(bool(before) and _is_open(before))
+    if open_delta:
+        deltas['pedidos_abiertos'] = firestore.Increment(open_delta)
+
+    if deltas:
+        transaction.set(daily_rollup_ref(day_key(venta['created_at'])), deltas, merge=True)
+
+def load_venta_client(transaction, venta, deleted_venta_id=None):
+    """
+    Read phase of the client aggregates: fetch the client a venta belongs to.
+
+    Firestore transactions must do every read before any write, so this is
+    called before the venta write and its result handed to record_venta_change.
+    When `deleted_venta_id` is given and that venta is the client's latest
+    purchase, the previous purchase date is looked up as well (in 'ventas'
+    and in the archive, which keeps counting).
+
+    Returns:
+        dict | None: {'ref', 'last_purchase_date'} or None if the venta has no
+        existing client.
+    """
+    client_id = venta.get('client_id')
+    if not client_id:
+        return None
+
+    client_ref = db.collection('clients').document(client_id)
+    snapshot = client_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+
+    last_purchase_date = snapshot.to_dict().get('last_purchase_date')
+    created_at = venta.get('created_at')
+    if deleted_venta_id and last_purchase_date and created_at and _as_utc(last_purchase_date) == _as_utc(created_at):
+        # Mismo índice declarado que el historial paginado del cliente (client_id, created_at DESC)
+        plan = plan_venta_query({'client_id': client_id})
+        last_purchase_date = None
+        for collection in ('ventas', ARCHIVE_COLLECTION):
+            latest = plan.build(db.collection(collection), paged=True).limit(2)
+            for doc in transaction.get(latest):
+                created = doc.to_dict().get('created_at')
+                if doc.id != deleted_venta_id and created and _is_later(created, last_purchase_date):
+                    last_purchase_date = created
+
+    return {'ref': client_ref, 'last_purchase_date': last_purchase_date}
+
+def record_client_change(transaction, client, before, after):
+    """
+    Adjust the running aggregates stored on the client document.
+
+    Args:
+        transaction: The Firestore transaction (or batch) the venta write belongs to.
+        client (dict): Result of load_venta_client.
+        before (dict | None): Venta data before the write, None on create.
+        after (dict | None): Venta data after the write, None on delete.
+    """
+    changes = {}
+    total_delta = (_total(after) if after else 0) - (_total(before) if before else 0)
+    if total_delta:
+        changes['gasto_total'] = firestore.Increment(total_delta)
+
+    if before is None:
+        changes['total_ventas'] = firestore.Increment(1)
+        created_at = after.get('created_at')
+        if created_at and _is_later(created_at, client['last_purchase_date']):
+            changes['last_purchase_date'] = created_at
+    elif after is None:
+        changes['total_ventas'] = firestore.Increment(-1)
+        changes['last_purchase_date'] = client['last_purchase_date']
+
+    if changes:
+        transaction.update(client['ref'], changes)
+
+def record_venta_change(transaction, before, after, client=None):
+    """
+    Keep every venta aggregate in sync with a single venta write.
+
+    Args:
+        transaction: The Firestore transaction (or batch) the venta write belongs to.
+        before (dict | None): Venta data before the write, None on create.
+        after (dict | None): Venta data after the write, None on delete.
+        client (dict | None): Result of load_venta_client, if the client
+            aggregates are affected by this write.
+    """
+    record_state_change(
+        transaction,
+        before.get('estado_actual') if before else None,
+        after.get('estado_actual') if after else None
+    )
+    record_daily_change(transaction, before, after)
+    record_dwell_change(transaction, before, after)
+    if client:
+        record_client_change(transaction, client, before, after)
+
+class AggregateDeltas:
+    """
+    Collects the aggregate writes of many venta writes so that each aggregate
+    document is written once per batch.
+
+    Exposes the subset of the transaction API used by record_venta_change
+    (`set` with merge and `update`); Increment values on the same field are
+    summed and any other value is last-write-wins. `flush` copies the merged
+    writes into a real WriteBatch or transaction. `len()` is the number of
+    aggregate documents it will write, so callers can size their batches.
+    """
+
+    def __init__(self):
+        self._docs = {}
+
+    def set(self, ref, data, merge=False):
+        self._add(ref, 'set', data)
+
+    def update(self, ref, data):
+        self._add(ref, 'update', data)
+
+    def _add(self, ref, method, data):
+        _, current_method, merged = self._docs.setdefault(ref.path, (ref, method, {}))
+        if current_method != method:
+            raise ValueError(f"Mixed set/update on aggregate document {ref.path}")
+        for key, value in data.items():
+            previous = merged.get(key)
+            if isinstance(value, firestore.Increment) and isinstance(previous, firestore.Increment):
+                merged[key] = firestore.Increment(previous.value + value.value)
+            else:
+                merged[key] = value
+
+    def __len__(self):
+        return len(self._docs)
+
+    def new_documents(self, other):
+        """Number of aggregate documents of `other` not written by this one yet."""
+        return sum(1 for path in other._docs if path not in self._docs)
+
+    def merge(self, other):
+        """Add the writes collected by another AggregateDeltas."""
+        for ref, method, merged in other._docs.values():
+            self._add(ref, method, merged)
+
+    def flush(self, writer):
+        for ref, method, merged in self._docs.values():
+            if method == 'set':
+                writer.set(ref, merged, merge=True)
+            else:
+                writer.update(ref, merged)
+        self._docs = {}
+
+def get_state_counts():
+    """
+    Read the per-state counters: one query over the shards, one read each.
+
+    Returns:
+        dict: {state value: count} with every VentaState present.
+    """
+    return sum_state_counters(state_counters_ref().stream())
+
+def get_daily_stats(moment=None):
+    """
+    Sales statistics for the UTC day of `moment` (today by default).
+
+    Costs one read for the day's rollup bucket plus one per counter shard.
+    Orders still open from previous days are every open order minus the
+    ones created today.
+
+    Returns:
+        dict: total_precio, total_ventas and pedidos_antiguos.
+    """
+    moment = moment or datetime.now(timezone.utc)
+    day_snap = daily_rollup_ref(day_key(moment)).get()
+    day = day_snap.to_dict() if day_snap.exists else {}
+
+    counts = get_state_counts()
+    open_total = sum(counts[state] for state in NON_TERMINAL_STATES)
+    return {
+        "total_precio": day.get('total_precio', 0),
+        "total_ventas": day.get('total_ventas', 0),
+        "pedidos_antiguos": max(open_total - day.get('pedidos_abiertos', 0), 0)
+    }
+
+def rebuild_aggregates():
+    """
+    Reconciliation: recount every venta and overwrite the aggregates.
+
+    Rebuilds the per-state counters (all in shard 0; the other shards and
+    the pre-sharding stats/ventas_por_estado document are deleted), the
+    daily rollup buckets (deleting buckets of days that no longer have any
+    venta), the per-client aggregates and the dwell sketches (from every
+    historial_estados).
+    Archived ventas (ventas_archive) keep counting.
+
+    Returns:
+        dict: The rebuilt {state value: count} mapping.
+    """
+    status_counts = {state.value: 0 for state in VentaState}
+    daily = {}
+    per_client = {}
+    dwell = DwellEvents()
+    fields = ['estado_actual', 'created_at', 'coste', 'client_id']
+    documents = chain(
+        ((doc, False) for doc in db.collection('ventas').select(fields + ['historial_estados']).stream()),
+        ((doc, True) for doc in db.collection(ARCHIVE_COLLECTION).select(fields + ['transiciones']).stream())
+    )
+    for doc, archived in documents:
+        venta = unpack_venta(doc.to_dict()) if archived else doc.to_dict()
+        dwell.add_historial(venta.get('historial_estados'))
+        estado = venta.get('estado_actual')
+        if estado in status_counts:
+            status_counts[estado] += 1
+        if venta.get('client_id'):
+            aggregates = per_client.setdefault(
+                venta['client_id'],
+                {'total_ventas': 0, 'gasto_total': 0, 'last_purchase_date': None}
+            )
+            aggregates['total_ventas'] += 1
+            aggregates['gasto_total'] += _total(venta)
+            created_at = venta.get('created_at')
+            if created_at and _is_later(created_at, aggregates['last_purchase_date']):
+                aggregates['last_purchase_date'] = created_at
+        if venta.get('created_at'):
+            bucket = daily.setdefault(
+                day_key(venta['created_at']),
+                {'total_precio': 0, 'total_ventas': 0, 'pedidos_abiertos': 0}
+            )
+            bucket['total_precio'] += _total(venta)
+            bucket['total_ventas'] += 1
+            bucket['pedidos_abiertos'] += int(_is_open(venta))
+
+    # (ref, data, merge); data None = borrar
+    writes = [(db.collection(STATS_COLLECTION).document(STATE_COUNTERS_DOC), None, False)]
+    writes += [
+        (doc.reference, None, False)
+        for doc in state_counters_ref().select([]).stream()
+        if doc.id != '0'
+    ]
+    writes.append((state_counter_shard_ref(0), {str(state): count for state, count in status_counts.items()}, False))
+    writes += [
+        (doc.reference, None, False)
+        for doc in db.collection(DAILY_ROLLUPS_COLLECTION).select([]).stream()
+        if doc.id not in daily
+    ]
+    writes += [(daily_rollup_ref(day), bucket, False) for day, bucket in daily.items()]
+    writes += [
+        (doc.reference, None, False)
+        for doc in db.collection(DWELL_COLLECTION).select([]).stream()
+        if doc.id not in dwell.days
+    ]
+    writes += [(dwell_day_ref(day), sketch, False) for day, sketch in dwell.days.items()]
+
+    empty_client = {'total_ventas': 0, 'gasto_total': 0, 'last_purchase_date': None}
+    writes += [
+        (doc.reference, per_client.get(doc.id, empty_client), True)
+        for doc in db.collection('clients').select([]).stream()
+    ]
+
+    # Firestore limita los batches a 500 operaciones
+    for start in range(0, len(writes), 500):
+        batch = db.batch()
+        for ref, data, merge in writes[start:start + 500]:
+            if data is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, data, merge=merge)
+        batch.commit()
+
+    return status_counts
+
+if __name__ == "__main__":
+    if not db:
+        print("Firestore not initialized. Aborting reconciliation.")
+    else:
+        print("Rebuilding venta counters, daily rollups and client aggregates...")
+        print(rebuild_aggregates())
+        print("Reconciliation finished.")
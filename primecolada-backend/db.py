@@ -1,6 +1,7 @@
-from google.cloud import firestore
 import os
 from dotenv import load_dotenv
+from instrumentation import instrument_client
+from lazy import LazyProxy
 
 load_dotenv()
 
@@ -10,11 +11,45 @@ google_credentials = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 if google_credentials:
     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = google_credentials
 
-# Initialize the Firestore client.
-# The client will automatically use the credentials from the environment variable.
-try:
-    db = firestore.Client(database=os.getenv('FIRESTORE_DATABASE', 'primecolada-ventas'))
-    print(f"Successfully connected to Firestore database '{os.getenv('FIRESTORE_DATABASE')}' using google-cloud-firestore.")
-except Exception as e:
-    print(f"Could not initialize Firestore. Please check your service account key path and project configuration. Error: {e}")
-    db = None
+# Data-access backend: 'firestore' (default) or 'memory', an in-process fake
+# of the Firestore subset we use (offline development and benchmarks).
+FIRESTORE_BACKEND = os.getenv('FIRESTORE_BACKEND', 'firestore')
+
+def create_client():
+    """
+    Build the Firestore client of this process (see FIRESTORE_BACKEND).
+
+    The client will automatically use the credentials from the environment
+    variable.
+
+    Returns:
+        The instrumented client, or None if Firestore could not be initialized.
+    """
+    if FIRESTORE_BACKEND == 'memory':
+        from memory_firestore import MemoryClient
+        client = MemoryClient()
+        print("Using the in-memory Firestore backend (data is not persisted).")
+    else:
+        from google.cloud import firestore
+        try:
+            client = firestore.Client(database=os.getenv('FIRESTORE_DATABASE', 'primecolada-ventas'))
+            print(f"Successfully connected to Firestore database '{os.getenv('FIRESTORE_DATABASE')}' using google-cloud-firestore.")
+        except Exception as e:
+            print(f"Could not initialize Firestore. Please check your service account key path and project configuration. Error: {e}")
+            client = None
+
+    # Cuenta lecturas/escrituras y tiempo de Firestore de cada petición (Server-Timing, /metrics)
+    return instrument_client(client)
+
+# El cliente se crea en el primer uso, no al importar: cada worker de gunicorn
+# crea el suyo (sus canales gRPC) después del fork, y arrancar no espera a las
+# credenciales ni al proyecto de Google Cloud.
+db = LazyProxy(create_client)
+
+def lazy_collection(name):
+    """
+    A collection reference of `db` for module globals, built on first use.
+
+    Falsy when Firestore could not be initialized (`if not ventas_collection:`).
+    """
+    return LazyProxy(lambda: db.collection(name) if db else None)
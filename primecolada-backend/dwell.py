@@ -0,0 +1,230 @@
+import math
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from db import db
+from enums import NON_TERMINAL_STATES
+
+# Bocetos diarios de tiempos de permanencia por estado, mantenidos en la misma
+# transacción que las escrituras de ventas (ver counters.record_venta_change).
+# Un documento por día (UTC) en 'ventas_dwell' con campos planos, todos
+# firestore.Increment para que se puedan sumar dentro de AggregateDeltas:
+#   - dwell_<estado>_<bucket>: salidas del estado con esa permanencia
+#     (histograma logarítmico, ver dwell_bucket)
+#   - dwell_seconds_<estado>: suma de las permanencias (para la media)
+#   - entradas_<estado>_<HH> / salidas_<estado>_<HH>: entradas y salidas del
+#     estado en esa hora; bajas_<estado>_<HH>: ventas borradas en ese estado
+DWELL_COLLECTION = 'ventas_dwell'
+# Cada bucket cubre [base^(i-1), base^i) segundos: error relativo < 5%
+DWELL_BUCKET_BASE = 1.1
+DWELL_PERCENTILES = (50, 90, 95, 99)
+# Rango máximo de una consulta de analítica y antigüedad máxima de su inicio
+# (las colas se reconstruyen leyendo un documento por día hasta hoy)
+MAX_DWELL_RANGE_DAYS = 92
+MAX_DWELL_LOOKBACK_DAYS = 366
+
+def _as_utc(moment):
+    # Firestore guarda los datetime naive como UTC y los devuelve con tzinfo
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+def dwell_bucket(seconds):
+    """Histogram bucket of a dwell time; bucket 0 holds anything under a second."""
+    if seconds < 1:
+        return 0
+    return 1 + int(math.log(seconds) / math.log(DWELL_BUCKET_BASE))
+
+def bucket_value(bucket):
+    """Representative dwell time (geometric midpoint) of a bucket, in seconds."""
+    if bucket == 0:
+        return 0.0
+    return DWELL_BUCKET_BASE ** (bucket - 0.5)
+
+def dwell_day_ref(day):
+    """Return the DocumentReference of the dwell sketch for a 'YYYY-MM-DD' day."""
+    return db.collection(DWELL_COLLECTION).document(day)
+
+def _day_and_hour(moment):
+    moment = _as_utc(moment)
+    return moment.strftime('%Y-%m-%d'), moment.strftime('%H')
+
+class DwellEvents:
+    """Accumulates dwell sketch increments as {day: {field: amount}}."""
+
+    def __init__(self):
+        self.days = {}
+
+    def _add(self, moment, field, amount=1, hourly=False):
+        day, hour = _day_and_hour(moment)
+        if hourly:
+            field = f'{field}_{hour}'
+        fields = self.days.setdefault(day, {})
+        fields[field] = fields.get(field, 0) + amount
+
+    def entry(self, estado, moment):
+        self._add(moment, f'entradas_{estado}', hourly=True)
+
+    def exit(self, estado, entrada, salida):
+        self._add(salida, f'salidas_{estado}', hourly=True)
+        if entrada is not None:
+            seconds = max((_as_utc(salida) - _as_utc(entrada)).total_seconds(), 0)
+            self._add(salida, f'dwell_{estado}_{dwell_bucket(seconds)}')
+            self._add(salida, f'dwell_seconds_{estado}', round(seconds, 3))
+
+    def removal(self, estado, moment):
+        self._add(moment, f'bajas_{estado}', hourly=True)
+
+    def add_historial(self, historial):
+        """Every entry and exit recorded in a venta's historial_estados."""
+        for estado, stint in (historial or {}).items():
+            if not isinstance(stint, dict):
+                continue
+            if stint.get('entrada') is not None:
+                self.entry(estado, stint['entrada'])
+            if stint.get('salida') is not None:
+                self.exit(estado, stint.get('entrada'), stint['salida'])
+
+def _historial_stint(venta, estado):
+    stint = (venta.get('historial_estados') or {}).get(str(estado))
+    return stint if isinstance(stint, dict) else {}
+
+def record_dwell_change(transaction, before, after):
+    """
+    Add the state entries/exits of a venta write to the daily dwell sketches.
+
+    Args:
+        transaction: The Firestore transaction (or batch) the venta write belongs to.
+        before (dict | None): Venta data before the write, None on create.
+        after (dict | None): Venta data after the write, None on delete.
+    """
+    old_state = before.get('estado_actual') if before else None
+    new_state = after.get('estado_actual') if after else None
+    if old_state == new_state:
+        return
+
+    events = DwellEvents()
+    if after is None:
+        events.removal(old_state, datetime.now(timezone.utc))
+    else:
+        entrada = _historial_stint(after, new_state).get('entrada') or after.get('updated_at') or after.get('created_at')
+        if entrada is None:
+            return
+        events.entry(new_state, entrada)
+        if before is not None:
+            stint = _historial_stint(after, old_state)
+            events.exit(old_state, stint.get('entrada'), stint.get('salida') or entrada)
+
+    for day, fields in events.days.items():
+        transaction.set(
+            dwell_day_ref(day),
+            {field: firestore.Increment(amount) for field, amount in fields.items()},
+            merge=True
+        )
+
+def _percentiles(histogram):
+    """Nearest-rank percentiles of a {bucket: count} histogram, in seconds."""
+    count = sum(histogram.values())
+    result = {}
+    buckets = sorted(histogram)
+    for percentile in DWELL_PERCENTILES:
+        rank = max(math.ceil(percentile / 100 * count), 1)
+        cumulative = 0
+        for bucket in buckets:
+            cumulative += histogram[bucket]
+            if cumulative >= rank:
+                result[f'p{percentile}'] = round(bucket_value(bucket), 1)
+                break
+    return result
+
+def get_dwell_analytics(start_day, end_day, state_counts, now=None):
+    """
+    Dwell percentiles, hourly throughput and hourly queue length per state
+    between two days (inclusive, UTC), from the daily sketches.
+
+    Queue lengths are rebuilt backwards from the current per-state counters,
+    so the sketches from `start_day` up to today are read (one document per
+    day); nothing is computed from the ventas themselves.
+
+    Args:
+        start_day (date): First day of the range.
+        end_day (date): Last day of the range.
+        state_counts (dict): Current {state value: count} (see get_state_counts).
+
+    Returns:
+        dict: from, to, dwell ({estado: count, mean_seconds, pNN}), hours (hour
+        starts), throughput ({estado: [exits per hour]}) and queue_length
+        ({open estado: [ventas in the state at the end of each hour]}).
+    """
+    now = _as_utc(now or datetime.now(timezone.utc))
+    today = now.date()
+    last_day = max(end_day, today)
+    days = [start_day + timedelta(days=offset) for offset in range((last_day - start_day).days + 1)]
+    refs = [dwell_day_ref(day.isoformat()) for day in days]
+    sketches = {snap.id: snap.to_dict() for snap in db.get_all(refs) if snap.exists}
+
+    histograms = {}
+    dwell_seconds = {}
+    # (día, hora) -> {campo: {estado: n}}
+    hourly = {}
+    for day, fields in sketches.items():
+        in_range = start_day.isoformat() <= day <= end_day.isoformat()
+        for field, amount in fields.items():
+            kind, _, rest = field.partition('_')
+            if kind == 'dwell' and in_range:
+                if rest.startswith('seconds_'):
+                    estado = rest[len('seconds_'):]
+                    dwell_seconds[estado] = dwell_seconds.get(estado, 0) + amount
+                else:
+                    estado, _, bucket = rest.rpartition('_')
+                    histogram = histograms.setdefault(estado, {})
+                    histogram[int(bucket)] = histogram.get(int(bucket), 0) + amount
+            elif kind in ('entradas', 'salidas', 'bajas'):
+                estado, _, hour = rest.rpartition('_')
+                per_kind = hourly.setdefault((day, hour), {}).setdefault(kind, {})
+                per_kind[estado] = per_kind.get(estado, 0) + amount
+
+    dwell = {}
+    for estado, histogram in sorted(histograms.items()):
+        count = sum(histogram.values())
+        dwell[estado] = {
+            'count': count,
+            'mean_seconds': round(dwell_seconds.get(estado, 0) / count, 1),
+            **_percentiles(histogram)
+        }
+
+    # Horas del rango (hasta la hora actual) y nivel de cada cola al final de cada hora,
+    # reconstruido hacia atrás desde los contadores actuales
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    range_start = datetime.combine(start_day, datetime.min.time(), tzinfo=timezone.utc)
+    range_end = min(datetime.combine(end_day, datetime.min.time(), tzinfo=timezone.utc) + timedelta(hours=23), current_hour)
+    states = [str(state) for state in sorted(state_counts)]
+    queue_states = [str(state) for state in NON_TERMINAL_STATES]
+    levels = {estado: state_counts[int(estado)] for estado in states}
+
+    hours = []
+    throughput = {estado: [] for estado in states}
+    queue_length = {estado: [] for estado in queue_states}
+    hour = current_hour
+    while hour >= range_start:
+        counts = hourly.get((hour.strftime('%Y-%m-%d'), hour.strftime('%H')), {})
+        if hour <= range_end:
+            hours.append(hour.replace(tzinfo=None).isoformat())
+            for estado in states:
+                throughput[estado].append(counts.get('salidas', {}).get(estado, 0))
+            for estado in queue_states:
+                queue_length[estado].append(levels[estado])
+        for estado in states:
+            levels[estado] -= counts.get('entradas', {}).get(estado, 0)
+            levels[estado] += counts.get('salidas', {}).get(estado, 0) + counts.get('bajas', {}).get(estado, 0)
+        hour -= timedelta(hours=1)
+
+    hours.reverse()
+    for series in (*throughput.values(), *queue_length.values()):
+        series.reverse()
+
+    return {
+        'from': start_day.isoformat(),
+        'to': end_day.isoformat(),
+        'dwell': dwell,
+        'hours': hours,
+        'throughput': throughput,
+        'queue_length': queue_length
+    }
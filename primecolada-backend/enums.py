@@ -5,4 +5,11 @@ class VentaState(Enum):
     EN_COLA = 1
     LAVANDO = 2
     PTE_RECOGIDA = 3
-    RECOGIDO = 4
\ No newline at end of file
+    RECOGIDO = 4
+
+# Estados "abiertos": el pedido sigue en la tienda
+NON_TERMINAL_STATES = [
+    VentaState.EN_COLA.value,
+    VentaState.LAVANDO.value,
+    VentaState.PTE_RECOGIDA.value
+]
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from google.cloud.firestore_v1.watch import ChangeType
+from db import db
+from counters import day_key
+from serializers import venta_fields_serializer
+
+# Eventos de cambios en 'ventas' para el tablero (GET /ventas/events, SSE).
+# Cada worker mantiene un listener on_snapshot sobre las ventas modificadas
+# desde que arrancó y guarda los últimos EVENTS_BUFFER_SIZE cambios para que
+# un cliente que se reconecta con Last-Event-ID reciba lo que se perdió.
+EVENTS_BUFFER_SIZE = int(os.getenv('EVENTS_BUFFER_SIZE', 1000))
+# Cada conexión ocupa un hilo de gunicorn: se cierra pasado este tiempo y el
+# navegador se reconecta (con Last-Event-ID) tras SSE_RETRY_MS
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', 300))
+SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+SSE_RETRY_MS = 3000
+# Campos de la venta que viajan en el evento: los mismos que pide el listado
+# del tablero (VENTA_LIST_FIELDS en el frontend), que así no vuelve a pedirla
+EVENT_VENTA_FIELDS = ('id', 'client_id', 'nombre', 'telefono', 'estado_actual', 'coste', 'created_at', 'updated_at')
+# Un borrado deja una lápida en esta colección dentro de su misma transacción:
+# una venta que no ha cambiado desde que arrancó el listener no está en su
+# consulta y su borrado no produciría ningún evento. Las lápidas caducan
+# (política TTL sobre expires_at) pasado un día, lo que dura cada listener.
+DELETED_VENTAS_COLLECTION = 'ventas_deleted'
+DELETED_VENTA_TTL_HOURS = 24
+
+def _micros(moment):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1_000_000)
+
+def encode_event_id(key):
+    """Event IDs are '<commit time in µs>-<venta id>': comparable across workers."""
+    return f"{key[0]}-{key[1]}"
+
+def decode_event_id(event_id):
+    """
+    Parse a Last-Event-ID header.
+
+    Raises:
+        ValueError: If the ID was not produced by encode_event_id.
+    """
+    micros, _, venta_id = (event_id or '').partition('-')
+    return int(micros), venta_id
+
+def record_venta_deletion(transaction, venta_id, now=None):
+    """
+    Leave the tombstone that turns a venta deletion into a 'removed' event
+    on every worker.
+
+    Args:
+        transaction: Transaction (or batch) that deletes the venta.
+        venta_id (str): ID of the deleted venta.
+        now (datetime | None): Deletion time, UTC now by default.
+    """
+    now = now or datetime.now(timezone.utc)
+    transaction.set(db.collection(DELETED_VENTAS_COLLECTION).document(venta_id), {
+        'deleted_at': now,
+        'expires_at': now + timedelta(hours=DELETED_VENTA_TTL_HOURS)
+    })
+
+class VentaEventBroker:
+    """
+    Fan-out of venta changes to any number of SSE connections of one worker.
+
+    Events are diffs: {"id", "estado_actual", "updated_at", "type", "venta"}
+    with type added, modified or removed and "venta" the listing fields of
+    the committed document (None when removed); deletions come from the tombstones
+    left by record_venta_deletion. They are keyed by the Firestore
+    commit time of the change, so a Last-Event-ID issued by one worker can be
+    resumed on another. Delivery is at-least-once; when the requested ID is
+    older than what the buffer covers a 'reset' event asks the client to
+    reload the full listing.
+    """
+
+    def __init__(self, buffer_size):
+        self._condition = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._events = deque()
+        self._keys = set()
+        self._buffer_size = buffer_size
+        self._watches = []
+        self._subscribers = []
+        self._started_day = None
+        # Eventos anteriores a este punto ya no están en el buffer
+        self._horizon = None
+
+    def ensure_started(self):
+        """Start the listener, or roll it over to a fresh one once a day."""
+        if not db:
+            return
+        today = day_key(datetime.now(timezone.utc))
+        if self._watches and self._started_day == today and self._listening():
+            return
+        with self._start_lock:
+            if self._watches and self._started_day == today and self._listening():
+                return
+            started_at = datetime.now(timezone.utc)
+            if not self._watches or not self._listening():
+                # Sin listener vivo se han podido perder cambios
+                with self._condition:
+                    self._horizon = (_micros(started_at), '')
+
+            def skip_initial(publish):
+                initial = [True]
+
+                def on_snapshot(docs, changes, read_time):
+                    if initial[0]:
+                        # La carga inicial son cambios ya emitidos (o anteriores al arranque)
+                        initial[0] = False
+                        return
+                    publish(changes, read_time)
+                return on_snapshot
+
+            # Los listeners siguen solo las ventas modificadas y las borradas
+            # desde su arranque (fechas en UTC) y se renuevan cada día para que
+            # ese conjunto no crezca sin límite. Los nuevos arrancan
+            # antes de cerrar los anteriores: los duplicados se descartan por clave.
+            now = datetime.now(timezone.utc)
+            watches = []
+            try:
+                watches.append(db.collection('ventas').where('updated_at', '>=', now)
+                               .on_snapshot(skip_initial(self._publish)))
+                watches.append(db.collection(DELETED_VENTAS_COLLECTION).where('deleted_at', '>=', now)
+                               .on_snapshot(skip_initial(self._publish_deletions)))
+            except Exception as e:
+                logging.error(f"Venta events: could not start the listener: {e}")
+                for watch in watches:
+                    watch.unsubscribe()
+                return
+            for previous in self._watches:
+                previous.unsubscribe()
+            self._watches = watches
+            self._started_day = today
+
+    def _listening(self):
+        return all(watch.is_active for watch in self._watches)
+
+    def subscribe(self, callback):
+        """
+        Call `callback(event)` for every new event (e.g. to invalidate caches).
+
+        Callbacks run on the listener thread and must be quick.
+        """
+        self._subscribers.append(callback)
+
+    def _publish(self, changes, read_time):
+        entries = []
+        for change in changes:
+            snapshot = change.document
+            venta = snapshot.to_dict() or {}
+            removed = change.type == ChangeType.REMOVED
+            moment = read_time if removed or not snapshot.update_time else snapshot.update_time
+            updated_at = venta.get('updated_at')
+            entries.append(((_micros(moment), snapshot.id), {
+                'id': snapshot.id,
+                'type': 'removed' if removed else ('added' if change.type == ChangeType.ADDED else 'modified'),
+                'estado_actual': None if removed else venta.get('estado_actual'),
+                'updated_at': updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at,
+                'venta': None if removed else venta_fields_serializer(EVENT_VENTA_FIELDS).dump({**venta, 'id': snapshot.id})
+            }))
+        self._append(entries)
+
+    def _publish_deletions(self, changes, read_time):
+        entries = []
+        for change in changes:
+            # Solo interesa la lápida recién escrita; su caducidad no es un evento
+            if change.type != ChangeType.ADDED:
+                continue
+            snapshot = change.document
+            moment = snapshot.update_time or read_time
+            entries.append(((_micros(moment), snapshot.id), {
+                'id': snapshot.id,
+                'type': 'removed',
+                'estado_actual': None,
+                'updated_at': None,
+                'venta': None
+            }))
+        self._append(entries)
+
+    def _already_removed(self, venta_id):
+        # El listener de 'ventas' también ve el borrado si la venta estaba en
+        # su consulta: se emite una sola vez si no ha habido cambios después
+        for _, event in reversed(self._events):
+            if event['id'] == venta_id:
+                return event['type'] == 'removed'
+        return False
+
+    def _append(self, entries):
+        published = []
+        with self._condition:
+            for key, event in entries:
+                if key in self._keys:
+                    continue
+                if event['type'] == 'removed' and self._already_removed(event['id']):
+                    continue
+                self._events.append((key, event))
+                self._keys.add(key)
+                published.append(event)
+                while len(self._events) > self._buffer_size:
+                    evicted, _ = self._events.popleft()
+                    self._keys.discard(evicted)
+                    self._horizon = max(self._horizon, evicted) if self._horizon else evicted
+            self._condition.notify_all()
+        for event in published:
+            for callback in self._subscribers:
+                try:
+                    callback(event)
+                except Exception:
+                    logging.exception("Venta events: subscriber failed")
+
+    def _events_after(self, cursor):
+        return [(key, event) for key, event in self._events if key > cursor]
+
+    def _head(self):
+        if self._events:
+            return max(key for key, _ in self._events)
+        return self._horizon or (_micros(datetime.now(timezone.utc)), '')
+
+    def stream(self, last_event_id=None):
+        """
+        Generate the text/event-stream frames of one SSE connection.
+
+        Args:
+            last_event_id (str | None): Resume after this event ID; without it
+                only changes from now on are sent.
+        """
+        self.ensure_started()
+        with self._condition:
+            cursor = self._head()
+            reset = False
+            if last_event_id:
+                try:
+                    requested = decode_event_id(last_event_id)
+                except ValueError:
+                    requested = None
+                if requested is None or (self._horizon and requested < self._horizon):
+                    reset = True
+                else:
+                    cursor = requested
+
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if reset:
+            yield f"id: {encode_event_id(cursor)}\nevent: reset\ndata: {{}}\n\n"
+
+        deadline = time.time() + SSE_MAX_SECONDS
+        while time.time() < deadline:
+            self.ensure_started()
+            with self._condition:
+                pending = self._events_after(cursor)
+                if not pending:
+                    self._condition.wait(timeout=min(SSE_HEARTBEAT_SECONDS, max(deadline - time.time(), 0)))
+                    pending = self._events_after(cursor)
+                # El buffer ha descartado eventos que este cliente no ha recibido
+                lost = bool(self._horizon and cursor < self._horizon)
+            if lost:
+                cursor = self._head()
+                yield f"id: {encode_event_id(cursor)}\nevent: reset\ndata: {{}}\n\n"
+                continue
+            if not pending:
+                yield ": keepalive\n\n"
+                continue
+            frames = []
+            for key, event in pending:
+                frames.append(f"id: {encode_event_id(key)}\nevent: venta\ndata: {json.dumps(event)}\n\n")
+                cursor = max(cursor, key)
+            yield ''.join(frames)
+
+venta_events = VentaEventBroker(buffer_size=EVENTS_BUFFER_SIZE)
@@ -0,0 +1,22 @@
+# Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# Los endpoints pasan casi todo su tiempo esperando a Firestore (E/S de red que
+# libera el GIL), así que cada worker atiende varias peticiones en hilos: con
+# 4 workers x 32 hilos el contenedor mantiene 128 peticiones en vuelo en lugar
+# de 4. El cliente de Firestore y las cachés por worker son thread-safe.
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'debug')
+
+# La app se importa una sola vez en el proceso maestro y los workers la heredan
+# con el fork, en lugar de importarla cada uno a la vez en un arranque en frío.
+# Es seguro porque el cliente de Firestore (canales gRPC) y Firebase Admin no
+# se crean al importar sino en el primer uso, ya dentro de cada worker (lazy.py).
+preload_app = os.getenv('GUNICORN_PRELOAD_APP', '1') == '1'
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from db import db
+
+# Claves de idempotencia de POST /ventas (cabecera Idempotency-Key).
+#
+# La primera respuesta correcta de cada clave se guarda en
+# idempotency_keys/<sha256(usuario:clave)>, escrita en la misma transacción
+# que la venta: un reintento (aunque llegue a la vez que el original o a otro
+# worker) devuelve la misma venta en vez de crear otra. Los registros caducan
+# a las IDEMPOTENCY_KEY_TTL_HOURS horas (política TTL de Firestore sobre
+# expires_at, declarada en firestore.indexes.json) y cada worker guarda los
+# últimos en un LRU para responder sin leer Firestore.
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_CACHE_MAX_ENTRIES', 1024))
+# UUID v4 u otro identificador opaco generado por el cliente
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+class IdempotencyCache:
+    """Per-worker LRU of stored idempotency records, each kept until it expires."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, record_id):
+        """Return the cached record, or None on a miss."""
+        with self._lock:
+            record = self._entries.get(record_id)
+            if record is None or is_expired(record):
+                if record is not None:
+                    del self._entries[record_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(record_id)
+            self.hits += 1
+            return record
+
+    def put(self, record_id, record):
+        with self._lock:
+            self._entries[record_id] = record
+            self._entries.move_to_end(record_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_MAX_ENTRIES)
+
+def idempotency_ref(user_id, key):
+    """
+    Return the idempotency_keys DocumentReference of a user's key.
+
+    Keys are scoped to the user: two users may send the same key.
+
+    Raises:
+        ValueError: If the key is empty or too long.
+    """
+    key = key.strip()
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    record_id = hashlib.sha256(f"{user_id}:{key}".encode()).hexdigest()
+    return db.collection(IDEMPOTENCY_COLLECTION).document(record_id)
+
+def request_fingerprint(payload):
+    """Hash of a JSON payload, independent of key order and whitespace."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def is_expired(record, now=None):
+    # Firestore borra los documentos caducados con hasta 24 h de retraso
+    return record['expires_at'] <= (now or datetime.now(timezone.utc))
+
+def build_record(user_id, fingerprint, status, body, now=None):
+    """The document stored for the first response of a key."""
+    now = now or datetime.now(timezone.utc)
+    return {
+        'user_id': user_id,
+        'request_hash': fingerprint,
+        'status': status,
+        'body': body,
+        'created_at': now,
+        'expires_at': now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    }
+
+def lookup_record(ref):
+    """
+    Return the stored record of a key (per-worker cache first), or None if
+    the key is new or expired.
+    """
+    record = idempotency_cache.get(ref.id)
+    if record is not None:
+        return record
+    snapshot = ref.get()
+    if not snapshot.exists or is_expired(snapshot.to_dict()):
+        return None
+    record = snapshot.to_dict()
+    idempotency_cache.put(ref.id, record)
+    return record
+
+def read_record(transaction, ref):
+    """Read a key's record inside an open transaction; None if new or expired."""
+    snapshot = ref.get(transaction=transaction)
+    if not snapshot.exists or is_expired(snapshot.to_dict()):
+        return None
+    return snapshot.to_dict()
+
+def store_record(transaction, ref, record):
+    """Write a key's record inside the transaction that produces its response."""
+    transaction.set(ref, record)
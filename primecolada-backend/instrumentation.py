@@ -0,0 +1,348 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from flask import Response, g, request, jsonify, has_request_context
+
+# Instrumentación por petición: lecturas/escrituras/consultas a Firestore,
+# tiempo en Firestore, tiempo de (de)serialización con marshmallow y tiempo
+# total. Se emite como cabecera Server-Timing, como log estructurado (una
+# línea JSON por petición) y agregado en histogramas en /metrics (formato
+# Prometheus). Las métricas son de cada worker.
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', '1') not in ('0', 'false', 'False')
+REQUEST_LOGS_ENABLED = os.getenv('REQUEST_LOGS_ENABLED', '1') not in ('0', 'false', 'False')
+# /metrics exige 'Authorization: Bearer <METRICS_TOKEN>'; sin token no se sirve
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OPERATION_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+request_logger = logging.getLogger('primecolada.requests')
+
+class RequestMetrics:
+    """Counters of one request, filled by the instrumented Firestore client."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.firestore_calls = 0
+        self.firestore_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.serialize_depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+def current_metrics():
+    """Return the RequestMetrics of the request being served, or None."""
+    metrics = _current_metrics.get()
+    if metrics is None and has_request_context():
+        # Respuestas en streaming (stream_with_context): el cuerpo se genera
+        # después de teardown_request, pero el contexto de la petición sigue vivo
+        metrics = g.get('request_metrics')
+    return metrics
+
+def record_firestore_call(kind, seconds, reads=0, writes=0):
+    """Add one Firestore RPC to the current request (no-op outside requests)."""
+    metrics = current_metrics()
+    if metrics is None:
+        return
+    metrics.firestore_calls += 1
+    metrics.firestore_seconds += seconds
+    metrics.reads += reads
+    metrics.writes += writes
+    if kind == 'query':
+        metrics.queries += 1
+
+# --- Cliente de Firestore instrumentado ---
+
+def _timed_call(fn, kind, count_writes=None):
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            writes = count_writes(args, kwargs) if count_writes else 0
+            record_firestore_call(kind, time.perf_counter() - started, writes=writes)
+    return wrapped
+
+def _timed_stream(fn, kind, count_reads):
+    """Wrap a server-streaming RPC: time spent waiting for each response counts."""
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        started = time.perf_counter()
+        iterator = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+
+        def generate():
+            nonlocal elapsed
+            documents = 0
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        response = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    documents += count_reads(response)
+                    yield response
+            finally:
+                # Firestore factura al menos una lectura por consulta
+                record_firestore_call(kind, elapsed, reads=max(documents, 1))
+        return generate()
+    return wrapped
+
+def _commit_writes(args, kwargs):
+    commit_request = kwargs.get('request') or (args[0] if args else None)
+    if isinstance(commit_request, dict):
+        return len(commit_request.get('writes') or ())
+    return len(getattr(commit_request, 'writes', ()) or ())
+
+def _query_documents(response):
+    return 1 if response._pb.HasField('document') else 0
+
+def instrument_client(client):
+    """
+    Record every Firestore RPC of `client` in the current request's metrics.
+
+    The real client is instrumented at its GAPIC layer (the single point all
+    reads and writes go through); the in-memory backend at its equivalent
+    _snapshot/_run_query/_run_aggregation/_commit methods. Snapshot listeners are not counted.
+
+    Returns:
+        The same client, instrumented in place.
+    """
+    if client is None or not INSTRUMENTATION_ENABLED:
+        return client
+
+    if hasattr(client, '_run_query'):
+        # Backend en memoria (memory_firestore.MemoryClient)
+        snapshot, run_query, run_aggregation, commit = client._snapshot, client._run_query, client._run_aggregation, client._commit
+
+        def timed_snapshot(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return snapshot(*args, **kwargs)
+            finally:
+                record_firestore_call('get', time.perf_counter() - started, reads=1)
+
+        def timed_run_query(*args, **kwargs):
+            started = time.perf_counter()
+            results = []
+            try:
+                results = run_query(*args, **kwargs)
+                return results
+            finally:
+                record_firestore_call('query', time.perf_counter() - started, reads=max(len(results), 1))
+
+        def timed_run_aggregation(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return run_aggregation(*args, **kwargs)
+            finally:
+                record_firestore_call('query', time.perf_counter() - started, reads=1)
+
+        def timed_commit(writes, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return commit(writes, *args, **kwargs)
+            finally:
+                record_firestore_call('commit', time.perf_counter() - started, writes=len(writes))
+
+        client._snapshot, client._run_query, client._commit = timed_snapshot, timed_run_query, timed_commit
+        client._run_aggregation = timed_run_aggregation
+        return client
+
+    try:
+        api = client._firestore_api
+    except Exception as e:
+        logging.warning(f"Firestore instrumentation disabled: {e}")
+        return client
+    api.batch_get_documents = _timed_stream(api.batch_get_documents, 'get', lambda response: 1)
+    api.run_query = _timed_stream(api.run_query, 'query', _query_documents)
+    api.run_aggregation_query = _timed_stream(api.run_aggregation_query, 'query', lambda response: 1)
+    api.commit = _timed_call(api.commit, 'commit', _commit_writes)
+    api.begin_transaction = _timed_call(api.begin_transaction, 'begin_transaction')
+    api.rollback = _timed_call(api.rollback, 'rollback')
+    return client
+
+# --- Tiempo de (de)serialización ---
+
+class TimedSchema:
+    """
+    Wrapper of a schema (marshmallow or CompiledSchema) whose `dump` and
+    `load` add their time to the current request's serialization time.
+
+    Only the schemas wrapped explicitly are timed (see serializers.py);
+    marshmallow itself is left untouched. Other attributes go to the
+    wrapped schema.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def dump(self, *args, **kwargs):
+        return self._timed(self.schema.dump, args, kwargs)
+
+    def load(self, *args, **kwargs):
+        return self._timed(self.schema.load, args, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.schema, name)
+
+    @staticmethod
+    def _timed(method, args, kwargs):
+        metrics = current_metrics()
+        if metrics is None:
+            return method(*args, **kwargs)
+        # Un esquema cronometrado puede llamar a otro: solo mide el exterior
+        metrics.serialize_depth += 1
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            metrics.serialize_depth -= 1
+            if metrics.serialize_depth == 0:
+                metrics.serialize_seconds += time.perf_counter() - started
+
+# --- Histogramas (formato de exposición de Prometheus) ---
+
+class Histogram:
+    """Cumulative histogram with labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, documentation, buckets, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{{label_text}}} {series["count"]}')
+        return lines
+
+ENDPOINT_LABELS = ('method', 'endpoint', 'status')
+HISTOGRAMS = {
+    'total': Histogram('http_request_duration_seconds', 'Total request time.', LATENCY_BUCKETS, ENDPOINT_LABELS),
+    'firestore': Histogram('firestore_request_duration_seconds', 'Time spent in Firestore RPCs per request.', LATENCY_BUCKETS, ENDPOINT_LABELS),
+    'serialize': Histogram('serialization_duration_seconds', 'Time spent in schema dump/load per request.', LATENCY_BUCKETS, ENDPOINT_LABELS),
+    'reads': Histogram('firestore_document_reads', 'Firestore document reads per request.', OPERATION_BUCKETS, ENDPOINT_LABELS),
+    'writes': Histogram('firestore_document_writes', 'Firestore document writes per request.', OPERATION_BUCKETS, ENDPOINT_LABELS),
+    'queries': Histogram('firestore_queries', 'Firestore queries per request.', OPERATION_BUCKETS, ENDPOINT_LABELS),
+}
+
+def render_metrics():
+    """Return every histogram in Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+# --- Middleware ---
+
+def _server_timing(metrics, total):
+    return ', '.join([
+        f'firestore;dur={metrics.firestore_seconds * 1000:.2f};desc="reads={metrics.reads} writes={metrics.writes} queries={metrics.queries}"',
+        f'serialize;dur={metrics.serialize_seconds * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}'
+    ])
+
+def _finish_request(metrics, method, endpoint, path, status):
+    """Record a finished request (after streamed bodies have been sent)."""
+    total = metrics.elapsed()
+    labels = (method, endpoint, str(status))
+    HISTOGRAMS['total'].observe(labels, total)
+    HISTOGRAMS['firestore'].observe(labels, metrics.firestore_seconds)
+    HISTOGRAMS['serialize'].observe(labels, metrics.serialize_seconds)
+    HISTOGRAMS['reads'].observe(labels, metrics.reads)
+    HISTOGRAMS['writes'].observe(labels, metrics.writes)
+    HISTOGRAMS['queries'].observe(labels, metrics.queries)
+    if REQUEST_LOGS_ENABLED:
+        request_logger.info(json.dumps({
+            'event': 'request',
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'total_ms': round(total * 1000, 2),
+            'firestore_ms': round(metrics.firestore_seconds * 1000, 2),
+            'serialize_ms': round(metrics.serialize_seconds * 1000, 2),
+            'firestore_calls': metrics.firestore_calls,
+            'reads': metrics.reads,
+            'writes': metrics.writes,
+            'queries': metrics.queries
+        }))
+
+def init_instrumentation(app):
+    """Register the per-request metrics middleware and the /metrics endpoint."""
+    if not INSTRUMENTATION_ENABLED:
+        return
+
+    if REQUEST_LOGS_ENABLED and not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        request_logger.addHandler(handler)
+        request_logger.setLevel(logging.INFO)
+        request_logger.propagate = False
+
+    @app.before_request
+    def start_request_metrics():
+        metrics = RequestMetrics()
+        g.request_metrics = metrics
+        g.request_metrics_token = _current_metrics.set(metrics)
+
+    @app.after_request
+    def add_server_timing(response):
+        metrics = g.get('request_metrics')
+        if metrics is None:
+            return response
+        response.headers['Server-Timing'] = _server_timing(metrics, metrics.elapsed())
+        method, endpoint, path, status = request.method, request.url_rule.rule if request.url_rule else 'unmatched', request.path, response.status_code
+        # Las respuestas en streaming siguen leyendo de Firestore al enviarse
+        response.call_on_close(lambda: _finish_request(metrics, method, endpoint, path, status))
+        return response
+
+    @app.teardown_request
+    def reset_request_metrics(exc):
+        token = g.pop('request_metrics_token', None)
+        if token is not None:
+            _current_metrics.reset(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Aggregated per-endpoint histograms of this worker (Prometheus format)."""
+        if not METRICS_TOKEN:
+            return jsonify({'error': 'Metrics are disabled: METRICS_TOKEN is not set'}), 403
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return jsonify({'error': 'Unauthorized'}), 401
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
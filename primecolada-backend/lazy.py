@@ -0,0 +1,56 @@
+import importlib
+import threading
+
+# Inicialización diferida para el arranque en frío: el contenedor escala a
+# cero y el primer cliente espera a que un worker importe la app. Lo que no
+# hace falta para importarla (cliente de Firestore, Firebase Admin) se crea en
+# el primer uso, ya dentro de cada worker.
+
+_UNSET = object()
+
+class LazyProxy:
+    """
+    Stand-in for an object built on first use.
+
+    Attribute reads and writes, and truthiness, go to the object returned by
+    `factory()`, which is called once (thread-safe). A factory may return None
+    (e.g. Firestore could not be initialized): the proxy is then falsy, so the
+    existing `if not db:` guards keep working.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_target', _UNSET)
+        object.__setattr__(self, '_lazy_lock', threading.Lock())
+
+    @property
+    def initialized(self):
+        """Whether the factory has already run."""
+        return self._lazy_target is not _UNSET
+
+    def resolve(self):
+        """Return the target, building it on the first call."""
+        target = self._lazy_target
+        if target is _UNSET:
+            with self._lazy_lock:
+                target = self._lazy_target
+                if target is _UNSET:
+                    target = self._lazy_factory()
+                    object.__setattr__(self, '_lazy_target', target)
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __bool__(self):
+        return bool(self.resolve())
+
+    def __repr__(self):
+        return repr(self.resolve()) if self.initialized else f"<LazyProxy of {self._lazy_factory.__name__}>"
+
+def lazy_import(module_name):
+    """A module imported on first attribute access."""
+    return LazyProxy(lambda: importlib.import_module(module_name))
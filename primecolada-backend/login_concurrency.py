@@ -0,0 +1,137 @@
+# Concurrency check of POST /clients/login (the _login_txn transaction).
+#
+# Against the in-memory backend, fires parallel logins through the Flask test
+# client and checks the identity invariants:
+#   - N different users claiming the same shadow profile: exactly one wins
+#     (200 with the shadow profile), the rest get 409 and no profile is created.
+#   - The same user logging in N times at once with a new phone: exactly one
+#     profile is created and every response returns it.
+# Every backend call sleeps --rpc-latency-ms first, like a network round trip,
+# so the transactions really overlap (and conflict) as they would on Firestore.
+# Reports p50/p99/max latency and transaction retries, and exits with an error
+# if an invariant breaks or the slowest login exceeds --max-latency-ms.
+#
+#   python login_concurrency.py --logins 32 --rounds 20 --rpc-latency-ms 5
+
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Siempre contra el backend en memoria: nunca contra la base de datos real
+os.environ['FIRESTORE_BACKEND'] = 'memory'
+# Todas las peticiones salen de la misma IP: sin límite de peticiones
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import auth_middleware
+from app import app
+from db import db
+from phone_index import index_phone, lookup_client_id
+from uid_index import lookup_client_id_by_uid
+from benchmark import fake_verify_id_token, percentile
+
+def _login(client, uid, telefono):
+    started = time.perf_counter()
+    response = client.post('/clients/login', json={'telefono': telefono, 'nombre': uid},
+                           headers={'Authorization': f'Bearer {uid}'})
+    return response.status_code, response.get_json(), time.perf_counter() - started
+
+def _fire(logins, jobs):
+    """Run the (uid, telefono) logins at the same time; returns their results."""
+    client = app.test_client()
+    with ThreadPoolExecutor(max_workers=logins) as executor:
+        return list(executor.map(lambda job: _login(client, *job), jobs))
+
+def _profiles_with_phone(telefono):
+    return [doc for doc in db.collection('clients').where('telefono', '==', telefono).stream()]
+
+def claim_round(round_index, logins):
+    """N users race for one shadow profile. Returns (errors, latencies)."""
+    telefono = f"+3461{round_index:07d}"
+    shadow_ref = db.collection('clients').document(f"shadow-{round_index}")
+    batch = db.batch()
+    batch.set(shadow_ref, {'nombre': 'Sombra', 'telefono': telefono, 'firebase_uid': None})
+    index_phone(batch, telefono, shadow_ref.id)
+    batch.commit()
+
+    uids = [f"claim-{round_index}-{i}" for i in range(logins)]
+    results = _fire(logins, [(uid, telefono) for uid in uids])
+
+    errors = []
+    winners = [uid for uid, (status, _, _) in zip(uids, results) if status == 200]
+    statuses = sorted({status for status, _, _ in results})
+    if len(winners) != 1 or statuses != [200, 409]:
+        errors.append(f"claim round {round_index}: {len(winners)} winners, statuses {statuses}")
+    owner = shadow_ref.get().to_dict().get('firebase_uid')
+    if winners and owner != winners[0]:
+        errors.append(f"claim round {round_index}: shadow owned by {owner}, 200 returned to {winners[0]}")
+    if len(_profiles_with_phone(telefono)) != 1 or lookup_client_id(telefono) != shadow_ref.id:
+        errors.append(f"claim round {round_index}: phone {telefono} no longer maps to one profile")
+    if owner and lookup_client_id_by_uid(owner) != shadow_ref.id:
+        errors.append(f"claim round {round_index}: uid_index of {owner} does not point at the shadow")
+    losers_indexed = [uid for uid in uids if uid != owner and lookup_client_id_by_uid(uid)]
+    if losers_indexed:
+        errors.append(f"claim round {round_index}: profiles created for losers {losers_indexed}")
+    return errors, [elapsed for _, _, elapsed in results]
+
+def create_round(round_index, logins):
+    """One user logs in N times at once with a new phone. Returns (errors, latencies)."""
+    uid = f"create-{round_index}"
+    telefono = f"+3462{round_index:07d}"
+    results = _fire(logins, [(uid, telefono)] * logins)
+
+    errors = []
+    statuses = sorted({status for status, _, _ in results})
+    ids = {body.get('id') for status, body, _ in results if status == 200}
+    profiles = _profiles_with_phone(telefono)
+    if statuses != [200] or len(ids) != 1 or len(profiles) != 1:
+        errors.append(f"create round {round_index}: statuses {statuses}, {len(ids)} ids, {len(profiles)} profiles")
+    elif lookup_client_id_by_uid(uid) != profiles[0].id or lookup_client_id(telefono) != profiles[0].id:
+        errors.append(f"create round {round_index}: indexes do not point at profile {profiles[0].id}")
+    return errors, [elapsed for _, _, elapsed in results]
+
+def _with_latency(call, seconds):
+    def delayed(*args, **kwargs):
+        time.sleep(seconds)
+        return call(*args, **kwargs)
+    return delayed
+
+def run(logins, rounds, rpc_latency):
+    auth_middleware.auth.verify_id_token = fake_verify_id_token
+    # Los 409 esperados registran avisos de seguridad en cada ronda
+    logging.disable(logging.WARNING)
+    db.reset()
+    # Las "RPC" del backend en memoria (ver MemoryClient) con latencia de red
+    for name in ('_snapshot', '_run_query', '_commit'):
+        setattr(db, name, _with_latency(getattr(db, name), rpc_latency))
+    errors = []
+    latencies = []
+    for round_index in range(rounds):
+        for scenario in (claim_round, create_round):
+            round_errors, round_latencies = scenario(round_index, logins)
+            errors += round_errors
+            latencies += round_latencies
+    return errors, sorted(latencies)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fire parallel logins for the same phone and check the invariants.")
+    parser.add_argument('--logins', type=int, default=16, help="Concurrent logins per round.")
+    parser.add_argument('--rounds', type=int, default=10, help="Rounds of each scenario.")
+    parser.add_argument('--rpc-latency-ms', type=float, default=2, help="Simulated round trip of each Firestore call.")
+    parser.add_argument('--max-latency-ms', type=float, default=1000, help="Fail if a login takes longer.")
+    args = parser.parse_args()
+
+    errors, latencies = run(args.logins, args.rounds, args.rpc_latency_ms / 1000)
+    print(f"{len(latencies)} logins, {args.logins} at a time: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms, "
+          f"{db.stats['aborts']} transaction retries")
+    for error in errors:
+        print(error, file=sys.stderr)
+    if latencies[-1] * 1000 > args.max_latency_ms:
+        print(f"Slowest login took more than {args.max_latency_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+    if errors:
+        sys.exit(1)
+    print("OK: one owner per phone, one profile per user.")
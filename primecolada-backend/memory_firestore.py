@@ -0,0 +1,785 @@
+# In-process stand-in for the subset of google-cloud-firestore used by this backend.
+#
+# Selected with FIRESTORE_BACKEND=memory (see db.py). Used by the benchmark
+# harness and for offline development: no network, no credentials. Supports
+# collections, document get/set/update/delete/create, where/order_by/limit/
+# start_after/select queries, count/sum/avg aggregation queries, WriteBatch, BulkWriter, get_all, update-time preconditions,
+# SERVER_TIMESTAMP/Increment/DELETE_FIELD transforms, optimistic
+# transactions compatible with @firestore.transactional and on_snapshot
+# listeners (delivered synchronously at the end of each commit).
+
+import copy
+import functools
+import logging
+import threading
+import uuid
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import ReadAfterWriteError
+from google.cloud.firestore_v1.base_aggregation import AggregationResult
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MISSING = object()
+# Firestore rechaza los commits (batch o transacción) de más escrituras
+MAX_WRITES_PER_COMMIT = 500
+
+def _normalize(value):
+    """Mirror Firestore's encoding: naive datetimes are stored as UTC, tuples as lists."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+def _split_path(field_path):
+    return [part.strip('`') for part in field_path.split('.')]
+
+def _get_field(data, field_path):
+    current = data
+    for part in _split_path(field_path):
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+def _compare(left, right):
+    """Three-way comparison; values of different types order by type name."""
+    try:
+        return (left > right) - (left < right)
+    except TypeError:
+        left_type, right_type = type(left).__name__, type(right).__name__
+        return (left_type > right_type) - (left_type < right_type)
+
+def _matches(value, op, expected):
+    if value is _MISSING:
+        return False
+    try:
+        if op == '==':
+            return value == expected
+        if op == '!=':
+            return value != expected
+        if op == '<':
+            return value < expected
+        if op == '<=':
+            return value <= expected
+        if op == '>':
+            return value > expected
+        if op == '>=':
+            return value >= expected
+        if op == 'in':
+            return value in expected
+        if op == 'not-in':
+            return value not in expected
+        if op == 'array_contains':
+            return isinstance(value, list) and expected in value
+        if op == 'array_contains_any':
+            return isinstance(value, list) and any(item in value for item in expected)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+class _Precondition:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+class MemorySnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+class MemoryDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return MemoryCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, collection_id):
+        return MemoryCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        if transaction is not None:
+            transaction._check_read()
+        snapshot = self._client._snapshot(self, field_paths)
+        if transaction is not None:
+            transaction._record_read(snapshot)
+        return snapshot
+
+    def create(self, document_data):
+        return self._client._commit([('create', self, document_data, False, None)])[0]
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self, document_data, merge, None)])[0]
+
+    def update(self, field_updates, option=None):
+        return self._client._commit([('update', self, field_updates, False, option)])[0]
+
+    def delete(self, option=None):
+        self._client._commit([('delete', self, None, False, option)])
+        return self._client._now()
+
+    def on_snapshot(self, callback):
+        return self._client._watch(MemoryWatch(self._client, callback, document_path=self.path))
+
+class MemoryQuery:
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None,
+                 offset=0, cursor=None, projection=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders, 'limit': self._limit,
+            'offset': self._offset, 'cursor': self._cursor, 'projection': self._projection
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, _normalize(value)),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def count(self, alias=None):
+        return MemoryAggregationQuery(self).count(alias=alias)
+
+    def sum(self, field_ref, alias=None):
+        return MemoryAggregationQuery(self).sum(field_ref, alias=alias)
+
+    def avg(self, field_ref, alias=None):
+        return MemoryAggregationQuery(self).avg(field_ref, alias=alias)
+
+    def _sort_value(self, snapshot, field_path):
+        if field_path == '__name__':
+            return snapshot.id
+        return _get_field(snapshot._data, field_path)
+
+    def _cursor_values(self, orders):
+        cursor = self._cursor
+        if isinstance(cursor, MemorySnapshot):
+            return [self._sort_value(cursor, field) for field, _ in orders]
+        values = []
+        for field, _ in orders[:len(cursor)]:
+            value = cursor.get(field, _MISSING)
+            if isinstance(value, MemoryDocumentReference):
+                value = value.id
+            values.append(_normalize(value))
+        return values
+
+    def _run(self, ordered=True):
+        snapshots = [
+            snapshot for snapshot in self._client._documents_in(self._collection_path)
+            if self._matches_document(snapshot._data)
+        ]
+        orders = list(self._orders)
+        if not any(field == '__name__' for field, _ in orders):
+            orders.append(('__name__', orders[-1][1] if orders else 'ASCENDING'))
+        # Firestore excluye los documentos sin el campo de ordenación
+        snapshots = [
+            snapshot for snapshot in snapshots
+            if all(self._sort_value(snapshot, field) is not _MISSING for field, _ in orders)
+        ]
+
+        def compare_values(left_values, right_values):
+            for (_, direction), left, right in zip(orders, left_values, right_values):
+                result = _compare(left, right)
+                if result:
+                    return -result if direction == firestore.Query.DESCENDING else result
+            return 0
+
+        if not ordered and self._limit is None and not self._offset and self._cursor is None:
+            # Agregaciones sin límite ni cursor: el orden no cambia el resultado
+            return snapshots
+
+        keyed = [([self._sort_value(snapshot, field) for field, _ in orders], snapshot) for snapshot in snapshots]
+        keyed.sort(key=functools.cmp_to_key(lambda a, b: compare_values(a[0], b[0])))
+
+        if self._cursor is not None:
+            cursor_values = self._cursor_values(orders)
+            keyed = [item for item in keyed if compare_values(item[0][:len(cursor_values)], cursor_values) > 0]
+
+        results = [snapshot for _, snapshot in keyed][self._offset:]
+        if self._limit is not None:
+            results = results[:self._limit]
+        if self._projection is not None:
+            results = [self._client._project(snapshot, self._projection) for snapshot in results]
+        return results
+
+    def stream(self, transaction=None):
+        if transaction is not None:
+            transaction._check_read()
+        results = self._client._run_query(self)
+        if transaction is not None:
+            for snapshot in results:
+                transaction._record_read(snapshot)
+        return iter(results)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        if self._limit is not None or self._offset or self._cursor is not None:
+            raise NotImplementedError("Listeners on limited or paginated queries are not supported.")
+        return self._client._watch(MemoryWatch(self._client, callback, query=self))
+
+    def _matches_document(self, data):
+        return all(_matches(_get_field(data, field), op, value) for field, op, value in self._filters)
+
+class MemoryAggregationQuery:
+    """count()/sum()/avg() over a MemoryQuery, evaluated like Firestore's aggregation queries."""
+
+    def __init__(self, query):
+        self._query = query
+        self._aggregations = []
+
+    def _add(self, kind, field_ref, alias):
+        self._aggregations.append((kind, field_ref, alias or f"field_{len(self._aggregations) + 1}"))
+        return self
+
+    def count(self, alias=None):
+        return self._add('count', None, alias)
+
+    def sum(self, field_ref, alias=None):
+        return self._add('sum', field_ref, alias)
+
+    def avg(self, field_ref, alias=None):
+        return self._add('avg', field_ref, alias)
+
+    def _evaluate(self, snapshots, read_time):
+        results = []
+        for kind, field_ref, alias in self._aggregations:
+            if kind == 'count':
+                value = len(snapshots)
+            else:
+                # Solo cuentan los valores numéricos (los bool no lo son en Firestore)
+                numbers = [
+                    value for value in (_get_field(snapshot._data, field_ref) for snapshot in snapshots)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)
+                ]
+                if kind == 'sum':
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+            results.append(AggregationResult(alias=alias, value=value, read_time=read_time))
+        return results
+
+    def get(self, transaction=None, **kwargs):
+        if transaction is not None:
+            transaction._check_read()
+        return [self._query._client._run_aggregation(self)]
+
+    def stream(self, transaction=None, **kwargs):
+        return iter(self.get(transaction=transaction))
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return MemoryDocumentReference(self._client, f"{self._collection_path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        doc_ref = self.document(document_id)
+        doc_ref.create(document_data)
+        return self._client._now(), doc_ref
+
+    def list_documents(self):
+        return [snapshot.reference for snapshot in self._client._documents_in(self._collection_path)]
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, False, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, False, option))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+class MemoryBulkWriter(MemoryWriteBatch):
+    """
+    BulkWriter stand-in: writes are committed in batches of `batch_size`,
+    each write independently (a failing write does not roll back the rest).
+    Failures are reported once to the on_write_error callback, with an
+    object shaped like BulkWriteFailure; they are never retried.
+    """
+
+    batch_size = 20
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._on_error = None
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def _add(self, write):
+        if self._closed:
+            raise Exception("BulkWriter is closed and cannot accept new operations")
+        with self._lock:
+            self._writes.append(write)
+            ready = len(self._writes) >= self.batch_size
+        if ready:
+            self.flush()
+
+    def create(self, reference, document_data):
+        self._add(('create', reference, document_data, False, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._add(('set', reference, document_data, merge, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._add(('update', reference, field_updates, False, option))
+
+    def delete(self, reference, option=None):
+        self._add(('delete', reference, None, False, option))
+
+    def flush(self):
+        with self._lock:
+            writes, self._writes = self._writes, []
+        for write in writes:
+            try:
+                self._client._commit([write])
+            except exceptions.GoogleAPICallError as e:
+                if self._on_error is not None:
+                    failure = SimpleNamespace(operation=write, code=e.grpc_status_code, message=str(e), attempts=1)
+                    self._on_error(failure, self)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+
+class MemoryTransaction(MemoryWriteBatch):
+    """Optimistic transaction: commit aborts if any document read has changed since."""
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        try:
+            return self._client._commit(self._writes, expected_versions=self._reads)
+        finally:
+            self._clean_up()
+
+    def _check_read(self):
+        if self._writes:
+            raise ReadAfterWriteError("Attempted read after write in a transaction.")
+
+    def _record_read(self, snapshot):
+        self._reads.setdefault(snapshot.reference.path, snapshot.update_time)
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references):
+        return self._client.get_all(references, transaction=self)
+
+class MemoryWatch:
+    """
+    Listener on a query or a single document (see on_snapshot).
+
+    Like Firestore's Watch, the callback first receives the current result set
+    (every document ADDED) and then one call per commit that changes it, with
+    the signature callback(docs, changes, read_time).
+    """
+
+    def __init__(self, client, callback, query=None, document_path=None):
+        self._client = client
+        self._callback = callback
+        self._query = query
+        self._document_path = document_path
+        self._docs = {}
+        self._active = True
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def unsubscribe(self):
+        self._client._unwatch(self)
+
+    def close(self, reason=None):
+        self.unsubscribe()
+
+    def _watches_path(self, path):
+        if self._document_path is not None:
+            return path == self._document_path
+        return path.rsplit('/', 1)[0] == self._query._collection_path
+
+    def _matches(self, data):
+        return self._document_path is not None or self._query._matches_document(data)
+
+    def _initial(self, read_time):
+        if self._document_path is not None:
+            stored = self._client._stored(self._document_path)
+            snapshots = [] if stored is None else [
+                MemorySnapshot(MemoryDocumentReference(self._client, self._document_path), stored[0], stored[1], stored[2], read_time)
+            ]
+        else:
+            snapshots = self._query._run()
+        self._docs = {snapshot.reference.path: snapshot for snapshot in snapshots}
+        changes = [DocumentChange(ChangeType.ADDED, snapshot, -1, index) for index, snapshot in enumerate(snapshots)]
+        self._deliver(changes, read_time)
+
+    def _apply(self, staged, read_time):
+        """Diff the staged writes of a commit against the listener's result set."""
+        changes = []
+        for path, stored in staged.items():
+            if not self._watches_path(path):
+                continue
+            previous = self._docs.get(path)
+            if stored is not None and self._matches(stored[0]):
+                snapshot = MemorySnapshot(MemoryDocumentReference(self._client, path), stored[0], stored[1], stored[2], read_time)
+                self._docs[path] = snapshot
+                change_type = ChangeType.MODIFIED if previous else ChangeType.ADDED
+                changes.append(DocumentChange(change_type, snapshot, -1 if previous is None else 0, 0))
+            elif previous is not None:
+                del self._docs[path]
+                changes.append(DocumentChange(ChangeType.REMOVED, previous, 0, -1))
+        if changes:
+            # Firestore factura cada documento que el listener recibe
+            self._client.stats['reads'] += len(changes)
+            self._deliver(changes, read_time)
+
+    def _deliver(self, changes, read_time):
+        try:
+            self._callback(list(self._docs.values()), changes, read_time)
+        except Exception:
+            # Como en Firestore, un fallo del callback no afecta a la escritura
+            logging.exception("Snapshot listener callback failed")
+
+class MemoryClient:
+    """In-memory Firestore client. Thread-safe; every commit is atomic."""
+
+    def __init__(self, project='memory', database='(default)'):
+        self.project = project
+        self._database = database
+        self._documents = {}
+        self._lock = threading.RLock()
+        self._clock = _EPOCH
+        self._watches = []
+        self.stats = {'reads': 0, 'writes': 0, 'commits': 0, 'aborts': 0}
+
+    # --- API pública (subconjunto de google.cloud.firestore.Client) ---
+
+    def collection(self, *collection_path):
+        return MemoryCollectionReference(self, '/'.join(collection_path))
+
+    def document(self, *document_path):
+        return MemoryDocumentReference(self, '/'.join(document_path))
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return MemoryTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def bulk_writer(self, options=None):
+        return MemoryBulkWriter(self)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return _Precondition(last_update_time=last_update_time, exists=exists)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        for reference in references:
+            yield reference.get(field_paths=field_paths, transaction=transaction)
+
+    def collections(self):
+        with self._lock:
+            roots = sorted(path for path, documents in self._documents.items() if '/' not in path and documents)
+        return [self.collection(root) for root in roots]
+
+    def reset(self):
+        """Drop every document (handy between benchmark runs). Listeners are closed."""
+        with self._lock:
+            self._documents = {}
+            self.stats = {key: 0 for key in self.stats}
+            for watch in self._watches:
+                watch._active = False
+            self._watches = []
+
+    # --- Implementación ---
+
+    def _now(self):
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            # update_time estrictamente creciente, como en Firestore
+            self._clock = max(now, self._clock + timedelta(microseconds=1))
+            return self._clock
+
+    def _watch(self, watch):
+        with self._lock:
+            self._watches.append(watch)
+            watch._initial(self._now())
+            # La carga inicial se factura como lectura de cada documento
+            self.stats['reads'] += max(len(watch._docs), 1)
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            watch._active = False
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _stored(self, path):
+        collection_path, doc_id = path.rsplit('/', 1)
+        return self._documents.get(collection_path, {}).get(doc_id)
+
+    # _snapshot, _run_query, _run_aggregation y _commit hacen de "RPC": todas las lecturas y
+    # escrituras pasan por ellos (es lo que instrumenta instrumentation.py).
+
+    def _run_query(self, query):
+        results = query._run()
+        with self._lock:
+            # Firestore factura los documentos devueltos (mínimo uno por consulta)
+            self.stats['reads'] += max(len(results), 1)
+        return results
+
+    def _run_aggregation(self, aggregation_query):
+        snapshots = aggregation_query._query._run(ordered=False)
+        with self._lock:
+            # Una lectura por cada 1000 entradas de índice (mínimo una)
+            self.stats['reads'] += max(-(-len(snapshots) // 1000), 1)
+            read_time = self._now()
+        return aggregation_query._evaluate(snapshots, read_time)
+
+    def _snapshot(self, reference, field_paths=None):
+        with self._lock:
+            self.stats['reads'] += 1
+            stored = self._stored(reference.path)
+            read_time = self._now()
+        if stored is None:
+            return MemorySnapshot(reference, None, read_time=read_time)
+        # Los documentos guardados nunca se modifican in situ (copy-on-write en
+        # _commit), así que el snapshot puede compartirlos; to_dict() copia.
+        data, create_time, update_time = stored
+        snapshot = MemorySnapshot(reference, data, create_time, update_time, read_time)
+        if field_paths is not None:
+            snapshot = self._project(snapshot, field_paths)
+        return snapshot
+
+    def _project(self, snapshot, field_paths):
+        projected = {}
+        for field_path in field_paths:
+            value = _get_field(snapshot._data, field_path)
+            if value is _MISSING:
+                continue
+            target = projected
+            parts = _split_path(field_path)
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return MemorySnapshot(snapshot.reference, projected, snapshot.create_time, snapshot.update_time, snapshot.read_time)
+
+    def _documents_in(self, collection_path):
+        with self._lock:
+            stored_documents = list(self._documents.get(collection_path, {}).items())
+            read_time = self._now()
+        return [
+            MemorySnapshot(MemoryDocumentReference(self, f"{collection_path}/{doc_id}"), data, create_time, update_time, read_time)
+            for doc_id, (data, create_time, update_time) in stored_documents
+        ]
+
+    def _apply_value(self, target, key, value, now):
+        if value is firestore.SERVER_TIMESTAMP:
+            target[key] = now
+        elif value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, firestore.Increment):
+            current = target.get(key)
+            target[key] = (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+        elif isinstance(value, (firestore.ArrayUnion, firestore.ArrayRemove)):
+            current = list(target.get(key) or [])
+            for item in _normalize(value.values):
+                if isinstance(value, firestore.ArrayUnion) and item not in current:
+                    current.append(item)
+                elif isinstance(value, firestore.ArrayRemove):
+                    current = [existing for existing in current if existing != item]
+            target[key] = current
+        else:
+            target[key] = _normalize(self._resolve_sentinels(value, now))
+
+    def _resolve_sentinels(self, value, now):
+        if value is firestore.SERVER_TIMESTAMP:
+            return now
+        if isinstance(value, dict):
+            return {
+                key: self._resolve_sentinels(item, now) for key, item in value.items()
+                if item is not firestore.DELETE_FIELD
+            }
+        return value
+
+    def _merge_into(self, target, data, now):
+        for key, value in data.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge_into(target[key], value, now)
+            elif isinstance(value, dict):
+                target[key] = {}
+                self._merge_into(target[key], value, now)
+            else:
+                self._apply_value(target, key, value, now)
+
+    def _commit(self, writes, expected_versions=None):
+        if len(writes) > MAX_WRITES_PER_COMMIT:
+            raise exceptions.InvalidArgument(f"maximum {MAX_WRITES_PER_COMMIT} writes allowed per request")
+        with self._lock:
+            if expected_versions:
+                for path, update_time in expected_versions.items():
+                    stored = self._stored(path)
+                    current = stored[2] if stored else None
+                    if current != update_time:
+                        self.stats['aborts'] += 1
+                        raise exceptions.Aborted(f"Transaction aborted: {path} changed since it was read.")
+
+            # Se prepara todo sobre una capa aparte: el commit es todo o nada
+            staged = {}
+            now = self._now()
+            results = []
+            for kind, reference, data, merge, option in writes:
+                stored = staged[reference.path] if reference.path in staged else self._stored(reference.path)
+                if option is not None:
+                    if option.exists is not None and option.exists != (stored is not None):
+                        raise exceptions.FailedPrecondition(f"Precondition failed for {reference.path}")
+                    if option.last_update_time is not None and (stored is None or stored[2] != option.last_update_time):
+                        raise exceptions.FailedPrecondition(f"Document {reference.path} was modified concurrently.")
+
+                results.append(now)
+                if kind == 'delete':
+                    staged[reference.path] = None
+                    continue
+                if kind == 'create' and stored is not None:
+                    raise exceptions.AlreadyExists(f"Document already exists: {reference.path}")
+                if kind == 'update' and stored is None:
+                    raise exceptions.NotFound(f"No document to update: {reference.path}")
+
+                create_time = stored[1] if stored else now
+                if kind == 'update':
+                    document = copy.deepcopy(stored[0])
+                    for field_path, value in data.items():
+                        parts = _split_path(field_path)
+                        target = document
+                        for part in parts[:-1]:
+                            if not isinstance(target.get(part), dict):
+                                target[part] = {}
+                            target = target[part]
+                        self._apply_value(target, parts[-1], value, now)
+                elif kind == 'set' and merge and stored is not None:
+                    document = copy.deepcopy(stored[0])
+                    self._merge_into(document, data, now)
+                else:
+                    document = {}
+                    self._merge_into(document, data, now)
+                staged[reference.path] = (document, create_time, now)
+
+            for path, stored in staged.items():
+                collection_path, doc_id = path.rsplit('/', 1)
+                if stored is None:
+                    self._documents.get(collection_path, {}).pop(doc_id, None)
+                else:
+                    self._documents.setdefault(collection_path, {})[doc_id] = stored
+            self.stats['writes'] += len(writes)
+            self.stats['commits'] += 1
+            for watch in list(self._watches):
+                watch._apply(staged, now)
+            return results
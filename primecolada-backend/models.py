@@ -26,6 +26,11 @@ class ClientSchema(Schema):
     firebase_uid = fields.Str(required=False, allow_none=True)
     created_at = fields.DateTime(dump_only=True)
 
+    # Agregados mantenidos por las escrituras de ventas
+    total_ventas = fields.Int(dump_only=True)
+    gasto_total = fields.Int(dump_only=True)
+    last_purchase_date = fields.DateTime(dump_only=True, allow_none=True)
+
 class VentaSchema(Schema):
     class Meta:
         unknown = EXCLUDE
@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+import sys
+from google.cloud import firestore
+from db import db
+
+# Índice teléfono -> cliente: phone_index/<E.164> = {'client_id': ...}
+# Permite resolver un cliente por teléfono con un solo get y, al escribirse en
+# la misma transacción que el cliente, impide que haya dos con el mismo número.
+PHONE_INDEX_COLLECTION = 'phone_index'
+
+class PhoneConflictError(Exception):
+    """The phone number is already indexed to a different client."""
+
+# Prefijo por defecto para números nacionales (España)
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_PHONE_COUNTRY_CODE', '34')
+
+# Longitud de un número E.164 sin el '+': de 8 (prefijo + número corto) a 15
+MIN_PHONE_DIGITS = 8
+MAX_PHONE_DIGITS = 15
+
+def normalize_phone(telefono):
+    """
+    Normalize a phone number to E.164 ('+34600111222').
+
+    Numbers without an international prefix get DEFAULT_COUNTRY_CODE.
+
+    Raises:
+        ValueError: If the input is not a phone number (no digits, letters,
+            or not MIN_PHONE_DIGITS to MAX_PHONE_DIGITS digits once normalized).
+    """
+    raw = str(telefono).strip()
+    digits = re.sub(r'\D', '', raw)
+    if not digits or re.search(r'[^\d\s().+-]', raw):
+        raise ValueError(f"Invalid phone number: {telefono!r}")
+
+    if raw.startswith('+'):
+        normalized = digits
+    elif digits.startswith('00'):
+        normalized = digits[2:]
+    elif len(digits) == 9:
+        normalized = f"{DEFAULT_COUNTRY_CODE}{digits}"
+    else:
+        normalized = digits
+    if not MIN_PHONE_DIGITS <= len(normalized) <= MAX_PHONE_DIGITS:
+        raise ValueError(f"Invalid phone number: {telefono!r} (expected {MIN_PHONE_DIGITS} to {MAX_PHONE_DIGITS} digits with the country code)")
+    return f"+{normalized}"
+
+def legacy_phone_forms(telefono):
+    """
+    The ways a phone may be stored in the 'telefono' field of clients that
+    predate phone_index: as typed, in E.164, and without '+' or without the
+    default country code. Used to find un-backfilled clients with an 'in'
+    query, so the same number written in two formats resolves to one client.
+    """
+    normalized = normalize_phone(telefono)
+    forms = [str(telefono).strip(), normalized, normalized[1:]]
+    if normalized.startswith(f"+{DEFAULT_COUNTRY_CODE}"):
+        forms.append(normalized[1 + len(DEFAULT_COUNTRY_CODE):])
+    return list(dict.fromkeys(forms))
+
+def phone_index_ref(telefono):
+    """Return the phone_index DocumentReference for a (raw) phone number."""
+    return db.collection(PHONE_INDEX_COLLECTION).document(normalize_phone(telefono))
+
+def lookup_client_id(telefono, transaction=None):
+    """
+    Resolve the client owning a phone number with a single document get.
+
+    Returns:
+        str | None: The client document ID, or None if the phone is not indexed.
+    """
+    snapshot = phone_index_ref(telefono).get(transaction=transaction)
+    return snapshot.to_dict().get('client_id') if snapshot.exists else None
+
+def index_phone(transaction, telefono, client_id):
+    """Point a phone number at a client inside an open transaction (or batch)."""
+    transaction.set(phone_index_ref(telefono), {
+        'client_id': client_id,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
+
+def unindex_phone(transaction, telefono):
+    """
+    Remove a phone number from the index inside an open transaction.
+
+    Only call this after reading the entry in the same transaction and
+    checking it still points at the client being changed.
+    """
+    transaction.delete(phone_index_ref(telefono))
+
+def backfill_phone_index(dry_run=False):
+    """
+    One-off tool: build phone_index from 'clients' and merge duplicates.
+
+    Clients are grouped by normalized phone. In each group the survivor is
+    the profile with a firebase_uid (or the oldest one); the ventas of the
+    other profiles are re-pointed to it and the duplicates are deleted.
+    Groups with more than one registered owner are left untouched and logged.
+
+    Returns:
+        dict: Summary counters of the run.
+    """
+    groups = {}
+    for doc in db.collection('clients').stream():
+        client = doc.to_dict()
+        if not client.get('telefono'):
+            continue
+        try:
+            key = normalize_phone(client['telefono'])
+        except ValueError:
+            logging.warning(f"Skipping client {doc.id} with invalid phone {client['telefono']!r}")
+            continue
+        groups.setdefault(key, []).append((doc, client))
+
+    summary = {'indexed': 0, 'merged': 0, 'ventas_repointed': 0, 'conflicts': 0}
+    for phone, members in groups.items():
+        owners = {client.get('firebase_uid') for _, client in members if client.get('firebase_uid')}
+        if len(owners) > 1:
+            logging.warning(f"CONFLICT: phone {phone} is owned by several accounts: {sorted(owners)}")
+            summary['conflicts'] += 1
+            continue
+
+        members.sort(key=lambda member: (
+            not member[1].get('firebase_uid'),
+            str(member[1].get('created_at') or '')
+        ))
+        survivor = members[0][0]
+        duplicates = [doc for doc, _ in members[1:]]
+
+        batch = db.batch()
+        pending = 0
+        for duplicate in duplicates:
+            for venta in db.collection('ventas').where('client_id', '==', duplicate.id).stream():
+                batch.update(venta.reference, {'client_id': survivor.id})
+                pending += 1
+                summary['ventas_repointed'] += 1
+                if pending >= 450:
+                    if not dry_run:
+                        batch.commit()
+                    batch = db.batch()
+                    pending = 0
+            batch.delete(duplicate.reference)
+            pending += 1
+            summary['merged'] += 1
+            logging.info(f"MERGE: client {duplicate.id} -> {survivor.id} ({phone})")
+
+        batch.set(db.collection(PHONE_INDEX_COLLECTION).document(phone), {
+            'client_id': survivor.id,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        summary['indexed'] += 1
+        if not dry_run:
+            batch.commit()
+
+    return summary
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not db:
+        print("Firestore not initialized. Aborting backfill.")
+    else:
+        dry_run = '--dry-run' in sys.argv
+        print(f"Backfilling phone index{' (dry run)' if dry_run else ''}...")
+        print(backfill_phone_index(dry_run=dry_run))
+        if not dry_run:
+            # Las ventas re-apuntadas cambian los agregados de los clientes
+            from counters import rebuild_aggregates
+            rebuild_aggregates()
+        print("Backfill finished.")
@@ -1,10 +1,19 @@
+import argparse
+import hashlib
+import json
+import math
 import random
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from faker import Faker
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from google.cloud import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
 from db import db  # Import the Firestore client from db.py
 from enums import VentaState
+from counters import rebuild_aggregates
+from phone_index import index_phone
 
 # Initialize Faker
 fake = Faker('es_ES')
@@ -24,7 +33,7 @@ def create_random_venta():
     total = (coste_lavadora or 0) + (coste_secadora or 0)
 
     # Simulate a credible lifecycle
-    now = datetime.now()
+    now = datetime.now(timezone.utc)
     created_at = now - timedelta(days=random.randint(0, 30), hours=random.randint(0, 23), minutes=random.randint(0, 59))
     
     # Define the state progression, excluding ERROR
@@ -72,6 +81,339 @@ def create_random_venta():
     }
     return payload
 
+def create_random_ventas(count, seed=None, num_clients=None, days=30, now=None):
+    """
+    Vectorized version of create_random_venta: builds `count` payloads at once.
+
+    Every random column (customer, costs, timestamps, lifecycle stage) is
+    drawn in a single pass from one seeded generator, so the output is
+    reproducible (pass `now` too for byte-identical runs). Customers come from
+    a pool of `num_clients` (a third of `count` by default), which gives
+    repeat customers like in the shop.
+    """
+    rng = random.Random(seed)
+    faker = Faker('es_ES')
+    faker.seed_instance(seed)
+
+    num_clients = num_clients or max(1, count // 3)
+    # Generar nombres con Faker es lento: se reutiliza un conjunto limitado
+    names = [faker.name() for _ in range(min(num_clients, 1000))]
+    phones = rng.sample(range(600000000, 700000000), num_clients)
+
+    possible_states = [s for s in VentaState if s != VentaState.ERROR]
+    now = now or datetime.now(timezone.utc)
+
+    customers = rng.choices(range(num_clients), k=count)
+    lavadoras = [rng.randint(5, 20) if flip else None for flip in rng.choices([True, False], k=count)]
+    secadoras = [rng.randint(5, 15) if flip else None for flip in rng.choices([True, False], k=count)]
+    ages = [timedelta(minutes=minutes) for minutes in rng.choices(range(days * 24 * 60), k=count)]
+    stages = rng.choices(range(len(possible_states)), k=count)
+    delays = [rng.randint(5, 120) for _ in range(count * len(possible_states))]
+
+    ventas = []
+    for i in range(count):
+        created_at = now - ages[i]
+        historial_estados = {}
+        current_time = created_at
+        for step in range(stages[i] + 1):
+            salida = None if step == stages[i] else current_time + timedelta(minutes=delays[i * len(possible_states) + step])
+            historial_estados[str(possible_states[step].value)] = {
+                'entrada': current_time,
+                'salida': salida
+            }
+            if salida:
+                current_time = salida
+
+        ventas.append({
+            "nombre": names[customers[i] % len(names)],
+            "telefono": phones[customers[i]],
+            "estado_actual": possible_states[stages[i]].value,
+            "coste": {
+                "lavadora": lavadoras[i],
+                "secadora": secadoras[i],
+                "total": (lavadoras[i] or 0) + (secadoras[i] or 0)
+            },
+            "created_at": created_at,
+            "updated_at": current_time,
+            "historial_estados": historial_estados
+        })
+    return ventas
+
+# --- Sembrado masivo: BulkWriter en paralelo, perfiles de volumen ---
+
+# Perfiles de volumen: días de histórico, pedidos por día, proporción de
+# ventas de clientes que repiten y reparto del estado final de las ventas
+VOLUME_PROFILES = {
+    'demo': {
+        'days': 30,
+        'orders_per_day': 20,
+        'repeat_customer_ratio': 0.5,
+        'state_weights': {1: 0.05, 2: 0.05, 3: 0.10, 4: 0.80, 0: 0.0}
+    },
+    'shop': {
+        'days': 365,
+        'orders_per_day': 80,
+        'repeat_customer_ratio': 0.7,
+        'state_weights': {1: 0.02, 2: 0.02, 3: 0.04, 4: 0.91, 0: 0.01}
+    },
+    'capacity': {
+        'days': 730,
+        'orders_per_day': 400,
+        'repeat_customer_ratio': 0.8,
+        'state_weights': {1: 0.02, 2: 0.02, 3: 0.04, 4: 0.91, 0: 0.01}
+    }
+}
+# Reparto de los pedidos a lo largo del día (horario de la tienda)
+HOURLY_WEIGHTS = {9: 6, 10: 10, 11: 10, 12: 8, 13: 5, 14: 3, 15: 3, 16: 5, 17: 8, 18: 10, 19: 10, 20: 7}
+# Minutos que pasa una venta en cada estado antes del siguiente
+STATE_DELAYS = {
+    VentaState.EN_COLA.value: (5, 120),
+    VentaState.LAVANDO.value: (35, 90),
+    VentaState.PTE_RECOGIDA.value: (30, 3 * 24 * 60)
+}
+LIFECYCLE = [VentaState.EN_COLA.value, VentaState.LAVANDO.value, VentaState.PTE_RECOGIDA.value, VentaState.RECOGIDO.value]
+# Ventas por unidad de trabajo (y de checkpoint)
+SEED_CHUNK_SIZE = 2000
+# Firestore recomienda empezar en 500 escrituras/s en colecciones nuevas (regla 500/50/5)
+SEED_INITIAL_OPS_PER_SECOND = 500
+
+def _seeded_id(seed, kind, index):
+    """Deterministic document ID: re-running a chunk overwrites instead of duplicating."""
+    return hashlib.sha1(f"{seed}:{kind}:{index}".encode()).hexdigest()[:20]
+
+def _new_customer_flags(profile, seed, chunk_index, start, end):
+    """For each venta in [start, end): does it come from a new customer?"""
+    rng = random.Random(f"{seed}:customers:{chunk_index}")
+    repeat_ratio = profile['repeat_customer_ratio']
+    return [index == 0 or rng.random() >= repeat_ratio for index in range(start, end)]
+
+def _customer(seed, index, names):
+    """Deterministic (nombre, telefono) of the customer number `index`."""
+    # 7919 es primo con 10^8: teléfonos distintos para los primeros 10^8 clientes
+    phone = 600000000 + (index * 7919 + seed * 104729) % 100000000
+    return names[(index * 2654435761) % len(names)], str(phone)
+
+def _lifecycle(rng, target_state, created_at, now):
+    """historial_estados, estado_actual and updated_at of a venta heading to `target_state`."""
+    if target_state == VentaState.ERROR.value:
+        path = [VentaState.EN_COLA.value, VentaState.ERROR.value]
+    else:
+        path = LIFECYCLE[:LIFECYCLE.index(target_state) + 1]
+
+    historial = {}
+    entrada = created_at
+    estado = path[0]
+    for step, estado in enumerate(path):
+        historial[str(estado)] = {'entrada': entrada, 'salida': None}
+        if step == len(path) - 1:
+            break
+        low, high = STATE_DELAYS.get(estado, (5, 120))
+        salida = entrada + timedelta(minutes=rng.randint(low, high))
+        if salida > now:
+            # Las ventas recientes aún no han llegado a su estado final
+            break
+        historial[str(estado)]['salida'] = salida
+        entrada = salida
+    return historial, estado, entrada
+
+def generate_seed_chunk(profile, seed, chunk_index, chunk_size, first_customer, names, now):
+    """
+    Build the documents of one chunk of a bulk seeding run.
+
+    The output depends only on its arguments: every chunk has its own
+    generator seeded with (seed, chunk_index), and document IDs are derived
+    from the seed, so chunks can be produced in any order, in parallel, and
+    re-run after an interruption.
+
+    Args:
+        profile (dict): Volume profile (see VOLUME_PROFILES).
+        seed (int): Seed of the run.
+        chunk_index (int): Chunk number; covers ventas [chunk_index * chunk_size, ...).
+        chunk_size (int): Ventas per chunk.
+        first_customer (int): Customers created by the previous chunks.
+        names (list): Pool of customer names.
+        now (datetime): End of the generated history.
+
+    Returns:
+        tuple: (clients, ventas) as lists of (document_id, data).
+    """
+    total = profile['days'] * profile['orders_per_day']
+    start = chunk_index * chunk_size
+    end = min(start + chunk_size, total)
+    rng = random.Random(f"{seed}:ventas:{chunk_index}")
+    first_day = datetime.combine((now - timedelta(days=profile['days'] - 1)).date(), datetime.min.time(), tzinfo=now.tzinfo)
+
+    hours, hour_weights = zip(*HOURLY_WEIGHTS.items())
+    states, state_weights = zip(*profile['state_weights'].items())
+
+    clients = []
+    ventas = []
+    customers = first_customer
+    for index, is_new in zip(range(start, end), _new_customer_flags(profile, seed, chunk_index, start, end)):
+        day = first_day + timedelta(days=index // profile['orders_per_day'])
+        created_at = day + timedelta(
+            hours=rng.choices(hours, hour_weights)[0],
+            minutes=rng.randrange(60),
+            seconds=rng.randrange(60)
+        )
+        if created_at > now:
+            created_at = now - timedelta(minutes=rng.randrange(1, 60))
+
+        if is_new:
+            customer = customers
+            customers += 1
+        else:
+            customer = rng.randrange(customers)
+        nombre, telefono = _customer(seed, customer, names)
+        client_id = _seeded_id(seed, 'client', customer)
+        if is_new:
+            clients.append((client_id, {
+                'nombre': nombre,
+                'telefono': telefono,
+                'firebase_uid': None,
+                'created_at': created_at
+            }))
+
+        lavadora = rng.randint(5, 20) if rng.random() < 0.5 else None
+        secadora = rng.randint(5, 15) if rng.random() < 0.5 else None
+        historial, estado, updated_at = _lifecycle(rng, rng.choices(states, state_weights)[0], created_at, now)
+        ventas.append((_seeded_id(seed, 'venta', index), {
+            'nombre': nombre,
+            'telefono': telefono,
+            'client_id': client_id,
+            'estado_actual': estado,
+            'coste': {
+                'lavadora': lavadora,
+                'secadora': secadora,
+                'total': (lavadora or 0) + (secadora or 0)
+            },
+            'created_at': created_at,
+            'updated_at': updated_at,
+            'historial_estados': historial
+        }))
+    return clients, ventas
+
+def _load_checkpoint(path, run):
+    """Chunks already written by a previous run with the same parameters."""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint.get('run') != run:
+        raise ValueError(f"Checkpoint {path} belongs to a different seeding run; delete it or change --checkpoint")
+    return set(checkpoint.get('completed', []))
+
+def _save_checkpoint(path, run, completed):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump({'run': run, 'completed': sorted(completed)}, checkpoint_file)
+    os.replace(tmp_path, path)
+
+def seed_bulk(profile, seed=0, parallelism=4, chunk_size=SEED_CHUNK_SIZE, max_ops_per_second=5000,
+              now=None, checkpoint_path=None, rebuild=True):
+    """
+    Seed `days * orders_per_day` ventas (plus their clients and phone index)
+    with BulkWriter, `parallelism` chunks at a time.
+
+    The run is deterministic for a given seed, profile and `now`, and
+    resumable: finished chunks are recorded in `checkpoint_path` and skipped
+    on the next run (IDs are deterministic, so a chunk interrupted halfway is
+    simply written again). Progress and throughput are printed per chunk.
+    Aggregates are rebuilt at the end (unless `rebuild` is False).
+
+    Returns:
+        dict: ventas, clients, failed_writes, seconds and docs_per_second.
+    """
+    total = profile['days'] * profile['orders_per_day']
+    num_chunks = math.ceil(total / chunk_size)
+    now = now or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    # En UTC, como las escrituras de la API y los buckets diarios (naive = UTC)
+    now = now.replace(tzinfo=timezone.utc) if now.tzinfo is None else now.astimezone(timezone.utc)
+    # Ida y vuelta por JSON para compararlo con el checkpoint (claves de estado como str)
+    run = json.loads(json.dumps({'seed': seed, 'profile': profile, 'chunk_size': chunk_size, 'now': now.isoformat()}))
+    completed = _load_checkpoint(checkpoint_path, run)
+
+    # Clientes nuevos de cada chunk: fija qué clientes le tocan a cada uno
+    first_customers = []
+    customers = 0
+    for chunk_index in range(num_chunks):
+        first_customers.append(customers)
+        start = chunk_index * chunk_size
+        customers += sum(_new_customer_flags(profile, seed, chunk_index, start, min(start + chunk_size, total)))
+
+    faker = Faker('es_ES')
+    faker.seed_instance(seed)
+    names = [faker.name() for _ in range(1000)]
+    per_writer_ops = max(1, max_ops_per_second // parallelism)
+    options = BulkWriterOptions(
+        initial_ops_per_second=min(SEED_INITIAL_OPS_PER_SECOND // parallelism or 1, per_writer_ops),
+        max_ops_per_second=per_writer_ops
+    )
+
+    def write_chunk(chunk_index):
+        clients, ventas = generate_seed_chunk(
+            profile, seed, chunk_index, chunk_size, first_customers[chunk_index], names, now
+        )
+        failures = []
+
+        def on_write_error(failure, bulk_writer):
+            retry = failure.attempts < 10
+            if not retry:
+                failures.append(failure)
+            return retry
+
+        bulk_writer = db.bulk_writer(options=options)
+        bulk_writer.on_write_error(on_write_error)
+        for client_id, client in clients:
+            bulk_writer.set(clients_collection.document(client_id), client)
+            index_phone(bulk_writer, client['telefono'], client_id)
+        for venta_id, venta in ventas:
+            bulk_writer.set(ventas_collection.document(venta_id), venta)
+        bulk_writer.close()
+        return chunk_index, len(ventas), len(clients), 2 * len(clients) + len(ventas), failures
+
+    pending = [chunk_index for chunk_index in range(num_chunks) if chunk_index not in completed]
+    print(f"Seeding {total} ventas in {num_chunks} chunks ({len(completed)} already done), "
+          f"parallelism {parallelism}, up to {max_ops_per_second} writes/s")
+
+    started = time.monotonic()
+    written_ventas = written_clients = written_docs = failed_writes = 0
+    done_ventas = sum(min(chunk_size, total - chunk_index * chunk_size) for chunk_index in completed)
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [executor.submit(write_chunk, chunk_index) for chunk_index in pending]
+        for future in as_completed(futures):
+            chunk_index, num_ventas, num_clients, num_docs, failures = future.result()
+            written_ventas += num_ventas
+            written_clients += num_clients
+            written_docs += num_docs
+            failed_writes += len(failures)
+            if not failures:
+                # Un chunk con escrituras fallidas se repite en la siguiente ejecución
+                completed.add(chunk_index)
+                _save_checkpoint(checkpoint_path, run, completed)
+            done_ventas += num_ventas
+            elapsed = time.monotonic() - started
+            rate = written_docs / elapsed if elapsed else 0
+            remaining = (total - done_ventas) * written_docs / written_ventas / rate if rate else 0
+            print(f"  chunk {chunk_index + 1}/{num_chunks}: {done_ventas}/{total} ventas "
+                  f"({done_ventas * 100 // total}%), {rate:.0f} docs/s, ETA {remaining:.0f}s"
+                  + (f", {len(failures)} failed writes" if failures else ""))
+
+    elapsed = time.monotonic() - started
+    result = {
+        'ventas': written_ventas,
+        'clients': written_clients,
+        'failed_writes': failed_writes,
+        'seconds': round(elapsed, 1),
+        'docs_per_second': round(written_docs / elapsed) if elapsed else 0
+    }
+    if rebuild:
+        # El sembrado no pasa por las rutas de la API: se reconcilian los agregados
+        print(f"Rebuilt aggregates: {rebuild_aggregates()}")
+    return result
+
 def populate_db():
     """Populates the database with a given number of ventas."""
     num_ventas = int(os.getenv("NUM_VENTAS", 20))
@@ -87,11 +429,14 @@ def populate_db():
             client_id = str(venta_data['telefono'])
             client_ref = clients_collection.document(client_id)
             if not client_ref.get().exists:
-                client_ref.set({
+                batch = db.batch()
+                batch.set(client_ref, {
                     'nombre': venta_data['nombre'],
                     'telefono': venta_data['telefono'],
                     'created_at': firestore.SERVER_TIMESTAMP
                 })
+                index_phone(batch, venta_data['telefono'], client_id)
+                batch.commit()
 
             # Add a new document with an auto-generated ID and default state
             update_time, doc_ref = ventas_collection.add(venta_data)
@@ -99,7 +444,53 @@ def populate_db():
         except Exception as e:
             print(f"Error creating venta {i+1}/{num_ventas}: {e}")
 
+    # Seeding bypasses the API write paths, so reconcile the aggregates afterwards
+    print(f"Rebuilt aggregates: {rebuild_aggregates()}")
+
 if __name__ == "__main__":
-    print("Starting database population...")
-    populate_db()
-    print("Database population finished.")
+    parser = argparse.ArgumentParser(description="Seed Firestore with random ventas.")
+    parser.add_argument('--bulk', action='store_true', help="Bulk mode: BulkWriter, volume profiles, resumable.")
+    parser.add_argument('--profile', choices=sorted(VOLUME_PROFILES), default='demo', help="Volume profile (bulk mode).")
+    parser.add_argument('--days', type=int, help="Days of history (overrides the profile).")
+    parser.add_argument('--orders-per-day', type=int, help="Ventas per day (overrides the profile).")
+    parser.add_argument('--repeat-ratio', type=float, help="Share of ventas from returning customers (overrides the profile).")
+    parser.add_argument('--states', help="Final state weights, e.g. '1=0.05,2=0.05,3=0.1,4=0.8' (overrides the profile).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed: same seed, profile and --until give the same data.")
+    parser.add_argument('--until', help="End of the history, ISO datetime, UTC if naive (default: the current UTC hour).")
+    parser.add_argument('--parallelism', type=int, default=4, help="Chunks written at the same time.")
+    parser.add_argument('--chunk-size', type=int, default=SEED_CHUNK_SIZE, help="Ventas per chunk.")
+    parser.add_argument('--max-ops-per-second', type=int, default=5000, help="Write rate cap across all writers.")
+    parser.add_argument('--checkpoint', default='.seed_checkpoint.json', help="Progress file used to resume a run.")
+    parser.add_argument('--skip-aggregates', action='store_true', help="Do not rebuild the aggregates at the end.")
+    args = parser.parse_args()
+
+    if not args.bulk:
+        print("Starting database population...")
+        populate_db()
+        print("Database population finished.")
+    elif not db:
+        print("Firestore not initialized. Aborting population.")
+    else:
+        profile = dict(VOLUME_PROFILES[args.profile])
+        if args.days is not None:
+            profile['days'] = args.days
+        if args.orders_per_day is not None:
+            profile['orders_per_day'] = args.orders_per_day
+        if args.repeat_ratio is not None:
+            profile['repeat_customer_ratio'] = args.repeat_ratio
+        if args.states:
+            profile['state_weights'] = {
+                int(state): float(weight)
+                for state, weight in (item.split('=') for item in args.states.split(','))
+            }
+        result = seed_bulk(
+            profile,
+            seed=args.seed,
+            parallelism=args.parallelism,
+            chunk_size=args.chunk_size,
+            max_ops_per_second=args.max_ops_per_second,
+            now=datetime.fromisoformat(args.until) if args.until else None,
+            checkpoint_path=args.checkpoint,
+            rebuild=not args.skip_aggregates
+        )
+        print(f"Bulk seeding finished: {result}")
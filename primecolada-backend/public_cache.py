@@ -0,0 +1,102 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from enums import NON_TERMINAL_STATES
+from events import venta_events
+
+# Caché HTTP del endpoint público de trazabilidad (/public/ventas/<id>):
+# cabeceras Cache-Control para navegadores/CDN y, en cada worker, un LRU de
+# las respuestas ya renderizadas que se invalida con los eventos de ventas.
+PUBLIC_CACHE_MAX_ENTRIES = int(os.getenv('PUBLIC_CACHE_MAX_ENTRIES', 2048))
+# Red de seguridad por si el listener de eventos no está activo
+PUBLIC_CACHE_TTL = int(os.getenv('PUBLIC_CACHE_TTL', 300))
+
+# Pedidos abiertos: el estado puede cambiar en cualquier momento
+OPEN_CACHE_CONTROL = 'public, max-age=10, stale-while-revalidate=30'
+# Pedidos cerrados (recogidos): prácticamente inmutables
+CLOSED_CACHE_CONTROL = 'public, max-age=300, stale-while-revalidate=3600'
+NOT_FOUND_CACHE_CONTROL = 'public, max-age=10'
+
+def cache_control_for(estado_actual):
+    """Return the Cache-Control header for a public payload in this state."""
+    return OPEN_CACHE_CONTROL if estado_actual in NON_TERMINAL_STATES else CLOSED_CACHE_CONTROL
+
+class PublicPayloadCache:
+    """
+    Per-worker LRU of rendered public venta payloads.
+
+    Each entry is (expires_at, body, etag, cache_control). Entries are
+    dropped when the venta changes (venta events) or after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def etag_for(body):
+        """Strong ETag of a rendered payload (which includes updated_at)."""
+        return hashlib.sha256(body).hexdigest()[:32]
+
+    def version(self):
+        """Token to pass to put(): detects invalidations that race with a render."""
+        with self._lock:
+            return self._invalidations
+
+    def get(self, venta_id):
+        """Return (body, etag, cache_control) or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(venta_id)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[venta_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(venta_id)
+            self.hits += 1
+            return entry[1:]
+
+    def put(self, venta_id, body, estado_actual, version):
+        """
+        Store a rendered payload and return (body, etag, cache_control).
+
+        Nothing is stored if an invalidation happened since `version()`:
+        the payload may already be stale.
+        """
+        rendered = (body, self.etag_for(body), cache_control_for(estado_actual))
+        with self._lock:
+            if version == self._invalidations:
+                self._entries[venta_id] = (time.time() + self.ttl,) + rendered
+                self._entries.move_to_end(venta_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return rendered
+
+    def invalidate(self, venta_id):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.pop(venta_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self._invalidations
+            }
+
+public_payload_cache = PublicPayloadCache(
+    max_entries=PUBLIC_CACHE_MAX_ENTRIES,
+    ttl=PUBLIC_CACHE_TTL
+)
+venta_events.subscribe(lambda event: public_payload_cache.invalidate(event['id']))
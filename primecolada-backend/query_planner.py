@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, date, time, timedelta, timezone
+from google.cloud import firestore
+from enums import VentaState
+
+# Planificador de consultas del listado de ventas (GET /ventas).
+#
+# Cada combinación de filtros soportada se traduce a una consulta de Firestore
+# con un índice conocido: filtros de igualdad (client_id, estado_actual) más
+# un rango sobre created_at, ordenada por created_at DESC + __name__ DESC (el
+# mismo orden que los cursores de paginación). Los índices compuestos que
+# necesitan esas consultas se generan en firestore.indexes.json
+# (python query_planner.py --output firestore.indexes.json); una combinación
+# sin índice declarado se rechaza en vez de filtrarse en Python.
+
+# Las agregaciones (aggregations.py) consultan también el archivo
+# (archive.ARCHIVE_COLLECTION) con los mismos filtros
+VENTAS_COLLECTION_GROUPS = ('ventas', 'ventas_archive')
+# Colecciones con política TTL sobre expires_at (idempotency.IDEMPOTENCY_COLLECTION,
+# rate_limit.RATE_LIMITS_COLLECTION y events.DELETED_VENTAS_COLLECTION)
+TTL_COLLECTION_GROUPS = ('idempotency_keys', 'rate_limits', 'ventas_deleted')
+TTL_FIELD = 'expires_at'
+INDEX_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firestore.indexes.json')
+
+# Parámetros de filtro: client_id y estado (igualdad o 'in'), created_from/created_to (rango)
+VENTA_FILTERS = ('client_id', 'estado', 'created_from', 'created_to')
+# Parámetros del listado que no son filtros
+VENTA_LIST_PARAMS = {'fields', 'limit', 'page_token', 'stream'}
+# Campo de rango y de ordenación de los listados filtrados
+ORDER_FIELD = 'created_at'
+# Combinaciones de igualdades con índice compuesto (igualdades ASC + created_at DESC).
+# ('client_id',) sirve además el historial paginado de un cliente (UserView) y
+# la búsqueda de la compra anterior al borrar una venta (counters.load_venta_client):
+# tiene que estar desplegado antes que el código que hace esas consultas.
+INDEXED_EQUALITY_FILTERS = [
+    ('client_id',),
+    ('estado_actual',),
+    ('client_id', 'estado_actual')
+]
+
+class UnsupportedQuery(ValueError):
+    """A filter combination the planner can't serve from an index."""
+
+class VentaQueryPlan:
+    """
+    An indexed Firestore query for a set of venta filters.
+
+    Attributes:
+        filters (list): (field, operator, value) tuples, in query order.
+        ordered (bool): Whether the query is ordered by created_at DESC, __name__ DESC.
+        index (tuple | None): Fields of the composite index the query needs
+            (None if Firestore's single-field indexes are enough).
+    """
+
+    def __init__(self, filters, ordered, index):
+        self.filters = filters
+        self.ordered = ordered
+        self.index = index
+
+    def index_for(self, paged=False):
+        """
+        Fields of the composite index build(paged=paged) needs: a paged query
+        is always ordered, so an equality-only plan needs one as well.
+        """
+        if self.ordered or not paged:
+            return self.index
+        return required_index([field for field, _, _ in self.filters if field != ORDER_FIELD], True)
+
+    @property
+    def client_id(self):
+        """The client_id filter when it is the only filter, else None."""
+        if len(self.filters) == 1 and self.filters[0][0] == 'client_id':
+            return self.filters[0][2]
+        return None
+
+    def build(self, collection, paged=False):
+        """
+        Turn the plan into a query on `collection`.
+
+        Args:
+            collection: The ventas CollectionReference.
+            paged (bool): Order the query even without filters (for cursors).
+
+        Returns:
+            Query: The query, ready for start_after/limit/select.
+        """
+        query = collection
+        for field, op, value in self.filters:
+            query = query.where(field, op, value)
+        if self.ordered or paged:
+            query = query.order_by(ORDER_FIELD, direction=firestore.Query.DESCENDING) \
+                         .order_by('__name__', direction=firestore.Query.DESCENDING)
+        return query
+
+def _parse_estados(value):
+    try:
+        estados = sorted({int(estado) for estado in value.split(',') if estado.strip()})
+    except ValueError:
+        raise UnsupportedQuery("estado must be a comma-separated list of state numbers")
+    valid = {state.value for state in VentaState}
+    if not estados or any(estado not in valid for estado in estados):
+        raise UnsupportedQuery(f"estado must be one or more of {sorted(valid)}")
+    return estados
+
+def parse_moment(name, value, end_of_day=False):
+    """ISO date or datetime (naive = UTC). A bare date as an upper bound covers the whole day."""
+    try:
+        if 'T' not in value and ' ' not in value:
+            day = date.fromisoformat(value)
+            moment = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            return moment + timedelta(days=1, microseconds=-1) if end_of_day else moment
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise UnsupportedQuery(f"{name} must be an ISO 8601 date or datetime")
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def required_index(equality_fields, ordered):
+    """Fields of the composite index an ordered query with these equalities needs."""
+    if not ordered or not equality_fields:
+        # Sin orden (solo igualdades) o solo created_at: índices de campo único
+        return None
+    return tuple(sorted(equality_fields)) + (ORDER_FIELD,)
+
+def plan_venta_query(args):
+    """
+    Plan the Firestore query for the filters of a ventas listing.
+
+    Args:
+        args (Mapping): Request query parameters. Filters: client_id,
+            estado (comma-separated states), created_from and created_to
+            (ISO dates or datetimes, inclusive).
+
+    Returns:
+        VentaQueryPlan: The query plan.
+
+    Raises:
+        UnsupportedQuery: Unknown parameters, invalid values or a combination
+            without a declared index.
+    """
+    unknown = set(args) - set(VENTA_FILTERS) - VENTA_LIST_PARAMS
+    if unknown:
+        raise UnsupportedQuery(
+            f"Unsupported filters: {', '.join(sorted(unknown))}. "
+            f"Ventas can be filtered by {', '.join(VENTA_FILTERS)}"
+        )
+
+    filters = []
+    if args.get('client_id'):
+        filters.append(('client_id', '==', args['client_id']))
+    if args.get('estado'):
+        estados = _parse_estados(args['estado'])
+        filters.append(('estado_actual', '==', estados[0]) if len(estados) == 1 else ('estado_actual', 'in', estados))
+
+    created_from = parse_moment('created_from', args['created_from']) if args.get('created_from') else None
+    created_to = parse_moment('created_to', args['created_to'], end_of_day=True) if args.get('created_to') else None
+    if created_from and created_to and created_from > created_to:
+        raise UnsupportedQuery("created_from must not be after created_to")
+    if created_from:
+        filters.append((ORDER_FIELD, '>=', created_from))
+    if created_to:
+        filters.append((ORDER_FIELD, '<=', created_to))
+
+    equality_fields = [field for field, _, _ in filters if field != ORDER_FIELD]
+    # Un filtro solo por cliente mantiene el listado sin ordenar (índice de campo único)
+    ordered = bool(filters) and (equality_fields != ['client_id'] or bool(created_from or created_to))
+    plan = VentaQueryPlan(filters, ordered, required_index(equality_fields, ordered))
+    # El índice de la forma paginada, que se ordena siempre (limit/page_token)
+    index = plan.index_for(paged=True)
+    if index is not None and tuple(index[:-1]) not in INDEXED_EQUALITY_FILTERS:
+        raise UnsupportedQuery(f"No index for filtering ventas by {', '.join(index[:-1])} together")
+    return plan
+
+def index_manifest():
+    """
+    The firestore.indexes.json manifest of every composite index the planned
+    queries (and the paged listings ordered by created_at) need, plus the TTL
+    policies (without single-field indexes on the TTL field).
+    """
+    return {
+        'indexes': [
+            {
+                'collectionGroup': collection_group,
+                'queryScope': 'COLLECTION',
+                'fields': [
+                    *({'fieldPath': field, 'order': 'ASCENDING'} for field in equality_fields),
+                    {'fieldPath': ORDER_FIELD, 'order': 'DESCENDING'}
+                ]
+            }
+            for collection_group in VENTAS_COLLECTION_GROUPS
+            for equality_fields in INDEXED_EQUALITY_FILTERS
+        ],
+        'fieldOverrides': [
+            {'collectionGroup': collection_group, 'fieldPath': TTL_FIELD, 'ttl': True, 'indexes': []}
+            for collection_group in TTL_COLLECTION_GROUPS
+        ]
+    }
+
+def render_index_manifest():
+    return json.dumps(index_manifest(), indent=2) + '\n'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the Firestore composite index manifest for the venta queries.")
+    parser.add_argument('--output', default=INDEX_MANIFEST_PATH, help="Where to write firestore.indexes.json.")
+    parser.add_argument('--check', action='store_true', help="Exit with an error if the manifest is out of date.")
+    args = parser.parse_args()
+
+    manifest = render_index_manifest()
+    if args.check:
+        current = open(args.output).read() if os.path.exists(args.output) else None
+        if current != manifest:
+            print(f"{args.output} is out of date; run python query_planner.py", file=sys.stderr)
+            sys.exit(1)
+        print(f"{args.output} is up to date.")
+    else:
+        with open(args.output, 'w') as manifest_file:
+            manifest_file.write(manifest)
+        print(f"Wrote {len(index_manifest()['indexes'])} indexes to {args.output}")
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from flask import request, jsonify
+from google.api_core import exceptions
+from google.cloud import firestore
+from db import db
+
+# Limitación de peticiones por IP y ruta (token bucket) para los endpoints
+# sin coste de autenticación previo: /public/ventas/<id> y /clients/login.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') not in ('0', 'false', 'False')
+# 'memory': buckets en cada worker (el límite efectivo se multiplica por el nº
+# de workers); 'firestore': buckets compartidos, a costa de una transacción por petición
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+# Proxies de confianza delante de la app (Cloud Run / balanceador): la IP del
+# cliente es la entrada de X-Forwarded-For que añadió el más cercano
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 1))
+RATE_LIMITS_COLLECTION = 'rate_limits'
+
+# Límites por IP: peticiones sostenidas por minuto y ráfaga máxima
+PUBLIC_RATE_LIMIT_PER_MINUTE = float(os.getenv('PUBLIC_RATE_LIMIT_PER_MINUTE', 60))
+PUBLIC_RATE_LIMIT_BURST = int(os.getenv('PUBLIC_RATE_LIMIT_BURST', 20))
+LOGIN_RATE_LIMIT_PER_MINUTE = float(os.getenv('LOGIN_RATE_LIMIT_PER_MINUTE', 10))
+LOGIN_RATE_LIMIT_BURST = int(os.getenv('LOGIN_RATE_LIMIT_BURST', 5))
+
+class MemoryBucketStore:
+    """Per-worker token buckets, bounded as an LRU of `max_keys` entries."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity):
+        """
+        Take one token from the bucket of `key`.
+
+        Args:
+            rate (float): Tokens refilled per second.
+            capacity (int): Bucket size (maximum burst).
+
+        Returns:
+            tuple: (allowed, retry_after_seconds).
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+@firestore.transactional
+def _take_token_txn(transaction, doc_ref, rate, capacity):
+    snapshot = doc_ref.get(transaction=transaction)
+    now = datetime.now(timezone.utc)
+    bucket = snapshot.to_dict() if snapshot.exists else {}
+    tokens = bucket.get('tokens', capacity)
+    updated = bucket.get('updated_at')
+    if updated is not None:
+        tokens = min(capacity, tokens + max((now - updated).total_seconds(), 0) * rate)
+    allowed = tokens >= 1
+    if allowed:
+        tokens -= 1
+    transaction.set(doc_ref, {
+        'tokens': tokens,
+        'updated_at': now,
+        # Política TTL de Firestore (firestore.indexes.json): un bucket lleno
+        # de nuevo equivale a no tener documento
+        'expires_at': now + timedelta(seconds=capacity / rate)
+    })
+    return allowed, 0 if allowed else (1 - tokens) / rate
+
+def _is_contention(error):
+    # @firestore.transactional envuelve en ValueError el último Aborted
+    return isinstance(error, exceptions.Aborted) or (
+        isinstance(error, ValueError) and isinstance(error.__cause__, exceptions.Aborted)
+    )
+
+class FirestoreBucketStore:
+    """
+    Token buckets shared by every worker, one document per key.
+
+    Requests of the same key contend on its document. When the transaction
+    runs out of attempts (a burst from one IP) the request is rejected, not
+    let through: contention only happens when that key is already busy.
+    """
+
+    def take(self, key, rate, capacity):
+        doc_id = hashlib.sha256(key.encode()).hexdigest()[:40]
+        doc_ref = db.collection(RATE_LIMITS_COLLECTION).document(doc_id)
+        try:
+            return _take_token_txn(db.transaction(), doc_ref, rate, capacity)
+        except (exceptions.Aborted, ValueError) as e:
+            if not _is_contention(e):
+                raise
+            logging.warning(f"Rate limit bucket contended, rejecting request: {e}")
+            return False, 1 / rate
+
+def create_bucket_store(backend):
+    """Return the bucket store for a RATE_LIMIT_BACKEND value."""
+    if backend == 'firestore':
+        return FirestoreBucketStore()
+    if backend == 'memory':
+        return MemoryBucketStore()
+    raise ValueError(f"Unknown rate limit backend: {backend!r}")
+
+bucket_store = create_bucket_store(RATE_LIMIT_BACKEND)
+
+def client_ip():
+    """Best-effort client IP: X-Forwarded-For as seen by the trusted proxies, else the peer."""
+    forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+    if forwarded and RATE_LIMIT_TRUSTED_PROXIES > 0:
+        return forwarded[-min(RATE_LIMIT_TRUSTED_PROXIES, len(forwarded))]
+    return request.remote_addr or 'unknown'
+
+def rate_limited(name, per_minute, burst):
+    """
+    Throttle a route per client IP with a token bucket.
+
+    Args:
+        name (str): Bucket namespace (usually the route).
+        per_minute (float): Sustained requests per minute.
+        burst (int): Requests allowed in a burst.
+
+    Over the limit the route answers 429 with a Retry-After header, and so
+    does a request whose shared bucket is contended (see
+    FirestoreBucketStore). If the bucket store is unavailable the request
+    is let through.
+    """
+    rate = per_minute / 60.0
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return fn(*args, **kwargs)
+            try:
+                allowed, retry_after = bucket_store.take(f"{name}:{client_ip()}", rate, burst)
+            except Exception as e:
+                logging.error(f"Rate limiter unavailable, allowing request: {e}")
+                allowed, retry_after = True, 0
+            if not allowed:
+                response = jsonify({"error": "Too many requests"})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
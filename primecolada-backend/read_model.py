@@ -0,0 +1,262 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from google.cloud.firestore_v1.watch import ChangeType
+from db import db
+from enums import NON_TERMINAL_STATES
+from counters import state_counters_ref, sum_state_counters, day_key
+
+# Modelo de lectura en memoria (uno por worker) alimentado por listeners
+# on_snapshot de Firestore. Contiene el "working set" de la tienda:
+#   - 'open':   ventas en un estado no terminal (siguen en la tienda).
+#   - 'recent': ventas creadas en los últimos READ_MODEL_WINDOW_DAYS días.
+#   - 'counts': los shards de los contadores por estado (stats/ventas_por_estado/shards).
+# Las lecturas que no encuentra aquí van a Firestore como siempre.
+READ_MODEL_ENABLED = os.getenv('READ_MODEL_ENABLED', '1') not in ('0', 'false', 'False')
+READ_MODEL_WINDOW_DAYS = int(os.getenv('READ_MODEL_WINDOW_DAYS', 1))
+
+VENTA_LISTENERS = ('open', 'recent')
+
+class VentasReadModel:
+    """
+    In-memory read model of the open and recent ventas, indexed by id, state
+    and client_id, plus the per-state counters.
+
+    Listeners are started lazily on first use (so each gunicorn worker owns
+    its own) and restarted when they die or when the recent window rolls over
+    to a new day. Until every listener has delivered its initial snapshot the
+    model reports misses and callers read from Firestore.
+    """
+
+    def __init__(self, window_days):
+        self.window_days = window_days
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._watches = {}
+        self._generation = {}
+        self._synced = set()
+        self._window_day = None
+
+        self._ventas = {}      # id -> (update_time, venta)
+        self._members = {}     # id -> listeners que contienen la venta
+        self._by_state = {}    # estado_actual -> set(ids)
+        self._by_client = {}   # client_id -> set(ids)
+        self._state_counts = None
+
+        self.hits = 0
+        self.misses = 0
+        self.restarts = 0
+        self.last_read_time = None
+        self.last_applied_at = None
+        self.listener_lag = None
+        self.max_listener_lag = 0.0
+
+    # --- Listeners ---
+
+    def window_start(self, now=None):
+        """Start (UTC midnight, like the daily buckets) of the recent window."""
+        today = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return today - timedelta(days=self.window_days - 1)
+
+    def _listener_targets(self):
+        ventas = db.collection('ventas')
+        return {
+            'open': ventas.where('estado_actual', 'in', NON_TERMINAL_STATES),
+            'recent': ventas.where('created_at', '>=', self.window_start()),
+            'counts': state_counters_ref()
+        }
+
+    def ensure_started(self):
+        """Start (or restart) the listeners that are missing, dead or out of window."""
+        if not READ_MODEL_ENABLED or not db:
+            return
+        today = day_key(datetime.now(timezone.utc))
+        if (len(self._watches) == len(VENTA_LISTENERS) + 1 and self._window_day == today
+                and all(watch.is_active for watch in self._watches.values())):
+            return
+
+        with self._start_lock:
+            targets = None
+            for name in VENTA_LISTENERS + ('counts',):
+                watch = self._watches.get(name)
+                stale_window = name == 'recent' and self._window_day != today
+                if watch is not None and watch.is_active and not stale_window:
+                    continue
+                if watch is not None:
+                    watch.unsubscribe()
+                    self.restarts += 1
+                targets = targets or self._listener_targets()
+                self._reset_listener(name)
+                generation = self._generation[name]
+                callback = lambda docs, changes, read_time, name=name, generation=generation: \
+                    self._on_snapshot(name, generation, docs, changes, read_time)
+                try:
+                    self._watches[name] = targets[name].on_snapshot(callback)
+                except Exception as e:
+                    self._watches.pop(name, None)
+                    logging.error(f"Read model: could not start the '{name}' listener: {e}")
+            self._window_day = today
+
+    def stop(self):
+        """Close every listener and drop the cached data."""
+        with self._start_lock:
+            for name, watch in list(self._watches.items()):
+                watch.unsubscribe()
+                self._reset_listener(name)
+            self._watches = {}
+            self._window_day = None
+
+    def _reset_listener(self, name):
+        """Forget everything a listener contributed (before re-subscribing it)."""
+        with self._lock:
+            self._generation[name] = self._generation.get(name, 0) + 1
+            self._synced.discard(name)
+            if name == 'counts':
+                self._state_counts = None
+                return
+            for venta_id in [venta_id for venta_id, members in self._members.items() if name in members]:
+                self._leave(venta_id, name)
+
+    def _on_snapshot(self, name, generation, docs, changes, read_time):
+        applied_at = time.time()
+        with self._lock:
+            # Callbacks de un listener ya sustituido
+            if self._generation.get(name) != generation:
+                return
+            if name == 'counts':
+                self._state_counts = sum_state_counters(docs)
+            else:
+                for change in changes:
+                    if change.type == ChangeType.REMOVED:
+                        self._leave(change.document.id, name)
+                    else:
+                        self._store(change.document, name)
+            self._synced.add(name)
+
+            self.last_applied_at = applied_at
+            if read_time is not None:
+                self.last_read_time = read_time
+                self.listener_lag = max(applied_at - read_time.timestamp(), 0.0)
+                self.max_listener_lag = max(self.max_listener_lag, self.listener_lag)
+
+    def _store(self, snapshot, name):
+        venta_id = snapshot.id
+        self._members.setdefault(venta_id, set()).add(name)
+        current = self._ventas.get(venta_id)
+        # Dos listeners pueden entregar la misma venta: gana la versión más nueva
+        if current is not None and current[0] and snapshot.update_time and current[0] > snapshot.update_time:
+            return
+        if current is not None:
+            self._unindex(venta_id, current[1])
+        venta = snapshot.to_dict()
+        venta['id'] = venta_id
+        self._ventas[venta_id] = (snapshot.update_time, venta)
+        self._by_state.setdefault(venta.get('estado_actual'), set()).add(venta_id)
+        self._by_client.setdefault(venta.get('client_id'), set()).add(venta_id)
+
+    def _leave(self, venta_id, name):
+        members = self._members.get(venta_id)
+        if members is None:
+            return
+        members.discard(name)
+        if members:
+            return
+        del self._members[venta_id]
+        _, venta = self._ventas.pop(venta_id)
+        self._unindex(venta_id, venta)
+
+    def _unindex(self, venta_id, venta):
+        for index, key in ((self._by_state, venta.get('estado_actual')), (self._by_client, venta.get('client_id'))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(venta_id)
+                if not ids:
+                    del index[key]
+
+    def _ready(self):
+        return len(self._synced) == len(VENTA_LISTENERS) + 1
+
+    # --- Lecturas ---
+
+    def get(self, venta_id):
+        """
+        Return a copy of a venta (with 'id') if it is in the working set.
+
+        Returns:
+            dict | None: The venta, or None on a miss (read Firestore instead).
+        """
+        self.ensure_started()
+        with self._lock:
+            entry = self._ventas.get(venta_id) if self._ready() else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[1])
+
+    def ventas_for_client(self, client_id):
+        """
+        Return every venta of a client, if the model holds all of them.
+
+        Completeness is checked against the client's total_ventas aggregate
+        (one document read instead of one read per venta).
+
+        Returns:
+            list | None: The ventas ordered by id, or None on a miss.
+        """
+        self.ensure_started()
+        with self._lock:
+            cached = len(self._by_client.get(client_id, ())) if self._ready() else None
+        if cached is not None:
+            client = db.collection('clients').document(client_id).get()
+            expected = client.to_dict().get('total_ventas') if client.exists else None
+            with self._lock:
+                ids = self._by_client.get(client_id, set())
+                if self._ready() and expected == len(ids):
+                    self.hits += 1
+                    return [dict(self._ventas[venta_id][1]) for venta_id in sorted(ids)]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def state_counts(self):
+        """
+        Per-state counters as served by get_state_counts(), or None on a miss.
+        """
+        self.ensure_started()
+        with self._lock:
+            if not self._ready() or self._state_counts is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(self._state_counts)
+
+    def stats(self):
+        """Size, hit/miss counters, staleness and listener lag of this worker's model."""
+        now = time.time()
+        with self._lock:
+            return {
+                'enabled': READ_MODEL_ENABLED,
+                'ready': self._ready(),
+                'listeners': {
+                    name: {'active': watch.is_active, 'synced': name in self._synced}
+                    for name, watch in self._watches.items()
+                },
+                'window_start': self.window_start().isoformat(),
+                'ventas': len(self._ventas),
+                'by_state': {str(state): len(ids) for state, ids in self._by_state.items()},
+                'clients': len(self._by_client),
+                'hits': self.hits,
+                'misses': self.misses,
+                'restarts': self.restarts,
+                'last_read_time': self.last_read_time.isoformat() if self.last_read_time else None,
+                # Segundos desde el último cambio aplicado (crece si no hay actividad)
+                'staleness_seconds': round(now - self.last_applied_at, 3) if self.last_applied_at else None,
+                # Retraso entre el read_time del servidor y su aplicación aquí
+                'listener_lag_seconds': round(self.listener_lag, 3) if self.listener_lag is not None else None,
+                'max_listener_lag_seconds': round(self.max_listener_lag, 3)
+            }
+
+ventas_read_model = VentasReadModel(window_days=READ_MODEL_WINDOW_DAYS)
@@ -1,19 +1,48 @@
-import requests
-import os
-from flask import Blueprint, request, jsonify, g
-from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, g, current_app
+from datetime import datetime, date, timedelta, timezone
 from google.cloud import firestore
-from db import db  # Import the Firestore client from db.py
+from google.api_core import exceptions
+from db import db, lazy_collection  # Import the Firestore client from db.py
 from enums import VentaState
-from models import venta_schema, ventas_schema, public_venta_schema
+from models import VentaSchema
+from serializers import venta_serializer, public_venta_serializer, venta_fields_serializer, venta_loader, ventas_loader
 from marshmallow import ValidationError
-from auth_middleware import token_required
+from auth_middleware import token_required, token_cache, admin_roster
 from functools import wraps
-from utils import get_or_create_client_by_phone
+from utils import get_or_create_client_by_phone, resolve_clients_by_phone, encode_page_token, decode_page_token
+from phone_index import normalize_phone
+from streaming import requested_stream_format, stream_query
+from counters import record_venta_change, load_venta_client, get_state_counts, get_daily_stats, AggregateDeltas
+from read_model import ventas_read_model
+from events import venta_events, record_venta_deletion
+from public_cache import public_payload_cache, NOT_FOUND_CACHE_CONTROL
+from rate_limit import rate_limited, PUBLIC_RATE_LIMIT_PER_MINUTE, PUBLIC_RATE_LIMIT_BURST
+from single_flight import SingleFlight
+from archive import archive_ventas, get_archived_venta, unpack_venta, ARCHIVE_AFTER_DAYS, ARCHIVE_COLLECTION
+from dwell import get_dwell_analytics, MAX_DWELL_RANGE_DAYS, MAX_DWELL_LOOKBACK_DAYS
+from query_planner import plan_venta_query, UnsupportedQuery
+from aggregations import count_ventas_by_state, get_range_stats
+from idempotency import (
+    IDEMPOTENCY_HEADER, idempotency_cache, idempotency_ref, request_fingerprint,
+    build_record, lookup_record, read_record, store_record
+)
 
 # Create a Blueprint for the routes
 api = Blueprint('api', __name__)
 
+# Paginación de listados: tamaño máximo de página
+MAX_PAGE_SIZE = 200
+
+# Alta masiva: máximo de ventas por petición y de escrituras por commit
+MAX_BATCH_VENTAS = 500
+BATCH_WRITE_LIMIT = 500
+
+# Cambio de estado masivo: reintentos de un lote ante ediciones concurrentes
+MAX_TRANSITION_ATTEMPTS = 3
+
+# Consultas públicas idénticas y simultáneas comparten una sola lectura
+public_lookups = SingleFlight()
+
 def admin_required():
     def wrapper(fn):
         @wraps(fn)
@@ -26,22 +55,110 @@ def admin_required():
         return decorator
     return wrapper
 
-def convert_timestamps(data):
+# A reference to the 'ventas' collection (built on first use, see db.py)
+ventas_collection = lazy_collection('ventas')
+clients_collection = lazy_collection('clients')
+
+def build_venta_doc(validated_data, client_id, now):
+    """Turn a validated venta payload into the document stored in Firestore."""
+    doc_data = dict(validated_data)
+    doc_data['client_id'] = client_id  # Link the sale to the resolved ID
+    doc_data['created_at'] = now
+    doc_data['updated_at'] = now
+    doc_data['historial_estados'] = {
+        str(validated_data['estado_actual']): {
+            'entrada': now,
+            'salida': None
+        }
+    }
+    return doc_data
+
+def transition_historial(existing_venta, new_state, now):
     """
-    Recursively convert Firestore DatetimeWithNanoseconds to ISO 8601 strings.
+    Return the historial_estados of a venta moving to `new_state`: the
+    current state is closed and the new one opened at `now`.
     """
-    if isinstance(data, dict):
-        return {key: convert_timestamps(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [convert_timestamps(item) for item in data]
-    elif isinstance(data, datetime):
-        return data.isoformat()
-    else:
-        return data
+    historial = existing_venta.get('historial_estados', {})
+
+    # Close the previous state
+    previous_state = str(existing_venta.get('estado_actual'))
+    if previous_state in historial:
+        historial[previous_state]['salida'] = now
+
+    # Open the new state
+    historial[str(new_state)] = {'entrada': now, 'salida': None}
+    return historial
 
-# A reference to the 'ventas' collection
-ventas_collection = db.collection('ventas') if db else None
-clients_collection = db.collection('clients') if db else None
+@firestore.transactional
+def _create_venta_txn(transaction, doc_ref, doc_data, idempotency=None):
+    """
+    Create a venta and its aggregates. With idempotency=(ref, record), the
+    key's record is written in the same commit; if the key was already used
+    (a concurrent retry won), nothing is written and its record is returned.
+    """
+    if idempotency:
+        stored = read_record(transaction, idempotency[0])
+        if stored is not None:
+            return stored
+    client = load_venta_client(transaction, doc_data)
+    transaction.set(doc_ref, doc_data)
+    record_venta_change(transaction, None, doc_data, client)
+    if idempotency:
+        store_record(transaction, *idempotency)
+    return None
+
+def _replay_response(record, fingerprint):
+    """The stored response of an Idempotency-Key, or 422 if the payload changed."""
+    if record['request_hash'] != fingerprint:
+        return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used with a different payload"}), 422
+    response = jsonify(record['body'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, record['status']
+
+@firestore.transactional
+def _update_venta_txn(transaction, doc_ref, changes):
+    """
+    Apply a partial update to a venta, keeping historial_estados and the
+    aggregates consistent. Returns False if the venta does not exist.
+    """
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return False
+
+    # Copia: la transacción puede reintentarse con el mismo payload
+    validated_data = dict(changes)
+    existing_venta = doc.to_dict()
+    # Solo el coste afecta a los agregados del cliente
+    client = load_venta_client(transaction, existing_venta) if 'coste' in validated_data else None
+    now = datetime.now(timezone.utc)
+    validated_data['updated_at'] = now
+
+    if 'estado_actual' in validated_data and validated_data['estado_actual'] != existing_venta.get('estado_actual'):
+        validated_data['historial_estados'] = transition_historial(existing_venta, validated_data['estado_actual'], now)
+
+    transaction.update(doc_ref, validated_data)
+    record_venta_change(transaction, existing_venta, {**existing_venta, **validated_data}, client)
+    return True
+
+@firestore.transactional
+def _delete_venta_txn(transaction, doc_ref):
+    doc = doc_ref.get(transaction=transaction)
+    if doc.exists:
+        venta = doc.to_dict()
+    else:
+        # Las ventas archivadas siguen contando en los agregados: se borran
+        # del archivo y se descuentan igual
+        doc_ref = db.collection(ARCHIVE_COLLECTION).document(doc_ref.id)
+        doc = doc_ref.get(transaction=transaction)
+        if not doc.exists:
+            return False
+        venta = unpack_venta(doc.to_dict())
+    client = load_venta_client(transaction, venta, deleted_venta_id=doc.id)
+    transaction.delete(doc_ref)
+    record_venta_change(transaction, venta, None, client)
+    # Avisa a los demás workers aunque la venta no esté en su listener
+    record_venta_deletion(transaction, doc.id)
+    return True
 
 @api.route('/user/profile', methods=['GET'])
 @token_required
@@ -57,23 +174,75 @@ def get_user_profile():
         'is_admin': g.is_admin
     })
 
+@api.route('/auth/cache/stats', methods=['GET'])
+@token_required
+@admin_required()
+def get_auth_cache_stats():
+    """
+    Hit/miss counters of this worker's verified-token cache and the status
+    of its admin roster listener.
+
+    Returns:
+        JSON: Entries, limits and hit/miss/eviction counters, plus
+        'admin_roster' (listening, synced, admins, restarts, fallbacks).
+    """
+    return jsonify({**token_cache.stats(), 'admin_roster': admin_roster.stats()}), 200
+
+@api.route('/read-model/stats', methods=['GET'])
+@token_required
+@admin_required()
+def get_read_model_stats():
+    """
+    Health of this worker's in-memory read model (see read_model.py).
+
+    Returns:
+        JSON: Listener status, size, hit/miss counters, staleness and listener
+        lag, plus the counters of the public payload cache.
+    """
+    return jsonify({
+        **ventas_read_model.stats(),
+        'public_cache': {**public_payload_cache.stats(), 'coalesced': public_lookups.coalesced}
+    }), 200
+
 @api.route('/ventas', methods=['POST'])
 @token_required
 def create_venta():
     """
     Create a new venta in Firestore.
     ADR-003: Accepts 'telefono' instead of 'client_id'.
+
+    With an Idempotency-Key header, retries of the same request return the
+    first response (with Idempotent-Replayed: true) without resolving the
+    client or creating another venta.
     """
     if not db:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         data = request.get_json()
+
+        # --- IDEMPOTENCIA: un reintento devuelve la respuesta original ---
+        idempotency = None
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key is not None:
+            try:
+                key_ref = idempotency_ref(g.user_id, idempotency_key)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            fingerprint = request_fingerprint(data)
+            stored = lookup_record(key_ref)
+            if stored is not None:
+                return _replay_response(stored, fingerprint)
+        # ------------------------------
         
         # Validate payload (Ensure models.py VentaSchema requires telefono, not client_id)
         try:
-            validated_data = venta_schema.load(data)
+            validated_data = venta_loader.load(data)
         except ValidationError as err:
             return jsonify(err.messages), 400
+        try:
+            normalize_phone(validated_data['telefono'])
+        except ValueError as e:
+            return jsonify({"telefono": [str(e)]}), 400
 
         # --- SHADOW USER RESOLUTION ---
         # We trust the helper to find the ID or create a ghost user
@@ -87,73 +256,434 @@ def create_venta():
         # ------------------------------
 
         # Construct the Venta document
-        doc_data = validated_data
-        doc_data['client_id'] = client_doc_id  # Link the sale to the resolved ID
-        
-        now = datetime.now()
-        doc_data['created_at'] = now
-        doc_data['updated_at'] = now
-        doc_data['historial_estados'] = {
-            str(validated_data['estado_actual']): {
-                'entrada': now,
-                'salida': None
-            }
-        }
-        
-        # Save to Firestore
-        ventas_collection = db.collection('ventas')
-        update_time, doc_ref = ventas_collection.add(doc_data)
-        
-        return jsonify({
+        doc_data = build_venta_doc(validated_data, client_doc_id, datetime.now(timezone.utc))
+        doc_ref = db.collection('ventas').document()
+        body = {
             "id": doc_ref.id, 
             "client_id": client_doc_id,
             "message": "Venta created and linked to Client (Shadow or Registered)"
-        }), 201
+        }
+        if idempotency_key is not None:
+            # Solo se guardan las altas: los errores no tienen efectos y se pueden repetir
+            idempotency = (key_ref, build_record(g.user_id, fingerprint, 201, body))
+
+        # Save to Firestore (venta + per-state counters + idempotency record in one transaction)
+        stored = _create_venta_txn(db.transaction(), doc_ref, doc_data, idempotency)
+        if idempotency:
+            idempotency_cache.put(key_ref.id, stored or idempotency[1])
+            if stored is not None:
+                return _replay_response(stored, fingerprint)
+        
+        return jsonify(body), 201
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+def _chunk_new_ventas(pending, clients):
+    """
+    Split new ventas into WriteBatch chunks of at most BATCH_WRITE_LIMIT
+    writes, counting the aggregate documents each one really touches (state
+    counter shard, daily and dwell buckets, client).
+
+    Args:
+        pending (list): (result, doc_ref, doc_data) of the ventas to create.
+        clients (dict): load_venta_client-like entries by client_id.
+
+    Returns:
+        list: (chunk, AggregateDeltas) pairs.
+    """
+    chunks, chunk, deltas = [], [], AggregateDeltas()
+    for item in pending:
+        doc_data = item[2]
+        venta_deltas = AggregateDeltas()
+        record_venta_change(venta_deltas, None, doc_data, clients.get(doc_data['client_id']))
+        if chunk and len(chunk) + 1 + len(deltas) + deltas.new_documents(venta_deltas) > BATCH_WRITE_LIMIT:
+            chunks.append((chunk, deltas))
+            chunk, deltas = [], AggregateDeltas()
+        chunk.append(item)
+        deltas.merge(venta_deltas)
+    if chunk:
+        chunks.append((chunk, deltas))
+    return chunks
+
+def _commit_venta_chunk(chunk, deltas):
+    """
+    Write a chunk of new ventas plus their merged aggregate deltas in one
+    WriteBatch. `chunk` is a list of (result, doc_ref, doc_data).
+    """
+    batch = db.batch()
+    for _, doc_ref, doc_data in chunk:
+        batch.set(doc_ref, doc_data)
+    deltas.flush(batch)
+    batch.commit()
+
+@api.route('/ventas/batch', methods=['POST'])
+@token_required
+def create_ventas_batch():
+    """
+    Create many ventas in one request (counter rush hours).
+
+    Expects a JSON array of venta payloads (same shape as POST /ventas).
+    Clients are resolved once per distinct phone, and ventas are written with
+    WriteBatch commits of at most BATCH_WRITE_LIMIT writes, aggregates included.
+    Invalid items or failed chunks are reported per item without aborting the
+    rest of the batch.
+
+    Returns:
+        JSON: {"results": [...], "created": int, "failed": int}; 201 if every
+        item was created, 207 otherwise.
+    """
+    if not db:
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        data = request.get_json()
+        if not isinstance(data, list) or not data:
+            return jsonify({"error": "Expected a non-empty list of ventas"}), 400
+        if len(data) > MAX_BATCH_VENTAS:
+            return jsonify({"error": f"A batch accepts at most {MAX_BATCH_VENTAS} ventas"}), 400
+
+        try:
+            validated = ventas_loader.load(data)
+            errors = {}
+        except ValidationError as err:
+            validated, errors = err.valid_data, err.messages
+
+        results = [{"index": index} for index in range(len(data))]
+        phones = {}
+        for index, result in enumerate(results):
+            if index in errors:
+                result.update(status=400, error=errors[index])
+                continue
+            try:
+                phones[index] = normalize_phone(validated[index]['telefono'])
+            except ValueError as e:
+                result.update(status=400, error={"telefono": [str(e)]})
+
+        # --- SHADOW USER RESOLUTION (una vez por teléfono) ---
+        resolved = resolve_clients_by_phone(
+            (validated[index]['telefono'], validated[index]['nombre']) for index in phones
+        )
+
+        now = datetime.now(timezone.utc)
+        pending = []
+        for index, phone in phones.items():
+            client_id = resolved.get(phone)
+            if isinstance(client_id, Exception) or not client_id:
+                results[index].update(status=500, error=f"Resolution failed: {client_id}")
+                continue
+            doc_data = build_venta_doc(validated[index], client_id, now)
+            pending.append((results[index], db.collection('ventas').document(), doc_data))
+
+        # Agregados de cliente: una lectura para todos los clientes del lote
+        client_refs = {doc_data['client_id']: clients_collection.document(doc_data['client_id']) for _, _, doc_data in pending}
+        clients = {
+            snapshot.id: {'ref': snapshot.reference, 'last_purchase_date': snapshot.to_dict().get('last_purchase_date')}
+            for snapshot in (db.get_all(list(client_refs.values())) if client_refs else [])
+            if snapshot.exists
+        }
+
+        for chunk, deltas in _chunk_new_ventas(pending, clients):
+            try:
+                _commit_venta_chunk(chunk, deltas)
+                for result, doc_ref, doc_data in chunk:
+                    result.update(status=201, id=doc_ref.id, client_id=doc_data['client_id'])
+            except Exception as e:
+                for result, _, _ in chunk:
+                    result.update(status=500, error=str(e))
+
+        created = sum(1 for result in results if result.get('status') == 201)
+        return jsonify({
+            "results": results,
+            "created": created,
+            "failed": len(results) - created
+        }), 201 if created == len(results) else 207
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _commit_transition_chunk(doc_refs, target_state, results):
+    """
+    Move a chunk of ventas to `target_state` in one atomic commit.
+
+    Each update carries a last-update-time precondition taken from the read,
+    so a concurrent edit makes the commit fail instead of being overwritten.
+    Ventas whose update and aggregate documents (state counter shard, daily
+    and dwell buckets) no longer fit in BATCH_WRITE_LIMIT writes are left
+    for the next chunk.
+
+    Returns:
+        set | None: IDs handled by this commit, or None on a conflict
+        (nothing written).
+    """
+    now = datetime.now(timezone.utc)
+    batch = db.batch()
+    deltas = AggregateDeltas()
+    updated = []
+    handled = set()
+    for snapshot in db.get_all(doc_refs):
+        result = results[snapshot.id]
+        if not snapshot.exists:
+            result['status'] = 'not_found'
+            handled.add(snapshot.id)
+            continue
+        venta = snapshot.to_dict()
+        if venta.get('estado_actual') == target_state:
+            result['status'] = 'unchanged'
+            handled.add(snapshot.id)
+            continue
+
+        changes = {
+            'estado_actual': target_state,
+            'updated_at': now,
+            'historial_estados': transition_historial(venta, target_state, now)
+        }
+        venta_deltas = AggregateDeltas()
+        record_venta_change(venta_deltas, venta, {**venta, **changes})
+        if len(updated) + 1 + len(deltas) + deltas.new_documents(venta_deltas) > BATCH_WRITE_LIMIT:
+            continue
+        batch.update(
+            snapshot.reference, changes,
+            option=db.write_option(last_update_time=snapshot.update_time)
+        )
+        deltas.merge(venta_deltas)
+        updated.append(result)
+        handled.add(snapshot.id)
+
+    if not updated:
+        return handled
+    deltas.flush(batch)
+    try:
+        batch.commit()
+    except (exceptions.FailedPrecondition, exceptions.Aborted):
+        return None
+    for result in updated:
+        result['status'] = 'updated'
+    for doc_ref in doc_refs:
+        if results[doc_ref.id]['status'] == 'updated':
+            public_payload_cache.invalidate(doc_ref.id)
+    return handled
+
+@api.route('/ventas/transition', methods=['POST'])
+@token_required
+def transition_ventas():
+    """
+    Move many ventas to the same state (e.g. a washer load to PTE_RECOGIDA).
+
+    Expects {"ids": [...], "estado_actual": <VentaState value>}. Documents are
+    read with get_all and committed in atomic chunks guarded by update-time
+    preconditions; a chunk hit by a concurrent edit is re-read and retried up
+    to MAX_TRANSITION_ATTEMPTS times.
+
+    Returns:
+        JSON: {"results": {id: status}} where status is updated, unchanged,
+        not_found or conflict.
+    """
+    if not ventas_collection:
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        data = request.get_json() or {}
+        ids = data.get('ids')
+        target_state = data.get('estado_actual')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, str) and i for i in ids):
+            return jsonify({"error": "ids must be a non-empty list of venta IDs"}), 400
+        if len(ids) > MAX_BATCH_VENTAS:
+            return jsonify({"error": f"A transition accepts at most {MAX_BATCH_VENTAS} ventas"}), 400
+        if type(target_state) is not int or target_state not in [e.value for e in VentaState]:
+            return jsonify({"estado_actual": ["Must be one of: " + ", ".join(str(e.value) for e in VentaState) + "."]}), 400
+
+        ids = list(dict.fromkeys(ids))
+        results = {venta_id: {'status': 'conflict'} for venta_id in ids}
+
+        # Se leen hasta BATCH_WRITE_LIMIT // 2 ventas por commit; las que no
+        # caben con sus agregados pasan al siguiente
+        pending = list(ids)
+        while pending:
+            doc_refs = [ventas_collection.document(venta_id) for venta_id in pending[:BATCH_WRITE_LIMIT // 2]]
+            for _ in range(MAX_TRANSITION_ATTEMPTS):
+                handled = _commit_transition_chunk(doc_refs, target_state, results)
+                if handled is not None:
+                    break
+                # Conflicto: se vuelve a leer el lote completo
+                for doc_ref in doc_refs:
+                    results[doc_ref.id] = {'status': 'conflict'}
+            else:
+                handled = {doc_ref.id for doc_ref in doc_refs}
+            pending = [venta_id for venta_id in pending if venta_id not in handled]
+
+        return jsonify({
+            "results": {venta_id: result['status'] for venta_id, result in results.items()}
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/ventas/archive', methods=['POST'])
+@token_required
+@admin_required()
+def archive_old_ventas():
+    """
+    Move terminal ventas (RECOGIDO, ERROR) not updated for a while to the
+    'ventas_archive' collection, in compact form (see archive.py).
+
+    Accepts an optional {"older_than_days": int} body (default
+    ARCHIVE_AFTER_DAYS). Aggregates are preserved and GET /ventas/<id> and
+    the public endpoint still find archived ventas.
+
+    Returns:
+        JSON: {"archived": int, "skipped": int}.
+    """
+    if not ventas_collection:
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        data = request.get_json(silent=True) or {}
+        older_than_days = data.get('older_than_days', ARCHIVE_AFTER_DAYS)
+        if type(older_than_days) is not int or older_than_days < 1:
+            return jsonify({"error": "older_than_days must be a positive integer"}), 400
+        return jsonify(archive_ventas(older_than_days)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @api.route('/ventas', methods=['GET'])
 @token_required
 def get_ventas():
     """
-    Get all ventas from Firestore, with optional filtering.
-
-    Retrieves documents from the 'ventas' collection. If a 'client_id'
-    query parameter is provided, it filters the ventas for that client.
-    Otherwise, it returns all ventas.
+    Get ventas from Firestore, with optional filtering, paging and projection.
+
+    Query params:
+        client_id (str): Only return ventas of this client.
+        estado (str): Comma-separated states (e.g. '1,2'); only ventas in them.
+        created_from (str): ISO date/datetime; only ventas created at or after it.
+        created_to (str): ISO date/datetime (a date covers the whole day);
+            only ventas created at or before it.
+        fields (str): Comma-separated list of fields to return (e.g.
+            'estado_actual,coste'). 'id' is always included.
+        limit (int): Page size (max MAX_PAGE_SIZE). Enables paged mode.
+        page_token (str): Cursor returned by the previous page.
+        stream (str): 'json' or 'ndjson' to stream the full listing instead
+            of building it in memory (ignored in paged mode).
+
+    Filters are planned into an indexed Firestore query (see
+    query_planner.py); unknown parameters and combinations without an index
+    get a 400. Listings filtered by estado or created_at, like paged ones,
+    are ordered by created_at (newest first). In paged mode the response is
+    {"ventas": [...], "next_page_token": str | null}; without
+    limit/page_token the full list is returned as a plain array.
 
     Returns:
-        JSON: A list of ventas or an error message.
+        JSON: A list (or page) of ventas or an error message.
     """
     if not ventas_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
-        client_id_filter = request.args.get('client_id')
-        
-        if client_id_filter:
-            query = ventas_collection.where('client_id', '==', client_id_filter)
-        else:
-            query = ventas_collection
+        try:
+            plan = plan_venta_query(request.args)
+        except UnsupportedQuery as e:
+            return jsonify({"error": str(e)}), 400
+        fields_param = request.args.get('fields')
+        limit_param = request.args.get('limit')
+        page_token = request.args.get('page_token')
+
+        serializer = venta_serializer
+        if fields_param:
+            fields = {f.strip() for f in fields_param.split(',') if f.strip()} | {'id'}
+            unknown_fields = fields - set(VentaSchema._declared_fields)
+            if unknown_fields:
+                return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown_fields))}"}), 400
+            serializer = venta_fields_serializer(fields)
+
+        paged = limit_param is not None or page_token is not None
+        stream_format = requested_stream_format()
+        if plan.client_id and not paged and not stream_format:
+            # Listado completo de un cliente: desde el modelo de lectura si lo tiene entero
+            cached_ventas = ventas_read_model.ventas_for_client(plan.client_id)
+            if cached_ventas is not None:
+                return jsonify(serializer.dump(cached_ventas, many=True)), 200
+
+        query = plan.build(ventas_collection, paged=paged)
+
+        if paged:
+            try:
+                limit = min(int(limit_param or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+                if limit < 1:
+                    raise ValueError("limit must be positive")
+                cursor = decode_page_token(page_token) if page_token else None
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            # Orden estable (created_at + id como desempate) aplicado por el plan
+            if cursor:
+                query = query.start_after(cursor)
+            query = query.limit(limit)
+
+        if fields_param:
+            # created_at es necesario para construir el cursor de la siguiente página
+            projection = fields - {'id'}
+            if paged:
+                projection.add('created_at')
+            query = query.select(sorted(projection))
+
+        if stream_format and not paged:
+            return stream_query(query, serializer, stream_format)
 
         all_ventas = []
         for doc in query.stream():
             venta = doc.to_dict()
             venta['id'] = doc.id
             all_ventas.append(venta)
-            
-        return jsonify(ventas_schema.dump(all_ventas)), 200
+
+        if not paged:
+            return jsonify(serializer.dump(all_ventas, many=True)), 200
+
+        next_page_token = None
+        if len(all_ventas) == limit:
+            last = all_ventas[-1]
+            next_page_token = encode_page_token(last['created_at'], last['id'])
+
+        return jsonify({
+            "ventas": serializer.dump(all_ventas, many=True),
+            "next_page_token": next_page_token
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@api.route('/ventas/events', methods=['GET'])
+@token_required
+def get_ventas_events():
+    """
+    Server-Sent Events stream of venta changes for the live order board.
+
+    Each 'venta' event carries a diff: {"id", "type", "estado_actual",
+    "updated_at", "venta"} with type added, modified or removed and "venta"
+    the listing fields of the committed document (null when removed), so the
+    board never refetches through a possibly stale read model. Reconnecting with the
+    Last-Event-ID header resumes after the last event received; a 'reset'
+    event means the gap can't be replayed and the board must reload.
+
+    Returns:
+        Response: A text/event-stream response.
+    """
+    if not ventas_collection:
+        return jsonify({"error": "Firestore not initialized"}), 500
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(
+        venta_events.stream(last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @api.route('/ventas/count', methods=['GET'])
 @token_required
 def count_ventas_by_status():
     """
     Count ventas by their current status.
 
-    Iterates through all ventas and returns a count for each status defined in the
-    VentaState enum.
+    Query Parameters:
+        client_id, created_from, created_to, estado: Optional GET /ventas
+            filters; only ventas matching them are counted.
+
+    Without filters it is served from the read model's copy of the
+    materialized per-state counters (see counters.py and read_model.py); on
+    a miss they are read from Firestore with a single document get. Filtered
+    counts are server-side count() aggregations (see aggregations.py).
 
     Returns:
         JSON: A dictionary with status counts or an error message.
@@ -161,12 +691,13 @@ def count_ventas_by_status():
     if not ventas_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
-        status_counts = {state.value: 0 for state in VentaState}
-        for doc in ventas_collection.stream():
-            venta = doc.to_dict()
-            if 'estado_actual' in venta and venta['estado_actual'] in status_counts:
-                status_counts[venta['estado_actual']] += 1
-        return jsonify(status_counts), 200
+        if request.args:
+            try:
+                return jsonify(count_ventas_by_state(request.args)), 200
+            except UnsupportedQuery as e:
+                return jsonify({"error": str(e)}), 400
+        counts = ventas_read_model.state_counts()
+        return jsonify(counts if counts is not None else get_state_counts()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -174,7 +705,18 @@ def count_ventas_by_status():
 @token_required
 def get_ventas_stats():
     """
-    Get sales statistics for the current day.
+    Get sales statistics for the current day, or for a range of days.
+
+    Query Parameters:
+        created_from (str): ISO date/datetime; start of the range.
+        created_to (str): ISO date/datetime (a date covers the whole day); end of the range.
+        client_id (str): Only this client's ventas.
+
+    The current day is served from the daily rollup bucket plus the
+    per-state counters (see counters.py): a constant number of reads however
+    much history exists. Ranges are server-side count()/sum() aggregations
+    (see aggregations.py); pedidos_antiguos are then the ventas created
+    before the range that are still open.
 
     Returns:
         JSON: A dictionary with total_precio, total_ventas, and pedidos_antiguos.
@@ -182,50 +724,53 @@ def get_ventas_stats():
     if not ventas_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
-        now = datetime.now()
-        start_of_day = datetime(now.year, now.month, now.day)
-        
-        # Daily stats
-        query_today = ventas_collection.where('created_at', '>=', start_of_day)
-        total_precio_today = 0
-        total_ventas_today = 0
-        for doc in query_today.stream():
-            venta = doc.to_dict()
-            if venta.get('coste'):
-                total_precio_today += venta.get('coste').get('total', 0)
-            total_ventas_today += 1
-            
-        # Old pending orders
-        query_old = ventas_collection.where('created_at', '<', start_of_day)
-        pedidos_antiguos = 0
-        non_terminal_states = [
-            VentaState.EN_COLA.value, 
-            VentaState.LAVANDO.value, 
-            VentaState.PTE_RECOGIDA.value
-        ]
-        
-        for doc in query_old.stream():
-            venta = doc.to_dict()
-            if venta.get('estado_actual') in non_terminal_states:
-                pedidos_antiguos += 1
-
-        return jsonify({
-            "total_precio": total_precio_today,
-            "total_ventas": total_ventas_today,
-            "pedidos_antiguos": pedidos_antiguos
-        }), 200
+        if request.args:
+            if 'estado' in request.args:
+                return jsonify({"error": "Stats can't be filtered by estado"}), 400
+            try:
+                return jsonify(get_range_stats(request.args)), 200
+            except UnsupportedQuery as e:
+                return jsonify({"error": str(e)}), 400
+        return jsonify(get_daily_stats()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-        for doc in query_old.stream():
-            venta = doc.to_dict()
-            if venta.get('estado_actual') not in [VentaState.ENTREGADO.value, VentaState.CANCELADO.value]:
-                pedidos_antiguos += 1
 
-        return jsonify({
-            "total_precio": total_precio_today,
-            "total_ventas": total_ventas_today,
-            "pedidos_antiguos": pedidos_antiguos
-        }), 200
+@api.route('/ventas/analytics/dwell', methods=['GET'])
+@token_required
+@admin_required()
+def get_dwell_analytics_endpoint():
+    """
+    How long ventas stay in each state, for machine capacity planning.
+
+    Query Parameters:
+        from (str): First day, 'YYYY-MM-DD' (UTC). Defaults to 6 days before `to`.
+        to (str): Last day, 'YYYY-MM-DD' (UTC). Defaults to today.
+
+    Served from the per-day dwell sketches maintained with every state
+    change (see dwell.py): percentiles are approximate (< 5% error) and no
+    venta is read.
+
+    Returns:
+        JSON: dwell percentiles per state (seconds), hourly throughput (exits
+        per state) and hourly queue length of the open states.
+    """
+    if not ventas_collection:
+        return jsonify({"error": "Firestore not initialized"}), 500
+    try:
+        today = datetime.now(timezone.utc).date()
+        try:
+            end_day = date.fromisoformat(request.args['to']) if 'to' in request.args else today
+            start_day = date.fromisoformat(request.args['from']) if 'from' in request.args else end_day - timedelta(days=6)
+        except ValueError:
+            return jsonify({"error": "from and to must be dates in YYYY-MM-DD format"}), 400
+        if start_day > end_day:
+            return jsonify({"error": "from must not be after to"}), 400
+        if (end_day - start_day).days >= MAX_DWELL_RANGE_DAYS:
+            return jsonify({"error": f"The range can span at most {MAX_DWELL_RANGE_DAYS} days"}), 400
+        if (today - start_day).days > MAX_DWELL_LOOKBACK_DAYS:
+            return jsonify({"error": f"from can be at most {MAX_DWELL_LOOKBACK_DAYS} days ago"}), 400
+
+        return jsonify(get_dwell_analytics(start_day, end_day, get_state_counts())), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -235,6 +780,9 @@ def get_venta(venta_id):
     """
     Get a single venta by its ID.
 
+    Open and recent ventas are served from the read model; anything else
+    falls back to Firestore, then to the archive.
+
     Args:
         venta_id (str): The unique identifier for the venta.
 
@@ -244,14 +792,21 @@ def get_venta(venta_id):
     if not ventas_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
+        cached_venta = ventas_read_model.get(venta_id)
+        if cached_venta is not None:
+            return jsonify(venta_serializer.dump(cached_venta)), 200
+
         doc_ref = ventas_collection.document(venta_id)
         doc = doc_ref.get()
         if doc.exists:
             venta = doc.to_dict()
             venta['id'] = doc.id
-            return jsonify(venta_schema.dump(venta)), 200
-        else:
-            return jsonify({"error": "Venta not found"}), 404
+            return jsonify(venta_serializer.dump(venta)), 200
+
+        archived_venta = get_archived_venta(venta_id)
+        if archived_venta is not None:
+            return jsonify(venta_serializer.dump(archived_venta)), 200
+        return jsonify({"error": "Venta not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -275,32 +830,13 @@ def update_venta(venta_id):
     try:
         data = request.get_json()
         try:
-            validated_data = venta_schema.load(data, partial=True)
+            validated_data = venta_loader.load(data, partial=True)
         except ValidationError as err:
             return jsonify(err.messages), 400
         
         doc_ref = ventas_collection.document(venta_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            existing_venta = doc.to_dict()
-            now = datetime.now()
-            validated_data['updated_at'] = now
-
-            if 'estado_actual' in validated_data and validated_data['estado_actual'] != existing_venta.get('estado_actual'):
-                historial = existing_venta.get('historial_estados', {})
-                
-                # Close the previous state
-                previous_state = str(existing_venta.get('estado_actual'))
-                if previous_state in historial:
-                    historial[previous_state]['salida'] = now
-
-                # Open the new state
-                new_state = str(validated_data['estado_actual'])
-                historial[new_state] = {'entrada': now, 'salida': None}
-                
-                validated_data['historial_estados'] = historial
-
-            doc_ref.update(validated_data)
+        if _update_venta_txn(db.transaction(), doc_ref, validated_data):
+            public_payload_cache.invalidate(venta_id)
             return jsonify({"success": True}), 200
         else:
             return jsonify({"error": "Venta not found"}), 404
@@ -313,6 +849,9 @@ def delete_venta(venta_id):
     """
     Delete a venta from Firestore.
 
+    Archived ventas (ventas_archive) are deleted from the archive, and the
+    aggregates are decremented the same way.
+
     Args:
         venta_id (str): The ID of the venta to delete.
 
@@ -323,37 +862,71 @@ def delete_venta(venta_id):
         return jsonify({"error": "Firestore not initialized"}), 500
     try:
         doc_ref = ventas_collection.document(venta_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.delete()
+        if _delete_venta_txn(db.transaction(), doc_ref):
+            public_payload_cache.invalidate(venta_id)
             return jsonify({"success": True}), 200
         else:
             return jsonify({"error": "Venta not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _render_public_venta(venta_id):
+    """
+    Read a venta and render its public payload into the payload cache.
+
+    Returns:
+        tuple | None: (body, etag, cache_control), or None if it does not exist.
+    """
+    version = public_payload_cache.version()
+    venta = ventas_read_model.get(venta_id)
+    if venta is None:
+        doc = ventas_collection.document(venta_id).get()
+        if doc.exists:
+            venta = doc.to_dict()
+            venta['id'] = doc.id
+        else:
+            venta = get_archived_venta(venta_id)
+            if venta is None:
+                return None
+
+    # APLICAMOS LA MÁSCARA: Solo salen los datos definidos en PublicVentaSchema
+    body = current_app.json.response(public_venta_serializer.dump(venta)).get_data()
+    return public_payload_cache.put(venta_id, body, venta.get('estado_actual'), version)
+
 @api.route('/public/ventas/<string:venta_id>', methods=['GET'])
+@rate_limited('public_venta', PUBLIC_RATE_LIMIT_PER_MINUTE, PUBLIC_RATE_LIMIT_BURST)
 def get_public_venta_traceability(venta_id):
     """
     Returns sanitized status of a sale. No Auth required.
+
+    Rendered payloads are kept in a per-worker LRU invalidated by venta
+    events, and responses carry a strong ETag plus Cache-Control headers:
+    a matching If-None-Match gets an empty 304. Concurrent misses for the
+    same venta share one backend read; clients are throttled per IP (429).
     """
     if not ventas_collection:
         return jsonify({"error": "Firestore not initialized"}), 500
     
     try:
-        doc_ref = ventas_collection.document(venta_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
-            venta = doc.to_dict()
-            venta['id'] = doc.id
-            
-            # APLICAMOS LA MÁSCARA: Solo salen los datos definidos en PublicVentaSchema
-            return jsonify(public_venta_schema.dump(venta)), 200
-        else:
+        # Listener que invalida la caché de respuestas cuando cambia una venta
+        venta_events.ensure_started()
+        cached = public_payload_cache.get(venta_id)
+        if cached is None:
+            cached = public_lookups.do(venta_id, lambda: _render_public_venta(venta_id))
+
+        if cached is None:
             # Devolvemos 404 genérico para no filtrar información
-            return jsonify({"error": "Order not found"}), 404
+            response = jsonify({"error": "Order not found"})
+            response.status_code = 404
+            response.headers['Cache-Control'] = NOT_FOUND_CACHE_CONTROL
+            return response
+
+        body, etag, cache_control = cached
+        response = Response(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response.make_conditional(request)
 
     except Exception as e:
         print(f"Error public endpoint: {str(e)}") 
-        return jsonify({"error": "Error retrieving status"}), 500
\ No newline at end of file
+        return jsonify({"error": "Error retrieving status"}), 500
@@ -0,0 +1,124 @@
+# Micro-benchmark of the response serialization path.
+#
+# Builds N venta/client documents (shaped like Firestore to_dict() output) and
+# times marshmallow dump + Flask's default JSON provider against the compiled
+# serializers (serializers.py) + FastJSONProvider. Both paths must produce the
+# same bytes; the script exits with an error if they don't.
+#
+#   python serializer_benchmark.py --documents 10000 --repeat 5
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# populate_db importa db: siempre el backend en memoria
+os.environ['FIRESTORE_BACKEND'] = 'memory'
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from models import venta_schema, public_venta_schema, client_schema
+from populate_db import create_random_ventas
+from serializers import venta_serializer, public_venta_serializer, client_serializer, orjson, FastJSONProvider
+
+def to_firestore_datetime(value):
+    """Timestamps come back from Firestore as tz-aware DatetimeWithNanoseconds."""
+    if value is None:
+        return None
+    value = value.astimezone(timezone.utc)
+    return DatetimeWithNanoseconds(*value.timetuple()[:6], value.microsecond, tzinfo=timezone.utc)
+
+def build_documents(count, seed_value):
+    """Return (ventas, clients) as plain dicts with an 'id' field."""
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    ventas = []
+    clients = {}
+    for i, venta in enumerate(create_random_ventas(count, seed=seed_value, now=now)):
+        client_id = f"client{venta['telefono']}"
+        created_at = to_firestore_datetime(venta['created_at'])
+        ventas.append({
+            'id': f"venta{i:06d}",
+            'client_id': client_id,
+            'nombre': venta['nombre'],
+            'telefono': str(venta['telefono']),
+            'created_at': created_at,
+            'updated_at': to_firestore_datetime(venta['updated_at']),
+            'estado_actual': venta['estado_actual'],
+            'coste': venta['coste'],
+            'historial_estados': {
+                estado: {key: to_firestore_datetime(value) for key, value in entrada.items()}
+                for estado, entrada in venta['historial_estados'].items()
+            }
+        })
+        client = clients.setdefault(client_id, {
+            'id': client_id,
+            'nombre': venta['nombre'],
+            'telefono': str(venta['telefono']),
+            'firebase_uid': None,
+            'created_at': created_at,
+            'total_ventas': 0,
+            'gasto_total': 0,
+            'last_purchase_date': None
+        })
+        client['total_ventas'] += 1
+        client['gasto_total'] += venta['coste']['total']
+        client['last_purchase_date'] = max(client['last_purchase_date'] or created_at, created_at)
+    return ventas, list(clients.values())
+
+def best_of(repeat, fn):
+    """Best wall time of `repeat` runs of fn() and its last result."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def run(num_documents, repeat, seed_value):
+    app = Flask(__name__)
+    default_json = DefaultJSONProvider(app)
+    fast_json = FastJSONProvider(app)
+
+    ventas, clients = build_documents(num_documents, seed_value)
+    cases = [
+        ('VentaSchema', venta_schema, venta_serializer, ventas),
+        ('PublicVentaSchema', public_venta_schema, public_venta_serializer, ventas),
+        ('ClientSchema', client_schema, client_serializer, clients),
+    ]
+
+    results = []
+    for name, schema, serializer, documents in cases:
+        # Igual que jsonify(): claves ordenadas, ASCII y separadores compactos
+        dump_time, dumped = best_of(repeat, lambda: schema.dump(documents, many=True))
+        encode_time, expected = best_of(repeat, lambda: default_json.dumps(dumped, separators=(',', ':')))
+        fast_dump_time, fast_dumped = best_of(repeat, lambda: serializer.dump(documents, many=True))
+        fast_encode_time, actual = best_of(repeat, lambda: fast_json.dumps(fast_dumped, separators=(',', ':')))
+
+        if actual != expected:
+            print(f"{name}: compiled output differs from marshmallow + json.dumps", file=sys.stderr)
+            sys.exit(1)
+
+        baseline = dump_time + encode_time
+        compiled = fast_dump_time + fast_encode_time
+        results.append((name, len(documents), dump_time, encode_time, fast_dump_time, fast_encode_time, baseline / compiled))
+    return results
+
+def print_report(results):
+    print(f"JSON encoder: {'orjson ' + orjson.__version__ if orjson else 'json (orjson not installed)'}")
+    print(f"{'schema':<18} {'docs':>6} {'dump ms':>9} {'json ms':>9} {'fast dump':>10} {'fast json':>10} {'speedup':>8}")
+    for name, count, dump_time, encode_time, fast_dump_time, fast_encode_time, speedup in results:
+        print(f"{name:<18} {count:>6} {dump_time * 1000:>9.1f} {encode_time * 1000:>9.1f} "
+              f"{fast_dump_time * 1000:>10.1f} {fast_encode_time * 1000:>10.1f} {speedup:>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare marshmallow + json.dumps with the compiled serializers.")
+    parser.add_argument('--documents', type=int, default=10000, help="Number of ventas to serialize.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement (best is reported).")
+    parser.add_argument('--seed', type=int, default=42, help="Seed for the generated documents.")
+    args = parser.parse_args()
+
+    print_report(run(args.documents, args.repeat, args.seed))
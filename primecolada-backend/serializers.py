@@ -0,0 +1,219 @@
+import codecs
+import re
+from marshmallow import Schema, fields, missing
+from marshmallow.utils import ensure_text_type
+from flask.json.provider import DefaultJSONProvider
+from models import venta_schema, ventas_schema, public_venta_schema, client_schema, VentaSchema
+from instrumentation import TimedSchema
+
+try:
+    import orjson
+except ImportError:  # Opcional: sin orjson se usa el codificador json de la stdlib
+    orjson = None
+
+# Serialización rápida de respuestas: los esquemas de marshmallow se compilan
+# una vez al importar en funciones planas (un encoder por campo, datetime →
+# ISO directo) y el proveedor JSON de Flask codifica con orjson cuando el
+# resultado es idéntico byte a byte al de json.dumps.
+
+_COMPILED_FIELD_TYPES = (fields.String, fields.Integer, fields.DateTime, fields.Nested, fields.Dict)
+
+class CompiledSchema:
+    """
+    Drop-in replacement for `schema.dump` generated from a marshmallow schema.
+
+    Each field becomes a line of straight Python code (compiled once), so
+    dumping skips marshmallow's per-field dispatch. Output is identical to
+    `schema.dump`. Fields, schemas or objects the compiler does not handle
+    (hooks, custom fields, non-dict objects) go through marshmallow itself.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.many = schema.many
+        self._dump_one = _compile(schema)
+
+    def dump(self, obj, many=None):
+        many = self.many if many is None else bool(many)
+        if many and obj is not None:
+            dump_one = self._dump_one
+            return [dump_one(item) for item in obj]
+        return self._dump_one(obj)
+
+def _compilable(schema):
+    return (
+        type(schema).get_attribute is Schema.get_attribute
+        and schema.dict_class is dict
+        and not any(schema._hooks.values())
+    )
+
+def _value_expr(field, var, namespace, depth=0):
+    """
+    Python expression serializing `var` like `field._serialize(var, ...)`,
+    or None if the field has to go through marshmallow.
+    """
+    kind = type(field)
+    if kind is fields.String:
+        return f"None if {var} is None else ({var} if type({var}) is str else _text({var}))"
+    if kind is fields.Integer and not field.as_string:
+        return f"None if {var} is None else ({var} if type({var}) is int else int({var}))"
+    if kind is fields.DateTime:
+        name = f"_format_{len(namespace)}"
+        data_format = field.format or field.DEFAULT_FORMAT
+        format_func = field.SERIALIZATION_FUNCS.get(data_format)
+        if format_func is None:
+            namespace[name] = data_format
+            return f"None if {var} is None else {var}.strftime({name})"
+        # datetime.isoformat sin pasar por el método de la subclase, como marshmallow
+        namespace[name] = format_func
+        return f"None if {var} is None else {name}({var})"
+    if kind is fields.Nested:
+        name = f"_nested_{len(namespace)}"
+        nested = field.schema
+        namespace[name] = CompiledSchema(nested)._dump_one
+        if nested.many or field.many:
+            item = f"_item{depth}"
+            return f"None if {var} is None else [{name}({item}) for {item} in {var}]"
+        return f"None if {var} is None else {name}({var})"
+    if kind is fields.Dict:
+        if field.key_field is None and field.value_field is None:
+            return f"None if {var} is None else dict({var})"
+        key, value = f"_key{depth}", f"_value{depth}"
+        key_expr = key if field.key_field is None else _value_expr(field.key_field, key, namespace, depth + 1)
+        value_expr = value if field.value_field is None else _value_expr(field.value_field, value, namespace, depth + 1)
+        if key_expr is None or value_expr is None:
+            return None
+        return f"None if {var} is None else {{({key_expr}): ({value_expr}) for {key}, {value} in {var}.items()}}"
+    return None
+
+def _compile(schema):
+    """Generate the `dump` function of a single object for `schema`."""
+    if not _compilable(schema):
+        return lambda obj: schema.dump(obj, many=False)
+
+    namespace = {'_missing': missing, '_text': ensure_text_type, '_fallback': schema.dump}
+    lines = [
+        "def dump(obj):",
+        "    if type(obj) is not dict:",
+        "        return _fallback(obj, many=False)",
+        "    out = {}",
+    ]
+    for attr_name, field in schema.dump_fields.items():
+        key = field.data_key if field.data_key is not None else attr_name
+        source = field.attribute or attr_name
+        expr = None
+        if (
+            type(field) in _COMPILED_FIELD_TYPES
+            and field.dump_default is missing
+            and '.' not in source
+            # marshmallow recurre a getattr(dict, ...) si falta la clave
+            and not hasattr(dict, source)
+        ):
+            expr = _value_expr(field, 'value', namespace)
+
+        if expr is not None:
+            lines += [
+                f"    value = obj.get({source!r}, _missing)",
+                "    if value is not _missing:",
+                f"        out[{key!r}] = {expr}",
+            ]
+        elif type(field) is fields.Method and field._serialize_method is not None:
+            name = f"_method_{len(namespace)}"
+            namespace[name] = field._serialize_method
+            lines += [
+                f"    value = {name}(obj)",
+                "    if value is not _missing:",
+                f"        out[{key!r}] = value",
+            ]
+        else:
+            name = f"_field_{len(namespace)}"
+            namespace[name] = field
+            namespace['_get_attribute'] = schema.get_attribute
+            lines += [
+                f"    value = {name}.serialize({attr_name!r}, obj, accessor=_get_attribute)",
+                "    if value is not _missing:",
+                f"        out[{key!r}] = value",
+            ]
+    lines.append("    return out")
+
+    exec(compile("\n".join(lines), f"<compiled {type(schema).__name__}>", "exec"), namespace)
+    return namespace['dump']
+
+# Esquemas que usan las rutas, cronometrados en Server-Timing (serialize)
+venta_serializer = TimedSchema(CompiledSchema(venta_schema))
+public_venta_serializer = TimedSchema(CompiledSchema(public_venta_schema))
+client_serializer = TimedSchema(CompiledSchema(client_schema))
+venta_loader = TimedSchema(venta_schema)
+ventas_loader = TimedSchema(ventas_schema)
+
+_field_serializers = {}
+
+def venta_fields_serializer(only):
+    """Timed CompiledSchema of VentaSchema restricted to the `only` field names (cached)."""
+    key = frozenset(only)
+    serializer = _field_serializers.get(key)
+    if serializer is None:
+        serializer = _field_serializers[key] = TimedSchema(CompiledSchema(VentaSchema(only=tuple(sorted(key)))))
+    return serializer
+
+# --- Proveedor JSON de Flask ---
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+# Floats que orjson escribe distinto que json.dumps: notación exponencial
+# (1e16 frente a 1e+16) y menores que 1e-4 (0.00001 frente a 1e-05). NaN e
+# Infinity (JSON no válido con json.dumps) salen como null con orjson.
+_EXPONENT = re.compile(rb'e-?[0-9]')
+_DIGITS = frozenset(b'0123456789')
+
+def _orjson_float_mismatch(encoded):
+    if b'0.0000' in encoded:
+        return True
+    # Los candidatos son raros: 'e' seguida de dígito dentro de un texto
+    return any(encoded[match.start() - 1] in _DIGITS for match in _EXPONENT.finditer(encoded, 1))
+
+def _escape_non_ascii(error):
+    """Codec error handler: escape non-ASCII text like json.dumps(ensure_ascii=True)."""
+    escaped = []
+    for char in error.object[error.start:error.end]:
+        code = ord(char)
+        if code > 0xFFFF:
+            code -= 0x10000
+            escaped.append('\\u{0:04x}\\u{1:04x}'.format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF)))
+        else:
+            escaped.append('\\u{0:04x}'.format(code))
+    return ''.join(escaped), error.end
+
+codecs.register_error('json_ascii_escape', _escape_non_ascii)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes compact responses with orjson.
+
+    Output is byte-identical to the default provider (sorted keys, escaped
+    non-ASCII, compact separators). Payloads orjson would render differently,
+    debug/indented output, or orjson being unavailable fall back to
+    `json.dumps`. Dates still go through Flask's default handler (HTTP date).
+    """
+
+    def dumps(self, obj, **kwargs):
+        if (
+            orjson is not None
+            and kwargs.get('separators') == (',', ':')
+            and kwargs.get('indent') is None
+            and 'default' not in kwargs
+            and self.sort_keys
+            and self.ensure_ascii
+        ):
+            try:
+                encoded = orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS)
+            except TypeError:
+                # Claves no str, enteros de más de 64 bits, surrogates...
+                encoded = None
+            if encoded is not None and not _orjson_float_mismatch(encoded):
+                text = encoded.decode()
+                if not encoded.isascii():
+                    text = text.encode('ascii', 'json_ascii_escape').decode('ascii')
+                # DEL es ASCII pero json.dumps también lo escapa
+                return text.replace('\x7f', '\\u007f') if '\x7f' in text else text
+        return super().dumps(obj, **kwargs)
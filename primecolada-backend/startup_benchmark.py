@@ -0,0 +1,138 @@
+# Benchmark of the cold start of the backend (what the first customer waits
+# for when the container scales up from zero).
+#
+# Launches fresh interpreters that import app.py and serve one request through
+# the Flask test client, and reports:
+#   - the time to first request, from launching the interpreter to the response
+#     (median and worst of --runs), split into import and first request;
+#   - the modules that take longest to import (python -X importtime), and the
+#     import time of each module of this repository.
+# Exits with an error if the median time to first request exceeds --budget-ms,
+# if the request fails, or if importing the app already created the Firestore
+# client or the Firebase Admin app (they must be created on first use, see
+# lazy.py).
+#
+# The budget is the measured median (~700-950 ms) plus a modest margin: a
+# return to the eager imports (~1000 ms of import alone) goes over it.
+# tests/test_startup.py runs the same check.
+#
+#   python startup_benchmark.py --runs 7 --budget-ms 1200
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RUNS = 7
+DEFAULT_BUDGET_MS = 1200
+DEFAULT_PATH = '/public/ventas/startup-check'
+
+# Código del proceso hijo: importa la app y atiende una petición
+CHILD = """
+import json, sys, time
+started = time.time()
+import app, auth_middleware, db
+imported = time.time()
+eager = [name for name, proxy in (('firestore', db.db), ('firebase_admin', auth_middleware.auth)) if proxy.initialized]
+status = app.app.test_client().get(sys.argv[1]).status_code
+print(json.dumps({'started': started, 'imported': imported, 'responded': time.time(), 'status': status, 'eager': eager}))
+"""
+
+def _child_env(backend):
+    env = dict(os.environ, FIRESTORE_BACKEND=backend)
+    # Sin avisos de dependencias en la salida del hijo
+    env.setdefault('PYTHONWARNINGS', 'ignore')
+    return env
+
+def cold_start(path, backend):
+    """Launch one interpreter and time it up to its first response."""
+    launched = time.time()
+    completed = subprocess.run([sys.executable, '-c', CHILD, path], cwd=BACKEND_DIR, env=_child_env(backend),
+                               capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        'interpreter': result['started'] - launched,
+        'import': result['imported'] - result['started'],
+        'first_request': result['responded'] - result['imported'],
+        'total': result['responded'] - launched,
+        'status': result['status'],
+        'eager': result['eager']
+    }
+
+def import_times(backend):
+    """
+    Import times of `import app` as (module, self seconds, cumulative seconds,
+    depth) tuples, in python -X importtime order.
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=BACKEND_DIR,
+                               env=_child_env(backend), capture_output=True, text=True, check=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return modules
+
+def check_runs(runs, budget_ms, path=DEFAULT_PATH):
+    """
+    Check measured cold starts against the budget.
+
+    Returns:
+        tuple: (median seconds, list of error messages).
+    """
+    median = statistics.median(run['total'] for run in runs)
+    errors = []
+    if median * 1000 > budget_ms:
+        errors.append(f"Median time to first request ({median * 1000:.0f} ms) exceeds the {budget_ms:.0f} ms budget")
+    if any(run['status'] >= 500 for run in runs):
+        errors.append(f"The first request to {path} failed")
+    eager = sorted({name for run in runs for name in run['eager']})
+    if eager:
+        errors.append(f"Importing the app initialized {', '.join(eager)}; it must happen on first use")
+    return median, errors
+
+def local_modules():
+    return {name[:-3] for name in os.listdir(BACKEND_DIR) if name.endswith('.py')}
+
+def print_report(runs, modules, top):
+    print(f"{'run':>4} {'interpreter ms':>15} {'import ms':>10} {'first request ms':>17} {'total ms':>9} {'status':>7}")
+    for index, run in enumerate(runs):
+        print(f"{index + 1:>4} {run['interpreter'] * 1000:>15.1f} {run['import'] * 1000:>10.1f} "
+              f"{run['first_request'] * 1000:>17.1f} {run['total'] * 1000:>9.1f} {run['status']:>7}")
+
+    print(f"\nSlowest imports (cumulative, -X importtime):")
+    for name, self_time, cumulative, depth in sorted(modules, key=lambda module: -module[2])[:top]:
+        print(f"  {cumulative * 1000:>8.1f} ms  {self_time * 1000:>7.1f} ms self  {'  ' * depth}{name}")
+
+    print(f"\nModules of this repository:")
+    local = local_modules()
+    for name, self_time, cumulative, depth in modules:
+        if name in local:
+            print(f"  {cumulative * 1000:>8.1f} ms  {self_time * 1000:>7.1f} ms self  {name}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request of a cold app.")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="Cold starts to measure (the median is checked).")
+    parser.add_argument('--path', default=DEFAULT_PATH, help="First request (GET).")
+    parser.add_argument('--backend', default='memory', help="FIRESTORE_BACKEND of the measured processes.")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="Fail if the median time to first request is higher.")
+    parser.add_argument('--top', type=int, default=15, help="Slowest imports to list.")
+    args = parser.parse_args()
+
+    runs = [cold_start(args.path, args.backend) for _ in range(args.runs)]
+    print_report(runs, import_times(args.backend), args.top)
+
+    median, errors = check_runs(runs, args.budget_ms, args.path)
+    print(f"\nTime to first request: median {median * 1000:.1f} ms, worst {max(run['total'] for run in runs) * 1000:.1f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+    for error in errors:
+        print(error, file=sys.stderr)
+    if errors:
+        sys.exit(1)
+    print("OK")
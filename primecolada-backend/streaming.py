@@ -0,0 +1,68 @@
+import json
+import logging
+from flask import Response, request, stream_with_context
+
+# Número de documentos que se agrupan en cada chunk de la respuesta
+STREAM_CHUNK_SIZE = 100
+
+def requested_stream_format():
+    """
+    Return the streaming format asked for by the current request, or None.
+
+    `?stream=json` streams a JSON array, `?stream=ndjson` (or an
+    `Accept: application/x-ndjson` header) streams one JSON object per line.
+    """
+    stream_param = request.args.get('stream')
+    if stream_param in ('json', 'ndjson'):
+        return stream_param
+    if 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return 'ndjson'
+    return None
+
+def stream_query(query, schema, fmt='json'):
+    """
+    Stream the documents of a Firestore query as they arrive.
+
+    Each document is dumped through `schema` (a single-object marshmallow
+    schema or its CompiledSchema) and written out in chunks, so worker memory stays constant no
+    matter how many documents the query returns.
+
+    Args:
+        query: A Firestore query or collection reference.
+        schema: Schema or CompiledSchema instance used to serialize each document.
+        fmt (str): 'json' for a JSON array, 'ndjson' for newline-delimited JSON.
+
+    Returns:
+        Response: A streamed Flask response.
+    """
+    ndjson = fmt == 'ndjson'
+
+    def generate():
+        buffer = []
+        first = True
+        if not ndjson:
+            yield '['
+        try:
+            for doc in query.stream():
+                item = doc.to_dict()
+                item['id'] = doc.id
+                encoded = json.dumps(schema.dump(item))
+                if ndjson:
+                    buffer.append(encoded + '\n')
+                else:
+                    buffer.append(encoded if first else ',' + encoded)
+                first = False
+                if len(buffer) >= STREAM_CHUNK_SIZE:
+                    yield ''.join(buffer)
+                    buffer = []
+        except Exception as e:
+            # Las cabeceras ya se han enviado: solo podemos cortar la respuesta
+            logging.error(f"Error streaming query: {e}")
+            raise
+        if buffer:
+            yield ''.join(buffer)
+        if not ndjson:
+            yield ']'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
@@ -29,7 +29,10 @@ def get_swagger_spec():
                     "id": { "type": "string" },
                     "nombre": { "type": "string" },
                     "telefono": { "type": "string" },
-                    "created_at": { "type": "string", "format": "date-time" }
+                    "created_at": { "type": "string", "format": "date-time" },
+                    "total_ventas": { "type": "integer", "readOnly": True },
+                    "gasto_total": { "type": "integer", "readOnly": True },
+                    "last_purchase_date": { "type": "string", "format": "date-time", "readOnly": True }
                 }
             },
             "Venta": {
@@ -53,6 +56,16 @@ def get_swagger_spec():
             "/ventas": {
                 "get": {
                     "summary": "Get all ventas",
+                    "parameters": [
+                        { "name": "client_id", "in": "query", "type": "string", "required": False, "description": "Filter by client_id" },
+                        { "name": "estado", "in": "query", "type": "string", "required": False, "description": "Comma-separated states to filter by (e.g. 1,2)" },
+                        { "name": "created_from", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or after this ISO date/datetime" },
+                        { "name": "created_to", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or before this ISO date/datetime (a date covers the whole day)" },
+                        { "name": "fields", "in": "query", "type": "string", "required": False, "description": "Comma-separated list of fields to return" },
+                        { "name": "limit", "in": "query", "type": "integer", "required": False, "description": "Page size (max 200). Enables paged mode: {ventas, next_page_token}" },
+                        { "name": "page_token", "in": "query", "type": "string", "required": False, "description": "Cursor returned as next_page_token by the previous page" },
+                        { "name": "stream", "in": "query", "type": "string", "enum": ["json", "ndjson"], "required": False, "description": "Stream the full listing as a chunked JSON array or NDJSON" }
+                    ],
                     "responses": { 
                         "200": { 
                             "description": "A list of ventas",
@@ -60,7 +73,8 @@ def get_swagger_spec():
                                 "type": "array",
                                 "items": { "$ref": "#/definitions/Venta" }
                             }
-                        } 
+                        },
+                        "400": { "description": "Unknown filter, invalid value or a filter combination without an index" }
                     }
                 },
                 "post": {
@@ -70,8 +84,97 @@ def get_swagger_spec():
                         "name": "body",
                         "required": True,
                         "schema": { "$ref": "#/definitions/Venta" }
+                    },
+                    { "name": "Idempotency-Key", "in": "header", "type": "string", "required": False, "description": "Client-generated key (e.g. a UUID); retries with the same key return the first response" }],
+                    "responses": {
+                        "201": { "description": "Venta created successfully (or replayed, with Idempotent-Replayed: true)" },
+                        "400": { "description": "Invalid payload or Idempotency-Key" },
+                        "422": { "description": "Idempotency-Key already used with a different payload" }
+                    }
+                }
+            },
+            "/ventas/batch": {
+                "post": {
+                    "summary": "Create many ventas in one request",
+                    "parameters": [{
+                        "in": "body",
+                        "name": "body",
+                        "required": True,
+                        "schema": { "type": "array", "items": { "$ref": "#/definitions/Venta" } }
+                    }],
+                    "responses": {
+                        "201": { "description": "Every venta was created" },
+                        "207": { "description": "Some ventas failed; see the per-item results" },
+                        "400": { "description": "Body is not a list or exceeds 500 ventas" }
+                    }
+                }
+            },
+            "/ventas/transition": {
+                "post": {
+                    "summary": "Move many ventas to the same state",
+                    "parameters": [{
+                        "in": "body",
+                        "name": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "ids": { "type": "array", "items": { "type": "string" } },
+                                "estado_actual": { "type": "integer" }
+                            }
+                        }
+                    }],
+                    "responses": {
+                        "200": { "description": "Per-venta status: updated, unchanged, not_found or conflict" },
+                        "400": { "description": "Invalid ids or estado_actual" }
+                    }
+                }
+            },
+            "/ventas/archive": {
+                "post": {
+                    "summary": "Archive old terminal ventas (admin)",
+                    "parameters": [{
+                        "in": "body",
+                        "name": "body",
+                        "required": False,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "older_than_days": { "type": "integer" }
+                            }
+                        }
                     }],
-                    "responses": { "201": { "description": "Venta created successfully" } }
+                    "responses": {
+                        "200": { "description": "Number of ventas archived and skipped" },
+                        "400": { "description": "Invalid older_than_days" },
+                        "403": { "description": "Admins only" }
+                    }
+                }
+            },
+            "/ventas/analytics/dwell": {
+                "get": {
+                    "summary": "Dwell time percentiles, hourly throughput and queue length per state (admin)",
+                    "parameters": [
+                        {
+                            "name": "from",
+                            "in": "query",
+                            "type": "string",
+                            "required": False,
+                            "description": "First day (YYYY-MM-DD, UTC). Defaults to 6 days before 'to'"
+                        },
+                        {
+                            "name": "to",
+                            "in": "query",
+                            "type": "string",
+                            "required": False,
+                            "description": "Last day (YYYY-MM-DD, UTC). Defaults to today"
+                        }
+                    ],
+                    "responses": {
+                        "200": { "description": "dwell, hours, throughput and queue_length" },
+                        "400": { "description": "Invalid date range" },
+                        "403": { "description": "Admins only" }
+                    }
                 }
             },
             "/ventas/search": {
@@ -99,6 +202,12 @@ def get_swagger_spec():
             "/ventas/count": {
                 "get": {
                     "summary": "Count ventas by status",
+                    "parameters": [
+                        { "name": "client_id", "in": "query", "type": "string", "required": False, "description": "Only count this client's ventas" },
+                        { "name": "estado", "in": "query", "type": "string", "required": False, "description": "Comma-separated states to count (others are 0)" },
+                        { "name": "created_from", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or after this ISO date/datetime" },
+                        { "name": "created_to", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or before this ISO date/datetime" }
+                    ],
                     "responses": {
                         "200": {
                             "description": "A JSON object with the count of ventas for each status.",
@@ -118,7 +227,12 @@ def get_swagger_spec():
             },
             "/ventas/stats": {
                 "get": {
-                    "summary": "Get sales statistics for the current day",
+                    "summary": "Get sales statistics for the current day or a date range",
+                    "parameters": [
+                        { "name": "created_from", "in": "query", "type": "string", "required": False, "description": "Start of the range (ISO date/datetime)" },
+                        { "name": "created_to", "in": "query", "type": "string", "required": False, "description": "End of the range (ISO date/datetime; a date covers the whole day)" },
+                        { "name": "client_id", "in": "query", "type": "string", "required": False, "description": "Only this client's ventas" }
+                    ],
                     "responses": {
                         "200": {
                             "description": "A JSON object with daily sales statistics.",
@@ -161,13 +275,39 @@ def get_swagger_spec():
                 },
                 "delete": {
                     "summary": "Delete a venta",
+                    "description": "Archived ventas are deleted from the archive; the aggregates are decremented either way.",
                     "parameters": [{ "name": "venta_id", "in": "path", "required": True, "type": "string" }],
                     "responses": { "200": { "description": "Venta deleted successfully" }, "404": { "description": "Venta not found" } }
                 }
             },
+            "/auth/cache/stats": {
+                "get": {
+                    "summary": "Verified-token cache counters of the serving worker (admin only)",
+                    "responses": { "200": { "description": "Cache size, hits, misses and evictions, plus the admin roster listener status" }, "403": { "description": "Admins only" } }
+                }
+            },
+            "/ventas/events": {
+                "get": {
+                    "summary": "Server-Sent Events stream of venta changes (live order board)",
+                    "produces": ["text/event-stream"],
+                    "parameters": [
+                        { "name": "Last-Event-ID", "in": "header", "type": "string", "required": False, "description": "Resume after this event ID" }
+                    ],
+                    "responses": { "200": { "description": "'venta' events with {id, type, estado_actual, updated_at}; 'reset' when the client must reload" } }
+                }
+            },
+            "/read-model/stats": {
+                "get": {
+                    "summary": "In-memory read model status of the serving worker (admin only)",
+                    "responses": { "200": { "description": "Listener status, size, hits, misses, staleness and listener lag" }, "403": { "description": "Admins only" } }
+                }
+            },
             "/clients": {
                 "get": {
                     "summary": "Get all clients",
+                    "parameters": [
+                        { "name": "stream", "in": "query", "type": "string", "enum": ["json", "ndjson"], "required": False, "description": "Stream the listing as a chunked JSON array or NDJSON" }
+                    ],
                     "responses": { "200": { "description": "A list of clients" } }
                 },
                 "post": {
@@ -185,7 +325,7 @@ def get_swagger_spec():
                 "get": {
                     "summary": "Get a single client by ID",
                     "parameters": [{ "name": "client_id", "in": "path", "required": True, "type": "string" }],
-                    "responses": { "200": { "description": "The client" }, "404": { "description": "Client not found" } }
+                    "responses": { "200": { "description": "The client" }, "403": { "description": "Not the caller's profile (and not an admin)" }, "404": { "description": "Client not found" } }
                 },
                 "put": {
                     "summary": "Update a client",
@@ -195,10 +335,17 @@ def get_swagger_spec():
                             "in": "body",
                             "name": "body",
                             "required": True,
-                            "schema": { "$ref": "#/definitions/Client" }
+                            "description": "nombre and/or telefono; admins can also set admin (boolean). Other fields are rejected",
+                            "schema": { "type": "object", "properties": { "nombre": { "type": "string" }, "telefono": { "type": "string" }, "admin": { "type": "boolean" } } }
                         }
                     ],
-                    "responses": { "200": { "description": "Client updated successfully" }, "404": { "description": "Client not found" } }
+                    "responses": {
+                        "200": { "description": "Client updated successfully" },
+                        "400": { "description": "Non-editable field or invalid value" },
+                        "403": { "description": "Not the caller's profile (and not an admin)" },
+                        "404": { "description": "Client not found" },
+                        "409": { "description": "The phone belongs to another client" }
+                    }
                 },
                 "delete": {
                     "summary": "Delete a client",
@@ -209,8 +356,17 @@ def get_swagger_spec():
             "/clients/{client_id}/stats": {
                 "get": {
                     "summary": "Get sales statistics for a client",
-                    "parameters": [{ "name": "client_id", "in": "path", "required": True, "type": "string" }],
-                    "responses": { "200": { "description": "Client statistics" }, "404": { "description": "Client not found" } }
+                    "parameters": [
+                        { "name": "client_id", "in": "path", "required": True, "type": "string" },
+                        { "name": "created_from", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or after this ISO date/datetime" },
+                        { "name": "created_to", "in": "query", "type": "string", "required": False, "description": "Only ventas created at or before this ISO date/datetime" }
+                    ],
+                    "responses": {
+                        "200": { "description": "Client statistics; with a range, total_ventas and gasto_total cover only that range (last_purchase_date is always the latest)" },
+                        "400": { "description": "Invalid range" },
+                        "403": { "description": "Not the caller's profile (and not an admin)" },
+                        "404": { "description": "Client not found" }
+                    }
                 }
             }
         }
@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FIRESTORE_BACKEND', 'memory')
+os.environ.setdefault('REQUEST_LOGS_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import auth_middleware
+import memory_firestore
+from benchmark import seed, fake_verify_id_token, ADMIN_TOKEN
+from db import db
+
+# Firestore rechaza los commits de más de 500 escrituras: el backend en
+# memoria también (memory_firestore.MAX_WRITES_PER_COMMIT), así que un lote
+# mal troceado falla aquí igual que en producción.
+
+class BatchWriteLimitTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        auth_middleware.auth.verify_id_token = fake_verify_id_token
+        from app import app
+        cls.client = app.test_client()
+        cls.headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+
+    def setUp(self):
+        seed(20, 1)
+        self.commits = []
+        original = db._commit
+
+        def recording_commit(writes, expected_versions=None):
+            self.commits.append(len(writes))
+            return original(writes, expected_versions)
+        db._commit = recording_commit
+        self.addCleanup(lambda: db.resolve().__dict__.pop('_commit', None))
+
+    def test_batch_of_one_phone_stays_under_the_commit_limit(self):
+        payload = [{'telefono': '600123123', 'nombre': 'Lote', 'coste': {'total': 1}}] * 500
+        response = self.client.post('/ventas/batch', json=payload, headers=self.headers)
+
+        self.assertEqual(response.status_code, 201, response.get_json().get('results', [])[:1])
+        self.assertEqual(response.get_json()['created'], 500)
+        self.assertLessEqual(max(self.commits), memory_firestore.MAX_WRITES_PER_COMMIT)
+
+    def test_transition_across_many_days_stays_under_the_commit_limit(self):
+        # Cada venta en un día distinto y pasa a un estado terminal: un bucket
+        # diario (pedidos_abiertos) por venta
+        now = datetime.now(timezone.utc)
+        ids = []
+        batch = db.batch()
+        for offset in range(500):
+            ref = db.collection('ventas').document()
+            created = now - timedelta(days=offset)
+            batch.set(ref, {
+                'nombre': 'Lote', 'telefono': '+34600123123', 'client_id': None, 'estado_actual': 1,
+                'coste': {'total': 1}, 'created_at': created, 'updated_at': created,
+                'historial_estados': {'1': {'entrada': created, 'salida': None}}
+            })
+            ids.append(ref.id)
+        batch.commit()
+        self.commits.clear()
+
+        response = self.client.post('/ventas/transition', json={'ids': ids, 'estado_actual': 4}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.get_json()['results'].values()), {'updated'})
+        self.assertLessEqual(max(self.commits), memory_firestore.MAX_WRITES_PER_COMMIT)
+        self.assertGreater(len(self.commits), 2)
+
+    def test_client_edit_refreshes_every_venta_in_bounded_commits(self):
+        payload = [{'telefono': '600123123', 'nombre': 'Antes', 'coste': {'total': 1}}] * 500
+        client_id = self.client.post('/ventas/batch', json=payload, headers=self.headers).get_json()['results'][0]['client_id']
+        self.client.post('/ventas/batch', json=payload[:100], headers=self.headers)
+        # Una venta archivada también guarda la copia del nombre
+        archived = next(db.collection('ventas').where('client_id', '==', client_id).limit(1).stream())
+        db.collection('ventas_archive').document(archived.id).set(archived.to_dict())
+        archived.reference.delete()
+        self.commits.clear()
+
+        response = self.client.put(f'/clients/{client_id}', json={'nombre': 'Después'}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(max(self.commits), memory_firestore.MAX_WRITES_PER_COMMIT)
+        names = {
+            doc.to_dict()['nombre']
+            for collection in ('ventas', 'ventas_archive')
+            for doc in db.collection(collection).where('client_id', '==', client_id).stream()
+        }
+        self.assertEqual(names, {'Después'})
+
+if __name__ == '__main__':
+    unittest.main()
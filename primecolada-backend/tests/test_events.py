@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('FIRESTORE_BACKEND', 'memory')
+os.environ.setdefault('REQUEST_LOGS_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import auth_middleware
+from benchmark import seed, fake_verify_id_token, ADMIN_TOKEN
+from events import VentaEventBroker
+
+# Cada broker hace de otro worker: solo se entera de los cambios por sus
+# listeners, nunca por la petición que los provocó.
+
+class VentaDeletionEventTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        auth_middleware.auth.verify_id_token = fake_verify_id_token
+        from app import app
+        cls.client = app.test_client()
+        cls.headers = {'Authorization': f'Bearer {ADMIN_TOKEN}'}
+
+    def setUp(self):
+        self.venta_ids = seed(20, 1)['venta_ids']
+        self.events = []
+        self.worker = VentaEventBroker(buffer_size=100)
+        self.worker.subscribe(self.events.append)
+        self.worker.ensure_started()
+        self.addCleanup(lambda: [watch.unsubscribe() for watch in self.worker._watches])
+
+    def wait_for(self, predicate, timeout=2):
+        deadline = time.time() + timeout
+        while time.time() < deadline and not predicate():
+            time.sleep(0.01)
+
+    def removals(self, venta_id):
+        return [event for event in self.events if event['id'] == venta_id and event['type'] == 'removed']
+
+    def test_deleting_an_unchanged_venta_reaches_other_workers(self):
+        # La venta no se ha tocado desde que arrancó el listener de 'ventas'
+        venta_id = self.venta_ids[0]
+
+        response = self.client.delete(f'/ventas/{venta_id}', headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.wait_for(lambda: self.removals(venta_id))
+        self.assertEqual(len(self.removals(venta_id)), 1)
+
+    def test_edit_events_carry_the_committed_listing_fields(self):
+        # El tablero aplica el evento tal cual, sin volver a pedir la venta
+        venta_id = self.venta_ids[2]
+
+        self.client.put(f'/ventas/{venta_id}', json={'nombre': 'Editada'}, headers=self.headers)
+        self.wait_for(lambda: any(event['id'] == venta_id for event in self.events))
+
+        event = next(event for event in self.events if event['id'] == venta_id)
+        # Entra en la consulta del listener: llega como 'added'
+        self.assertIn(event['type'], ('added', 'modified'))
+        self.assertEqual(event['venta']['id'], venta_id)
+        self.assertEqual(event['venta']['nombre'], 'Editada')
+        self.assertEqual(event['venta']['updated_at'], event['updated_at'])
+        json.dumps(event)
+
+    def test_deleting_a_recently_changed_venta_emits_one_removal(self):
+        venta_id = self.venta_ids[1]
+        self.client.put(f'/ventas/{venta_id}', json={'nombre': 'Editada'}, headers=self.headers)
+        self.wait_for(lambda: any(event['id'] == venta_id for event in self.events))
+
+        self.client.delete(f'/ventas/{venta_id}', headers=self.headers)
+        self.wait_for(lambda: self.removals(venta_id))
+        # Ambos listeners ven el borrado; el segundo aviso se descarta
+        time.sleep(0.1)
+
+        self.assertEqual(len(self.removals(venta_id)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
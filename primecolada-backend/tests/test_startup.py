@@ -0,0 +1,21 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup_benchmark import cold_start, check_runs, DEFAULT_RUNS, DEFAULT_BUDGET_MS, DEFAULT_PATH
+
+# Presupuesto de arranque en frío (ver startup_benchmark.py): mediana de
+# DEFAULT_RUNS intérpretes nuevos hasta la primera respuesta.
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', DEFAULT_BUDGET_MS))
+
+class ColdStartBudgetTest(unittest.TestCase):
+
+    def test_median_time_to_first_request_is_within_budget(self):
+        runs = [cold_start(DEFAULT_PATH, 'memory') for _ in range(DEFAULT_RUNS)]
+        median, errors = check_runs(runs, STARTUP_BUDGET_MS)
+        self.assertEqual(errors, [], f"median {median * 1000:.0f} ms")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import logging
+import sys
+from google.cloud import firestore
+from db import db
+
+# Índice UID de Firebase -> cliente: uid_index/<firebase_uid> = {'client_id': ...}
+# Como phone_index, resuelve el perfil de un usuario con un solo get y, al
+# escribirse en la misma transacción que el perfil, impide que un UID quede
+# vinculado a dos clientes (ver client_login).
+UID_INDEX_COLLECTION = 'uid_index'
+
+def uid_index_ref(firebase_uid):
+    """Return the uid_index DocumentReference for a Firebase UID."""
+    return db.collection(UID_INDEX_COLLECTION).document(firebase_uid)
+
+def lookup_client_id_by_uid(firebase_uid, transaction=None):
+    """
+    Resolve the client linked to a Firebase UID with a single document get.
+
+    Returns:
+        str | None: The client document ID, or None if the UID is not indexed.
+    """
+    snapshot = uid_index_ref(firebase_uid).get(transaction=transaction)
+    return snapshot.to_dict().get('client_id') if snapshot.exists else None
+
+def index_uid(transaction, firebase_uid, client_id):
+    """Point a Firebase UID at a client inside an open transaction (or batch)."""
+    transaction.set(uid_index_ref(firebase_uid), {
+        'client_id': client_id,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
+
+def unindex_uid(transaction, firebase_uid):
+    """
+    Remove a Firebase UID from the index inside an open transaction.
+
+    Only call this after reading the entry in the same transaction and
+    checking it still points at the client being changed.
+    """
+    transaction.delete(uid_index_ref(firebase_uid))
+
+def backfill_uid_index(dry_run=False):
+    """
+    One-off tool: build uid_index from the firebase_uid of 'clients'.
+
+    UIDs linked to several profiles are logged and left unindexed (login
+    falls back to the first profile found, as before the index).
+
+    Returns:
+        dict: Summary counters of the run.
+    """
+    owners = {}
+    for doc in db.collection('clients').stream():
+        firebase_uid = doc.to_dict().get('firebase_uid')
+        if firebase_uid:
+            owners.setdefault(firebase_uid, []).append(doc.id)
+
+    summary = {'indexed': 0, 'conflicts': 0}
+    batch = db.batch()
+    pending = 0
+    for firebase_uid, client_ids in owners.items():
+        if len(client_ids) > 1:
+            logging.warning(f"CONFLICT: UID {firebase_uid} is linked to several clients: {sorted(client_ids)}")
+            summary['conflicts'] += 1
+            continue
+        index_uid(batch, firebase_uid, client_ids[0])
+        summary['indexed'] += 1
+        pending += 1
+        if pending >= 450:
+            if not dry_run:
+                batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending and not dry_run:
+        batch.commit()
+    return summary
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not db:
+        print("Firestore not initialized. Aborting backfill.")
+    else:
+        dry_run = '--dry-run' in sys.argv
+        print(f"Backfilling UID index{' (dry run)' if dry_run else ''}...")
+        print(backfill_uid_index(dry_run=dry_run))
+        print("Backfill finished.")
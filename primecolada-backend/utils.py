@@ -1,80 +1,119 @@
+import base64
+import json
 import logging
+from datetime import datetime
 from google.cloud import firestore
 from db import db
+from phone_index import lookup_client_id, index_phone, normalize_phone, legacy_phone_forms, PHONE_INDEX_COLLECTION
+
+@firestore.transactional
+def _resolve_client_by_phone_txn(transaction, telefono, nombre):
+    clients_collection = db.collection('clients')
+
+    client_id = lookup_client_id(telefono, transaction=transaction)
+    if client_id:
+        return client_id, False
+
+    # Clientes anteriores al índice (en cualquiera de sus formatos): se indexan al encontrarlos
+    legacy = list(transaction.get(clients_collection.where('telefono', 'in', legacy_phone_forms(telefono)).limit(1)))
+    if legacy:
+        index_phone(transaction, telefono, legacy[0].id)
+        return legacy[0].id, False
+
+    new_client_ref = clients_collection.document()
+    transaction.set(new_client_ref, {
+        'nombre': nombre,
+        'telefono': str(telefono),
+        'firebase_uid': None,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'total_ventas': 0,
+        'gasto_total': 0,
+        'last_purchase_date': None
+    })
+    index_phone(transaction, telefono, new_client_ref.id)
+    return new_client_ref.id, True
 
 def get_or_create_client_by_phone(telefono, nombre):
     """
     Searches for a client by phone.
     - If found: Returns the existing Document ID.
     - If not found: Creates a 'Shadow User' (no firebase_uid) and returns new ID.
+
+    Lookup and creation run in one transaction over phone_index, so two
+    concurrent requests for a new phone can never create two clients.
     """
     if not db:
         raise Exception("Firestore not initialized")
 
-    clients_collection = db.collection('clients')
-    query = clients_collection.where('telefono', '==', str(telefono)).limit(1)
-    results = list(query.stream())
-
-    if results:
-        doc_id = results[0].id
-        logging.info(f"Existing client found for phone {telefono}: {doc_id}")
-        return doc_id
+    doc_id, created = _resolve_client_by_phone_txn(db.transaction(), telefono, nombre)
+    if created:
+        logging.info(f"Shadow User created: {doc_id} for phone {telefono}")
     else:
-        new_client_data = {
-            'nombre': nombre,
-            'telefono': str(telefono),
-            'firebase_uid': None,
-            'created_at': firestore.SERVER_TIMESTAMP
-        }
-        update_time, doc_ref = clients_collection.add(new_client_data)
-        logging.info(f"Shadow User created: {doc_ref.id} for phone {telefono}")
-        return doc_ref.id
+        logging.info(f"Existing client found for phone {telefono}: {doc_id}")
+    return doc_id
+
+def resolve_clients_by_phone(entries):
+    """
+    Resolve (or create) the clients of many ventas at once.
+
+    Phones are deduplicated after normalization; already indexed phones are
+    resolved with a single get_all and only the unknown ones go through
+    get_or_create_client_by_phone.
 
-def merge_shadow_user(firebase_uid, telefono):
+    Args:
+        entries: Iterable of (telefono, nombre) pairs. Phones must already be
+            valid for normalize_phone.
+
+    Returns:
+        dict: {normalized phone: client ID, or the Exception raised resolving it}.
+    """
+    if not db:
+        raise Exception("Firestore not initialized")
+
+    pending = {}
+    for telefono, nombre in entries:
+        pending.setdefault(normalize_phone(telefono), (telefono, nombre))
+
+    resolved = {}
+    index_collection = db.collection(PHONE_INDEX_COLLECTION)
+    if pending:
+        for snapshot in db.get_all([index_collection.document(phone) for phone in pending]):
+            if snapshot.exists:
+                resolved[snapshot.id] = snapshot.to_dict().get('client_id')
+
+    for phone, (telefono, nombre) in pending.items():
+        if phone in resolved:
+            continue
+        try:
+            resolved[phone] = get_or_create_client_by_phone(telefono, nombre)
+        except Exception as e:
+            logging.error(f"Resolution failed for phone {telefono}: {e}")
+            resolved[phone] = e
+    return resolved
+
+def encode_page_token(created_at, doc_id):
     """
-    Intenta fusionar un usuario autenticado (firebase_uid) con un perfil sombra existente.
-    
-    Retorna:
-        - (str) ID del documento sombra reclamado (si hubo fusión).
-        - None (si no se encontró sombra o no era necesaria fusión).
+    Build an opaque cursor pointing right after the given venta.
+    The cursor matches the (created_at DESC, __name__ DESC) ordering of paged listings.
     """
-    if not db or not telefono:
-        return None
+    payload = json.dumps({'created_at': created_at.isoformat(), 'id': doc_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
 
-    clients_collection = db.collection('clients')
-    
-    # Buscamos si existe un perfil sombra con este teléfono
-    # CRÍTICO: Debe ser un perfil que NO tenga firebase_uid asignado (o sea null)
-    # Pero Firestore query con '== None' puede ser tricky, mejor buscamos por telefono y filtramos en código
-    # para asegurar que no robamos la cuenta a otro usuario registrado.
-    
-    query = clients_collection.where('telefono', '==', str(telefono)).limit(1)
-    results = list(query.stream())
-    
-    if results:
-        shadow_doc = results[0]
-        shadow_data = shadow_doc.to_dict()
-        current_owner = shadow_data.get('firebase_uid')
-
-        # REGLA ESTRICTA DE SEGURIDAD:
-        # 1. Si el perfil encontrado tiene un `firebase_uid`...
-        # 2. ...Y ese `firebase_uid` NO es el del usuario que hace la petición...
-        # 3. ...Se aborta la operación para evitar robo de identidad.
-        if current_owner and current_owner != firebase_uid:
-            logging.warning(f"SECURITY ALERT: User {firebase_uid} attempted to claim phone number {telefono} already owned by {current_owner}.")
-            return None  # Abortar
-
-        # Si el perfil no tiene dueño (es un "Shadow User"), lo reclamamos.
-        if not current_owner:
-            clients_collection.document(shadow_doc.id).update({
-                'firebase_uid': firebase_uid,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
-            logging.info(f"MERGE SUCCESS: User {firebase_uid} claimed Shadow profile {shadow_doc.id}")
-            return shadow_doc.id
-        
-        # Si el `firebase_uid` es el nuestro, la operación es idempotente.
-        # Simplemente retornamos el ID correcto.
-        return shadow_doc.id
-            
-    return None
\ No newline at end of file
+def decode_page_token(token):
+    """
+    Inverse of encode_page_token.
+
+    Returns:
+        dict: Cursor values ready for Query.start_after.
+
+    Raises:
+        ValueError: If the token is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+        return {
+            'created_at': datetime.fromisoformat(payload['created_at']),
+            '__name__': payload['id']
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page_token: {e}")
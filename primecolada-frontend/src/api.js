@@ -45,13 +45,36 @@ export const clientsApi = {
   login: (data) => apiClient.post('/clients/login', data),
 };
 
+// Campos que necesitan los listados (sin historial_estados)
+export const VENTA_LIST_FIELDS = 'client_id,nombre,telefono,estado_actual,coste,created_at,updated_at';
+const VENTAS_PAGE_SIZE = 50;
+
 export const ventasApi = {
   getAll: (clientId = null) => {
     const params = clientId ? { client_id: clientId } : {};
     return apiClient.get('/ventas', { params });
   },
+  getPage: ({ clientId = null, limit = VENTAS_PAGE_SIZE, pageToken = null, fields = VENTA_LIST_FIELDS } = {}) => {
+    const params = { limit };
+    if (clientId) params.client_id = clientId;
+    if (pageToken) params.page_token = pageToken;
+    if (fields) params.fields = fields;
+    return apiClient.get('/ventas', { params });
+  },
+  // Recorre todas las páginas; onPage recibe cada página según llega
+  streamAll: async (onPage, options = {}) => {
+    let pageToken = null;
+    do {
+      const response = await ventasApi.getPage({ ...options, pageToken });
+      onPage(response.data.ventas);
+      pageToken = response.data.next_page_token;
+    } while (pageToken);
+  },
   getById: (id) => apiClient.get(`/ventas/${id}`),
-  create: (venta) => apiClient.post('/ventas', venta),
+  // La misma clave en los reintentos: el backend devuelve la venta ya creada
+  create: (venta, idempotencyKey = null) => apiClient.post('/ventas', venta, {
+    headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+  }),
   update: (id, venta) => apiClient.put(`/ventas/${id}`, venta),
   delete: (id) => apiClient.delete(`/ventas/${id}`),
   countByStatus: () => apiClient.get('/ventas/count'),
@@ -59,6 +82,69 @@ export const ventasApi = {
   getPublicStatus: (id) => apiClient.get(`/public/ventas/${id}`),
 };
 
+const EVENTS_RETRY_MS = 3000;
+
+// Suscripción a GET /ventas/events (Server-Sent Events). Se usa fetch en lugar
+// de EventSource porque este no permite enviar la cabecera Authorization.
+// onEvent recibe cada diff {id, type, estado_actual, updated_at, venta}; onReset se
+// llama cuando el servidor no puede reproducir lo perdido y hay que recargar.
+// Devuelve una función que cierra la suscripción.
+export const subscribeVentaEvents = (onEvent, onReset) => {
+  const controller = new AbortController();
+  let lastEventId = null;
+  let retryMs = EVENTS_RETRY_MS;
+
+  const dispatch = (frame) => {
+    let eventType = 'message';
+    let data = '';
+    for (const line of frame.split('\n')) {
+      if (line.startsWith(':')) continue;
+      const [field, ...rest] = line.split(':');
+      const value = rest.join(':').replace(/^ /, '');
+      if (field === 'id') lastEventId = value;
+      else if (field === 'event') eventType = value;
+      else if (field === 'data') data += value;
+      else if (field === 'retry') retryMs = parseInt(value, 10) || retryMs;
+    }
+    if (eventType === 'venta') onEvent(JSON.parse(data));
+    else if (eventType === 'reset') onReset();
+  };
+
+  const connect = async () => {
+    while (!controller.signal.aborted) {
+      try {
+        const headers = { Accept: 'text/event-stream' };
+        const user = auth.currentUser;
+        if (user) headers.Authorization = `Bearer ${await user.getIdToken()}`;
+        if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+
+        const response = await fetch(`${API_BASE_URL}/ventas/events`, { headers, signal: controller.signal });
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const frames = buffer.split('\n\n');
+          buffer = frames.pop();
+          frames.forEach(dispatch);
+        }
+      } catch (error) {
+        if (controller.signal.aborted) return;
+        console.error('Error en el stream de eventos de ventas:', error);
+      }
+      // El servidor cierra la conexión periódicamente: reconectamos y reanudamos
+      await new Promise((resolve) => setTimeout(resolve, retryMs));
+    }
+  };
+
+  connect();
+  return () => controller.abort();
+};
+
 export const userApi = {
   getProfile: () => apiClient.get('/user/profile'),
 };
\ No newline at end of file